@@ -12,6 +12,66 @@ class Environment(BaseSettings):
     algorithm: str
     access_token_expire_minutes: int
 
+    # database driver: asyncpg (async engine) or psycopg2 (sync engine in threadpool)
+    database_async: bool = False
+
+    # connection pool (per server worker): connections kept open, extra connections under load,
+    # seconds waiting for free connection, seconds after which connection is replaced (-1 never),
+    # test connection before use (drops dead connections e.g. after failover)
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    database_pool_timeout: float = 30
+    database_pool_recycle: int = -1
+    database_pool_pre_ping: bool = False
+    # connecting through PgBouncer in transaction pooling mode
+    database_pgbouncer: bool = False
+    # statement and idle in transaction timeouts of connections in ms (0 disables them)
+    database_statement_timeout_ms: int = 0
+    database_idle_in_transaction_timeout_ms: int = 0
+
+    # in-memory food catalog for food endpoints, reloaded when food table changes
+    food_catalog: bool = False
+    food_catalog_refresh_seconds: int = 60
+
+    # time zone of days in date filters when client does not send its own (tz parameter)
+    default_time_zone: str = 'UTC'
+
+    # default and maximum number of items on one page of list endpoints
+    page_size: int = 100
+    page_size_max: int = 1000
+    # rows fetched from server-side cursor at once by streaming responses (?stream=true)
+    stream_batch_size: int = 1000
+
+    # cache of authenticated users (0 seconds disables it), per server worker: update or delete of user
+    # invalidates it only in the worker which served the request, other workers keep it until ttl expires
+    auth_cache_ttl_seconds: int = 10
+    auth_cache_size: int = 10000
+
+    # process pool for password hashing, bcrypt cost of new hashes, rehash old hashes on login
+    password_workers: int = 2
+    password_queue: int = 32
+    bcrypt_rounds: int = 12
+    password_rehash: bool = False
+
+    # thread pool for decoding and resizing uploaded images
+    image_workers: int = 2
+    image_queue: int = 64
+
+    # where images are stored: database (bytea columns) or filesystem (content addressed directory)
+    image_storage: str = 'database'
+    image_storage_path: str = 'images'
+    # max-age of image responses cached by clients (0: client revalidates every time with ETag)
+    image_cache_max_age: int = 0
+
+    # Prometheus metrics at /metrics (latency, status codes, SQL statements and time per request)
+    metrics: bool = False
+
+    # per request profiler: requests with X-Profile header equal to profile_token (empty disables it)
+    # and this fraction of all requests, reports and cProfile stats are written to profile_path
+    profile_token: str = ''
+    profile_sample_rate: float = 0.0
+    profile_path: str = 'profiles'
+
     class Config:
         env_file = ".env"  # Path to .env file
 
@@ -1,27 +1,114 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
 from .config import env
+from .pool import engine_options, set_local_timeouts
 
 # code for session establishment with database
 SQLALCHEMY_DATABASE_URL = f'postgresql://{env.database_username}:{env.database_password}@' \
                           f'{env.database_hostname}:{env.database_port}/{env.database_name}'
+SQLALCHEMY_ASYNC_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace('postgresql://', 'postgresql+asyncpg://', 1)
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(asyncpg=False))
+set_local_timeouts(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=True, bind=engine)
 Base = declarative_base()
 
+# async engine is only created when selected in config (DATABASE_ASYNC=true)
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URL, **engine_options(asyncpg=True)) \
+    if env.database_async else None
+if async_engine is not None:
+    set_local_timeouts(async_engine.sync_engine)
+AsyncSessionLocal = sessionmaker(bind=async_engine, class_=AsyncSession, autocommit=False, autoflush=True,
+                                 expire_on_commit=False) if env.database_async else None
 
-def get_db():
-    db = SessionLocal()
+
+class ThreadpoolResult:
+    """
+    Awaitable wrapper around sync Result of server-side cursor, every fetch of a batch runs in the threadpool.
+    Same methods as AsyncResult that streaming responses use.
+    """
+
+    def __init__(self, result):
+        self.result = result
+
+    def scalars(self):
+        return ThreadpoolResult(self.result.scalars())
+
+    async def partitions(self, size=None):
+        batches = self.result.partitions(size)
+        while True:
+            batch = await run_in_threadpool(next, batches, None)
+            if batch is None:
+                return
+            yield batch
+
+    async def close(self):
+        await run_in_threadpool(self.result.close)
+
+
+class ThreadpoolSession:
+    """
+    Awaitable wrapper around sync Session, every database round-trip runs in the threadpool.
+    Exposes the same methods as AsyncSession that routers use, so handlers are same for both drivers.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    def add(self, instance):
+        self.session.add(instance)
+
+    async def execute(self, statement, *args, **kwargs):
+        return await run_in_threadpool(self.session.execute, statement, *args, **kwargs)
+
+    async def stream(self, statement, *args, execution_options=None, **kwargs):
+        # rows are fetched from server-side cursor, as AsyncSession.stream does
+        execution_options = {**(execution_options or {}), 'stream_results': True}
+        return ThreadpoolResult(await run_in_threadpool(self.session.execute, statement, *args,
+                                                        execution_options=execution_options, **kwargs))
+
+    async def scalar(self, statement, *args, **kwargs):
+        return await run_in_threadpool(self.session.scalar, statement, *args, **kwargs)
+
+    async def get(self, entity, ident, **kwargs):
+        return await run_in_threadpool(self.session.get, entity, ident, **kwargs)
+
+    async def flush(self):
+        await run_in_threadpool(self.session.flush)
+
+    async def commit(self):
+        await run_in_threadpool(self.session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.session.close)
+
+
+def pool_stats() -> dict:  # gauges of connection pool of selected driver
+    return (async_engine.sync_engine if env.database_async else engine).pool.stats()
+
+
+def new_session():  # session for selected driver
+    if env.database_async:
+        return AsyncSessionLocal()
+    return ThreadpoolSession(SessionLocal(expire_on_commit=False))
+
+
+async def get_db():
+    db = new_session()
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
 
 
 def ws_get_db():
-    db = SessionLocal()
+    db = new_session()
     try:
         return db
     except Exception:
@@ -0,0 +1,55 @@
+from fastapi import HTTPException, Query, status
+from dateutil import parser, tz
+from datetime import datetime, time, timedelta
+from typing import Optional
+
+from .config import env
+
+# Date range filters of list endpoints
+# Days are converted to half-open timestamp ranges [start of first day, start of day after last day)
+# in time zone of client, so the time column is compared directly and index on it can be used.
+
+ex_unknownTimeZone = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown time zone")
+
+
+class DateRange:
+    """
+    Date range query parameters shared by list endpoints:
+    - Optional **date**: single day
+    - Optional **from**: first day of range
+    - Optional **to**: last day of range (included)
+    - Optional **tz**: time zone of client, e.g. Europe/Bratislava (days start at midnight in it)
+    """
+
+    def __init__(self, date: Optional[str] = None, from_: Optional[str] = Query(None, alias='from'),
+                 to: Optional[str] = None, tz_name: Optional[str] = Query(None, alias='tz')):
+        self.zone = tz.gettz(tz_name or env.default_time_zone)
+        if self.zone is None:
+            raise ex_unknownTimeZone
+
+        self.valid = True
+        if date:    # single day is range from and to the same day
+            from_, to = date, date
+
+        self.first = self.parse(from_)
+        self.last = self.parse(to)
+
+    def parse(self, value: Optional[str]):
+        if not value:
+            return None
+        try:
+            return parser.parse(value).date()
+        except Exception:   # not a date, range matches nothing
+            self.valid = False
+            return None
+
+    def start(self, day) -> datetime:  # midnight of day in client's time zone
+        return datetime.combine(day, time.min, tzinfo=self.zone)
+
+    def where(self, column) -> list:  # sargable conditions on timestamp column (column >= start AND column < end)
+        conditions = []
+        if self.first is not None:
+            conditions.append(column >= self.start(self.first))
+        if self.last is not None:
+            conditions.append(column < self.start(self.last + timedelta(days=1)))
+        return conditions
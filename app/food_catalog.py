@@ -0,0 +1,235 @@
+from sqlalchemy import select, text
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+from array import array
+from loguru import logger
+
+from . import models, database
+from .config import env
+from .pagination import encode_cursor
+
+import asyncio
+import bisect
+import re
+
+# In-memory copy of food table for searching without database (enabled by FOOD_CATALOG=true)
+# Food table is read on every search keystroke, but almost never written.
+
+WORD_SPLIT = re.compile(r'[^\w]+')
+
+# fingerprint of food table content: number of rows and newest row version (xmin of inserted or updated row),
+# changes on every insert, update or delete (statistics counters are reported late and can be reset)
+FINGERPRINT_QUERY = text("SELECT count(*), max(xmin::text::bigint) FROM food")
+
+
+def substrings(value: str, n: int = 3) -> set:  # every n-character substring of value
+    return {value[i:i + n] for i in range(len(value) - n + 1)}
+
+
+def trigrams(value: str) -> set:  # trigrams as in pg_trgm (every word padded with spaces)
+    grams = set()
+    for word in WORD_SPLIT.split(value):
+        if word:
+            grams.update(word_trigrams(word))
+    return grams
+
+
+def word_trigrams(word: str) -> list:  # ordered trigrams of one padded word
+    padded = f"  {word} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def similarity(a: set, b: set) -> float:  # same as pg_trgm similarity() for trigram sets
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class CatalogSnapshot:
+    """
+    Immutable, array backed copy of food table with trigram indexes.
+    Row data are stored in parallel arrays, index maps every 3 characters of lowered title
+    to sorted array of row positions (substring search), grams maps pg_trgm trigrams (padded words)
+    to row positions (ranking candidates and fuzzy search).
+    """
+
+    def __init__(self, rows, fingerprint=None):
+        rows = sorted(rows, key=lambda row: row[0])
+        self.fingerprint = fingerprint
+        self.ids = array('i', (row[0] for row in rows))
+        self.titles = [row[1] for row in rows]
+        self.kcal = array('d', (row[2] for row in rows))
+        self.lowered = [title.lower() for title in self.titles]
+        self.positions = {food_id: pos for pos, food_id in enumerate(self.ids)}
+
+        index, grams = {}, {}
+        for pos, title in enumerate(self.lowered):
+            for gram in substrings(title):
+                index.setdefault(gram, []).append(pos)
+            for gram in trigrams(title):
+                grams.setdefault(gram, []).append(pos)
+        self.index = {gram: array('i', positions) for gram, positions in index.items()}
+        self.grams = {gram: array('i', positions) for gram, positions in grams.items()}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, pos: int) -> dict:
+        return {'id': self.ids[pos], 'title': self.titles[pos], 'kcal_100g': self.kcal[pos]}
+
+    def get(self, food_id: int) -> Optional[dict]:
+        pos = self.positions.get(food_id)
+        return None if pos is None else self.row(pos)
+
+    def candidates(self, title: str, title_grams: set, fuzzy: bool):
+        """
+        Positions of foods to rank. Fuzzy matches and matches of titles shorter than 3 characters
+        are foods sharing a pg_trgm trigram with title (others have zero similarities),
+        substring matches contain every 3 characters of title.
+        """
+
+        if fuzzy or len(title) < 3:
+            found = set()
+            for gram in title_grams:
+                found.update(self.grams.get(gram, ()))
+            return found
+
+        postings = sorted((self.index.get(gram, ()) for gram in substrings(title)), key=len)
+        found = set(postings[0])    # substring has to contain every trigram, start with the rarest one
+        for positions in postings[1:]:
+            if not found:
+                break
+            found.intersection_update(positions)
+        return found
+
+    def zero_matches(self, title: str, ranked: set, after_id: Optional[int], limit: Optional[int]) -> list:
+        # substring matches of short title without shared trigram (zero similarities) after id, in id order
+        start = 0 if after_id is None else bisect.bisect_right(self.ids, after_id)
+        found = []
+        for pos in range(start, len(self)):
+            if pos not in ranked and title in self.lowered[pos]:
+                found.append((0.0, 0.0, self.ids[pos], pos))
+                if limit is not None and len(found) >= limit:
+                    break
+        return found
+
+    def word_similarity(self, title_grams: set, pos: int, words: Optional[dict] = None) -> float:
+        """
+        Like pg_trgm word_similarity(): best similarity between searched trigrams and
+        any continuous extent of trigrams of one word in food title.
+        Words repeat across titles, words caches their similarities during one search.
+        """
+
+        best = 0.0
+        for word in WORD_SPLIT.split(self.lowered[pos]):
+            word_sim = words.get(word) if words is not None else None
+            if word_sim is None:
+                word_sim = 0.0
+                grams = word_trigrams(word)
+                for start in range(len(grams)):
+                    if grams[start] not in title_grams:    # best extents start and end with shared trigram
+                        continue
+                    for end in range(len(grams), start, -1):
+                        if grams[end - 1] in title_grams:
+                            word_sim = max(word_sim, similarity(title_grams, set(grams[start:end])))
+                if words is not None:
+                    words[word] = word_sim
+            best = max(best, word_sim)
+        return best
+
+    def search(self, title: str = '', fuzzy: bool = False, limit: Optional[int] = None,
+               after: Optional[tuple] = None, total: bool = False):
+        """
+        Same semantics as search_food in food router: substring or fuzzy (similar words) match,
+        results are ranked by similarity, empty title returns every food ordered by id.
+        Returns page of foods, cursor of next page and total count (if requested).
+        """
+
+        if title == '':
+            start = 0 if after is None else bisect.bisect_right(self.ids, after[0])
+            end = len(self) if limit is None else min(start + limit, len(self))
+            next_cursor = encode_cursor(self.ids[end - 1]) if end < len(self) else None
+            return [self.row(pos) for pos in range(start, end)], next_cursor, len(self) if total else None
+
+        title = title.lower()
+        title_grams = trigrams(title)
+        ranked, words = [], {}
+
+        for pos in self.candidates(title, title_grams, fuzzy):
+            if not fuzzy and title not in self.lowered[pos]:
+                continue
+            word_sim = self.word_similarity(title_grams, pos, words)  # first sort key in both modes, as in database
+            if fuzzy and word_sim < 0.6:  # pg_trgm.word_similarity_threshold default
+                continue
+            ranked.append((-word_sim, -similarity(title_grams, trigrams(self.lowered[pos])), self.ids[pos], pos))
+
+        ranked.sort()
+        short = not fuzzy and len(title) < 3    # matches without shared trigram follow ranked ones by id
+        count = (sum(title in lowered for lowered in self.lowered) if short else len(ranked)) if total else None
+        ranked_positions = {item[3] for item in ranked} if short else None
+
+        if after is not None:   # skip to first item after cursor (word similarity, similarity, id)
+            ranked = ranked[bisect.bisect_right(ranked, (-after[0], -after[1], after[2], len(self))):]
+
+        if short and (limit is None or len(ranked) <= limit):
+            after_id = after[2] if after is not None and after[0] == 0 and after[1] == 0 else None
+            ranked += self.zero_matches(title, ranked_positions, after_id,
+                                        None if limit is None else limit + 1 - len(ranked))
+
+        next_cursor = None
+        if limit is not None and len(ranked) > limit:
+            ranked = ranked[:limit]
+            next_cursor = encode_cursor(-ranked[-1][0], -ranked[-1][1], ranked[-1][2])
+
+        return [self.row(item[3]) for item in ranked], next_cursor, count
+
+
+class FoodCatalog:
+    """
+    Holds current snapshot of food table and refreshes it in background.
+    Snapshot is replaced as whole, so readers never see partially loaded catalog.
+    """
+
+    def __init__(self):
+        self.snapshot: Optional[CatalogSnapshot] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.snapshot is not None
+
+    async def load(self, force: bool = False):
+        db = database.new_session()
+        try:
+            fingerprint = tuple((await db.execute(FINGERPRINT_QUERY)).one())
+            if not force and self.snapshot is not None and fingerprint == self.snapshot.fingerprint:
+                return  # nothing changed
+
+            rows = (await db.execute(select(models.Food.id, models.Food.title, models.Food.kcal_100g))).all()
+        finally:
+            await db.close()
+
+        self.snapshot = await run_in_threadpool(CatalogSnapshot, rows, fingerprint)
+        logger.info(f"Food catalog loaded, {len(self.snapshot)} foods")
+
+    async def refresher(self):
+        # food table is written only by tools outside the server (import_foods), changes are found by fingerprint
+        while True:
+            await asyncio.sleep(env.food_catalog_refresh_seconds)
+
+            try:
+                await self.load()
+            except Exception as e:  # keep serving old snapshot when database is not available
+                logger.warning(f"Food catalog refresh failed: {e}")
+
+    async def start(self):
+        await self.load(force=True)
+        self.task = asyncio.create_task(self.refresher())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+catalog = FoodCatalog()
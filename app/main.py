@@ -1,9 +1,30 @@
-from fastapi import FastAPI
-from .routers import food, foodlist, recipes, users, auth, weight_measurement
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import DBAPIError, OperationalError, TimeoutError as PoolTimeoutError
+from .routers import food, foodlist, recipes, users, auth, weight_measurement, stats
 from .metadata import tags_metadata
+from .food_catalog import catalog
+from .config import env
+from .workers import password_pool, image_pool, ex_serverBusy
+from .utils import pg_error_code
+from .uploads import UploadSizeLimit
+from .metrics import MetricsMiddleware, TimedJSONResponse, instrument_engine, metrics_endpoint
+from .profiler import ProfilerMiddleware, profiling_enabled
+from . import database
 
 
-app = FastAPI(openapi_tags=tags_metadata)
+measured = env.metrics or profiling_enabled()  # nothing is measured when metrics and profiler are disabled
+
+app = FastAPI(openapi_tags=tags_metadata, default_response_class=TimedJSONResponse if measured else JSONResponse)
+app.add_middleware(UploadSizeLimit)     # early 413 for too large uploads
+
+if measured:
+    instrument_engine(database.async_engine.sync_engine if env.database_async else database.engine)
+if profiling_enabled():
+    app.add_middleware(ProfilerMiddleware)
+if env.metrics:     # outermost, so profiled requests are measured too
+    app.add_middleware(MetricsMiddleware)
+    app.add_api_route("/metrics", metrics_endpoint, include_in_schema=False)
 
 # Routers
 app.include_router(auth.router)
@@ -12,6 +33,37 @@ app.include_router(food.router)
 app.include_router(foodlist.router)
 app.include_router(weight_measurement.router)
 app.include_router(recipes.router)
+if env.metrics:     # internal statistics, same access as /metrics
+    app.include_router(stats.router)
+
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, e: PoolTimeoutError):    # no free database connection in time
+    return JSONResponse({'detail': ex_serverBusy.detail}, status_code=ex_serverBusy.status_code,
+                        headers=ex_serverBusy.headers)
+
+
+@app.exception_handler(DBAPIError)
+async def database_error_handler(request: Request, e: DBAPIError):
+    # statement timeout (query canceled) or lost connection is temporary, other database errors stay 500
+    if isinstance(e, OperationalError) or pg_error_code(e) == '57014':
+        return JSONResponse({'detail': ex_serverBusy.detail}, status_code=ex_serverBusy.status_code,
+                            headers=ex_serverBusy.headers)
+    raise e
+
+
+@app.on_event("startup")
+async def startup():
+    if env.food_catalog:    # load food catalog to memory
+        await catalog.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await catalog.stop()
+    password_pool.shutdown()
+    image_pool.shutdown()
+
 
 # root for basic response (so not "not found" will be shown)
 @app.get("/")
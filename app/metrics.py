@@ -0,0 +1,216 @@
+from contextvars import ContextVar
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from starlette.responses import Response
+from typing import Dict, Optional, Sequence, Tuple
+
+from .database import pool_stats
+
+import time
+
+# Prometheus metrics (enabled by METRICS=true): middleware measures every request, engine events add
+# SQL statements and database time of the request, JSON render time is added by TimedJSONResponse.
+# Request data are collected in RequestStats of request context, so no locking is needed
+# (it is shared with the profiler, see profiler.py).
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class RequestStats:  # database and serialization work of one request
+    __slots__ = ('statements', 'db_time', 'render_time', 'auth_time', 'queries')
+
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.auth_time = 0.0
+        self.queries: Optional[list] = None    # (statement, seconds) of every statement, only when profiled
+
+
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar('request_stats', default=None)
+
+
+def escape(value: str) -> str:  # label value in Prometheus text format
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def label_pairs(names: Sequence[str], values: Tuple[str, ...]) -> str:
+    return ','.join(f'{name}="{escape(str(value))}"' for name, value in zip(names, values))
+
+
+class Counter:
+    def __init__(self, name: str, description: str, labels: Sequence[str]):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, labels: tuple, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{{{label_pairs(self.labels, labels)}}} {value}" for labels, value in self.values.items()]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.values: Dict[tuple, list] = {}   # labels -> [count in every bucket (not cumulative), sum, count]
+
+    def observe(self, labels: tuple, value: float):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in self.values.items():
+            pairs = label_pairs(self.labels, labels)
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f'{self.name}_bucket{{{pairs},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{pairs},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{pairs}}} {total}")
+            lines.append(f"{self.name}_count{{{pairs}}} {count}")
+        return lines
+
+
+http_requests = Counter('http_requests_total', 'Finished HTTP requests.', ('method', 'route', 'status'))
+http_latency = Histogram('http_request_duration_seconds', 'Time of HTTP request until response was sent.',
+                         ('method', 'route'), LATENCY_BUCKETS)
+db_statements = Histogram('http_request_db_statements', 'SQL statements executed by HTTP request.',
+                          ('method', 'route'), STATEMENT_BUCKETS)
+db_time = Histogram('http_request_db_seconds', 'Time of SQL statements of HTTP request.',
+                    ('method', 'route'), LATENCY_BUCKETS)
+render_time = Histogram('http_request_render_seconds', 'Time of rendering JSON response body.',
+                        ('method', 'route'), LATENCY_BUCKETS)
+ws_messages = Counter('websocket_messages_total', 'WebSocket messages received and sent.', ('route', 'direction'))
+
+METRICS = (http_requests, http_latency, db_statements, db_time, render_time, ws_messages)
+
+
+def route_name(scope) -> str:  # path template of matched route, so label values are bounded
+    endpoint = scope.get('endpoint')
+    if endpoint is None:
+        return 'unmatched'
+    for route in scope['app'].routes:
+        if getattr(route, 'endpoint', None) is endpoint:
+            return route.path
+    return 'unmatched'
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency and status of HTTP requests and number of WebSocket messages.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.routes = {}    # endpoint -> route path
+
+    def route(self, scope) -> str:
+        endpoint = scope.get('endpoint')
+        name = self.routes.get(endpoint)
+        if name is None:
+            name = self.routes[endpoint] = route_name(scope)
+        return name
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'websocket':
+            return await self.websocket(scope, receive, send)
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def measured_send(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, measured_send)
+        finally:
+            request_stats.reset(token)
+            labels = (scope['method'], self.route(scope))
+            http_requests.inc(labels + (str(status_code),))
+            http_latency.observe(labels, time.perf_counter() - start)
+            db_statements.observe(labels, stats.statements)
+            db_time.observe(labels, stats.db_time)
+            if stats.render_time:
+                render_time.observe(labels, stats.render_time)
+
+    async def websocket(self, scope, receive, send):
+        async def counted_receive():
+            message = await receive()
+            if message['type'] == 'websocket.receive':
+                ws_messages.inc((self.route(scope), 'received'))
+            return message
+
+        async def counted_send(message):
+            if message['type'] == 'websocket.send':
+                ws_messages.inc((self.route(scope), 'sent'))
+            await send(message)
+
+        await self.app(scope, counted_receive, counted_send)
+
+
+class TimedJSONResponse(JSONResponse):  # default response class when metrics are enabled
+    def render(self, content) -> bytes:
+        stats = request_stats.get()
+        if stats is None:
+            return super().render(content)
+
+        start = time.perf_counter()
+        body = super().render(content)
+        stats.render_time += time.perf_counter() - start
+        return body
+
+
+def instrument_engine(engine):
+    # counts statements and their time for request in context (sync engine, or sync_engine of async engine)
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = request_stats.get()
+        if stats is not None:
+            elapsed = time.perf_counter() - context._metrics_start
+            stats.statements += 1
+            stats.db_time += elapsed
+            if stats.queries is not None:
+                stats.queries.append((statement, elapsed))
+
+
+def render_pool() -> list:  # gauges of database connection pool
+    lines = []
+    for name, value in pool_stats().items():
+        lines += [f"# TYPE db_pool_{name} gauge", f"db_pool_{name} {value}"]
+    return lines
+
+
+async def metrics_endpoint():
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += render_pool()
+    return Response('\n'.join(lines) + '\n', media_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,8 +1,8 @@
-from sqlalchemy import Column, ForeignKey, SmallInteger, Integer, Float, String, Text, Boolean, LargeBinary
-from sqlalchemy import CheckConstraint, UniqueConstraint
+from sqlalchemy import Column, ForeignKey, SmallInteger, Integer, Float, String, Text, Boolean, LargeBinary, Date
+from sqlalchemy import CheckConstraint, UniqueConstraint, Index, func
 from sqlalchemy.sql.sqltypes import TIMESTAMP
 from sqlalchemy.sql.expression import text
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 
 from .database import Base
 
@@ -15,7 +15,10 @@ class User(Base):
     id = Column(Integer, primary_key=True, nullable=False)
     email = Column(String, nullable=False, unique=True)
     password = Column(String, nullable=False)
-    profile_picture = Column(LargeBinary, nullable=True)
+    profile_picture = deferred(Column(LargeBinary, nullable=True))    # loaded only when accessed or selected
+    profile_picture_key = Column(String(64), nullable=True)     # sha256 of picture, file name in image storage
+    profile_picture_type = Column(String(32), nullable=True)    # MIME type of picture
+    profile_picture_updated_at = Column(TIMESTAMP(timezone=True), nullable=True)
     first_name = Column(String(50), nullable=False)
     last_name = Column(String(50), nullable=False)
     gender = Column(SmallInteger, nullable=False)
@@ -53,6 +56,11 @@ class Weightmeasure(Base):
     __tableargs__ = (CheckConstraint('weight > 0', name='positive_weight'),)
 
 
+# measurements of user in date range, ordered by time (keyset pagination)
+Index('idx_weightmeasurements_id_user_measure_time', Weightmeasure.id_user, Weightmeasure.measure_time,
+      Weightmeasure.id)
+
+
 # Foodlist table
 class Foodlist(Base):
     __tablename__ = "foodlist"
@@ -68,6 +76,21 @@ class Foodlist(Base):
     __tableargs__ = (CheckConstraint('amount > 0', name='positive_amount'),)
 
 
+# food list of user in date range, ordered by time (keyset pagination)
+Index('idx_foodlist_id_user_time', Foodlist.id_user, Foodlist.time, Foodlist.id)
+
+
+# Daily totals of food list (rollup), updated with food list in the same transaction
+class DailyIntake(Base):
+    __tablename__ = "daily_intake"
+
+    # Columns
+    id_user = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)    # day of food list time in DEFAULT_TIME_ZONE
+    kcal = Column(Float, nullable=False, server_default=text('0'))
+    entries = Column(Integer, nullable=False, server_default=text('0'))
+
+
 # Food table
 class Food(Base):
     __tablename__ = "food"
@@ -76,6 +99,9 @@ class Food(Base):
     id = Column(Integer, primary_key=True, nullable=False)
     title = Column(String(80), nullable=False)
     kcal_100g = Column(Float, nullable=False)
+    # origin of imported foods (app.tools.import_foods), NULL for foods added by hand
+    source = Column(String(32), nullable=True)
+    external_id = Column(String(64), nullable=True)
 
     # Constrains
     __tableargs__ = (CheckConstraint('kcal_100g > 0', name='positive_kcal_100g_in_food'),
@@ -83,6 +109,14 @@ class Food(Base):
                      )
 
 
+# trigram index for food title search (requires pg_trgm extension)
+Index('idx_food_title_trgm', func.lower(Food.title).label('title_lower'),
+      postgresql_using='gin', postgresql_ops={'title_lower': 'gin_trgm_ops'})
+
+# imported food is identified by its source dataset and id in it (upsert key of imports)
+Index('idx_food_source_external_id', Food.source, Food.external_id, unique=True)
+
+
 # Recipe table
 class Recipe(Base):
     __tablename__ = "recipes"
@@ -90,7 +124,10 @@ class Recipe(Base):
     # Columns
     id = Column(Integer, primary_key=True, nullable=False)
     id_user = Column(Integer, ForeignKey("users.id", ondelete="SET DEFAULT"), server_default=text('0'))
-    recipe_picture = Column(LargeBinary, nullable=True)
+    recipe_picture = deferred(Column(LargeBinary, nullable=True))     # loaded only when accessed or selected
+    recipe_picture_key = Column(String(64), nullable=True)      # sha256 of picture, file name in image storage
+    recipe_picture_type = Column(String(32), nullable=True)     # MIME type of picture
+    recipe_picture_updated_at = Column(TIMESTAMP(timezone=True), nullable=True)
     title = Column(String(80), nullable=False)
     ingredients = Column(Text, nullable=False)
     instructions = Column(Text, nullable=False)
@@ -103,3 +140,15 @@ class Recipe(Base):
     __tableargs__ = (CheckConstraint('kcal_100g >= 0', name='zero_or_positive_kcal_100g'),
                      CheckConstraint('LENGTH(title) >= 2', name='recipe_title_minimum_characters'),
                      )
+
+
+# Derivatives of images (smaller sizes, WebP) created on upload
+class ImageVariant(Base):
+    __tablename__ = "image_variants"
+
+    # Columns
+    image_key = Column(String(64), primary_key=True, nullable=False)    # key of original image
+    variant = Column(String(16), primary_key=True, nullable=False)      # e.g. '256' or '256.webp'
+    variant_key = Column(String(64), nullable=False)    # sha256 of variant, file name in image storage
+    media_type = Column(String(32), nullable=False)
+    data = deferred(Column(LargeBinary, nullable=True))     # null with filesystem image storage
@@ -3,9 +3,15 @@ from fastapi import Depends, status, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from datetime import datetime, timedelta
 from . import database, models
-from .schemas.users import TokenData
-from sqlalchemy.orm import Session
+from .schemas.users import TokenData, UserPrincipal
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from .cache import TTLCache
 from .config import env
+from .metrics import request_stats
+
+import time
 
 # code inspired by this documentation: https://fastapi.tiangolo.com/tutorial/security/simple-oauth2/
 
@@ -22,6 +28,10 @@ SECRET_KEY = env.secret
 ALGORITHM = env.algorithm
 ACCESS_TOKEN_EXPIRE_MINUTES = env.access_token_expire_minutes
 
+# authenticated users by id, has to be invalidated when user is changed or deleted
+principal_cache = TTLCache(maxsize=env.auth_cache_size, ttl=env.auth_cache_ttl_seconds)
+PRINCIPAL_COLUMNS = [getattr(models.User, field) for field in UserPrincipal.__fields__]
+
 
 def create_token(data: dict):  # Data -> JWT payload
     to_encode = data.copy()
@@ -60,17 +70,45 @@ def wb_verify_token(token: str):
     return token_data
 
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db),
-                     is_wb: bool = False) -> models.User:
-    if is_wb:
-        token = wb_verify_token(token)
-        user = db.query(models.User).filter(models.User.id == token.id).first()
-        if user is None:
-            raise {'status_code': 401, 'detail': "Not authorized to perform requested action"}
-    else:
+async def get_user_principal(user_id: int, db: AsyncSession) -> Optional[UserPrincipal]:
+    # authenticated user from cache, or from database (only columns of UserPrincipal) on cache miss
+    user = principal_cache.get(user_id)
+    if user is not None:
+        return user
+
+    row = (await db.execute(select(*PRINCIPAL_COLUMNS).where(models.User.id == user_id))).first()
+    if row is None:
+        return None
+
+    user = UserPrincipal.from_orm(row)
+    principal_cache.set(user_id, user)
+    return user
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme),
+                           db: AsyncSession = Depends(database.get_db)) -> UserPrincipal:
+    start = time.perf_counter()
+    try:
         token = verify_token(token, ex_validationErr)
-        user = db.query(models.User).filter(models.User.id == token.id).first()
-        if user is None:
-            raise ex_notAuthToPerformAction
+        user = await get_user_principal(int(token.id), db)
+    finally:
+        stats = request_stats.get()
+        if stats is not None:   # measured request (metrics or profiler)
+            stats.auth_time += time.perf_counter() - start
+
+    if user is None:
+        raise ex_notAuthToPerformAction
+
+    return user
+
+
+async def ws_get_current_user(token: str, db: AsyncSession):  # returns user or error message for websocket
+    token = wb_verify_token(token)
+    if not isinstance(token, TokenData):
+        return token
+
+    user = await get_user_principal(int(token.id), db)
+    if user is None:
+        return {'status_code': 401, 'detail': "Not authorized to perform requested action"}
 
     return user
@@ -0,0 +1,124 @@
+from fastapi import HTTPException, Query, Response, status
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from typing import Optional
+from datetime import date, datetime
+
+from .config import env
+
+import base64
+import json
+
+# Keyset (cursor) pagination for list endpoints
+# Cursor is an opaque string holding sort key of the last returned row, next page continues after it.
+
+ex_invalidCursor = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+TOTAL_ESTIMATE_HEADER = 'X-Total-Estimate'
+
+
+class PageParams:
+    """
+    Pagination query parameters shared by list endpoints:
+    - Optional **limit**: maximum number of returned items
+    - Optional **after**: cursor from X-Next-Cursor header of previous page
+    - Optional **total**: include estimated number of all matching items in X-Total-Estimate header
+    """
+
+    def __init__(self, limit: int = Query(env.page_size, ge=1, le=env.page_size_max),
+                 after: Optional[str] = None, total: bool = False):
+        self.limit = limit
+        self.after = after
+        self.total = total
+
+
+def encode_cursor(*values) -> str:
+    values = [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, *types) -> tuple:  # types of sort key columns, e.g. (datetime, int)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if len(values) != len(types):
+            raise ValueError
+        return tuple(value_type.fromisoformat(value) if value_type in (date, datetime) else value_type(value)
+                     for value_type, value in zip(types, values))
+    except Exception:
+        raise ex_invalidCursor
+
+
+class Keyset:
+    """
+    Sort key of paginated query, given as (expression, descending) pairs.
+    Last pair has to be unique (primary key), so the order is total.
+    """
+
+    def __init__(self, *keys):
+        self.keys = keys
+
+    def after(self, values: tuple):  # rows following the row with given sort key values
+        if all(desc == self.keys[0][1] for _, desc in self.keys):  # same direction, use row comparison
+            columns = tuple_(*(expression for expression, _ in self.keys))
+            return columns < tuple_(*values) if self.keys[0][1] else columns > tuple_(*values)
+
+        conditions = []
+        for i, (expression, desc) in enumerate(self.keys):
+            equal = [key[0] == value for key, value in zip(self.keys[:i], values)]
+            conditions.append(and_(*equal, expression < values[i] if desc else expression > values[i]))
+        return or_(*conditions)
+
+    def apply(self, query, limit: int, after: Optional[tuple] = None):
+        """
+        Orders and limits the query, sort key values are added as extra columns.
+        One more row than limit is fetched to find out if there is a next page.
+        """
+
+        query = query.add_columns(*(expression.label(f"sort_key_{i}")
+                                    for i, (expression, _) in enumerate(self.keys)))
+
+        if after is not None:
+            query = query.where(self.after(after))
+
+        return self.order(query).limit(limit + 1)
+
+    def order(self, query):  # query ordered by the sort key, without limit (streamed responses)
+        return query.order_by(*(expression.desc() if desc else expression for expression, desc in self.keys))
+
+    def page(self, rows, limit: int):  # returns items of page and cursor of next page (None on last page)
+        width = len(rows[0]) - len(self.keys) if rows else 0     # number of selected columns without sort key
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(*rows[-1][width:])
+
+        items = [row[0] for row in rows] if width == 1 else rows  # entity or row with columns
+        return items, next_cursor
+
+
+class Explain(Executable, ClauseElement):  # EXPLAIN of a query, returns estimated plan only
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, 'postgresql')
+def compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+async def estimate_count(db, query) -> int:  # planner's row estimate, no rows are read
+    plan = (await db.execute(Explain(query))).scalar()
+    if isinstance(plan, str):   # asyncpg does not decode json
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def set_page_headers(response: Response, next_cursor: Optional[str], total: Optional[int] = None):
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    if total is not None:
+        response.headers[TOTAL_ESTIMATE_HEADER] = str(total)
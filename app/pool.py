@@ -0,0 +1,109 @@
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from .config import env
+
+import threading
+import time
+
+# Connection pool of database engines, configured by DATABASE_POOL_* settings and counting checkouts,
+# so pool exhaustion is visible in /stats/pool before requests start failing with QueuePool limit errors.
+
+
+class PoolStatsMixin:
+    """
+    Counts checkouts of connections: time until connection was handed out (waiting for free connection,
+    connecting of overflow connection, pre-ping) and checkouts which timed out.
+    Sync pool is used from threadpool threads, so counters are updated under lock.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:     # pool_size + max_overflow connections were checked out for pool_timeout
+            with self.stats_lock:
+                self.timeouts += 1
+            raise
+
+        waited = time.perf_counter() - start
+        with self.stats_lock:
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        return connection
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            return {'size': self.size(), 'checked_out': self.checkedout(), 'idle': self.checkedin(),
+                    'overflow': max(self.overflow(), 0), 'max_overflow': self._max_overflow,
+                    'timeout': self._timeout, 'checkouts': self.checkouts, 'timeouts': self.timeouts,
+                    'wait_seconds_total': round(self.wait_total, 6),
+                    'wait_seconds_avg': round(self.wait_total / self.checkouts, 6) if self.checkouts else 0.0,
+                    'wait_seconds_max': round(self.wait_max, 6)}
+
+
+class InstrumentedQueuePool(PoolStatsMixin, QueuePool):  # pool of sync engine (psycopg2)
+    pass
+
+
+class InstrumentedAsyncPool(PoolStatsMixin, AsyncAdaptedQueuePool):  # pool of async engine (asyncpg)
+    pass
+
+
+def session_settings() -> dict:  # server settings of every connection (timeouts in ms, 0 disables them)
+    settings = {}
+    if env.database_statement_timeout_ms > 0:
+        settings['statement_timeout'] = str(env.database_statement_timeout_ms)
+    if env.database_idle_in_transaction_timeout_ms > 0:
+        settings['idle_in_transaction_session_timeout'] = str(env.database_idle_in_transaction_timeout_ms)
+    return settings
+
+
+def connect_args(asyncpg: bool) -> dict:
+    """
+    Driver arguments of connections. Timeouts are sent as startup parameters (no extra round-trip),
+    PgBouncer does not accept them, so in PgBouncer mode they are set per transaction (see set_local_timeouts).
+    asyncpg prepared statements do not survive transaction pooling, so its statement caches are disabled.
+    """
+
+    args = {}
+    settings = session_settings()
+    if env.database_pgbouncer:
+        if asyncpg:
+            args.update(statement_cache_size=0, prepared_statement_cache_size=0)
+    elif settings and asyncpg:
+        args['server_settings'] = settings
+    elif settings:
+        args['options'] = ' '.join(f"-c {name}={value}" for name, value in settings.items())
+    return args
+
+
+def engine_options(asyncpg: bool) -> dict:  # keyword arguments of create_engine / create_async_engine
+    return {'poolclass': InstrumentedAsyncPool if asyncpg else InstrumentedQueuePool,
+            'pool_size': env.database_pool_size, 'max_overflow': env.database_max_overflow,
+            'pool_timeout': env.database_pool_timeout, 'pool_recycle': env.database_pool_recycle,
+            'pool_pre_ping': env.database_pool_pre_ping, 'connect_args': connect_args(asyncpg)}
+
+
+def set_local_timeouts(engine):
+    # PgBouncer mode: server connection changes between transactions, so timeouts are set in every transaction
+    settings = session_settings()
+    if not env.database_pgbouncer or not settings:
+        return
+
+    statements = [f"SET LOCAL {name} = {value}" for name, value in settings.items()]
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        for statement in statements:
+            connection.exec_driver_sql(statement)
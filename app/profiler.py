@@ -0,0 +1,123 @@
+from collections import Counter
+from loguru import logger
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from pathlib import Path
+
+from .config import env
+from .metrics import RequestStats, request_stats
+
+import cProfile
+import hmac
+import json
+import random
+import time
+import uuid
+
+# Per request profiler: request with X-Profile header equal to PROFILE_TOKEN, or sampled with PROFILE_SAMPLE_RATE,
+# gets Server-Timing header and its SQL statements and cProfile stats are saved to PROFILE_PATH
+# (<id>.json report and <id>.prof for snakeviz / flameprof), id is returned in X-Profile-Id header.
+
+N_PLUS_ONE_MIN = 3  # identical statement executed this many times in one request is reported as likely N+1
+
+
+def profiling_enabled() -> bool:
+    return env.profile_token != '' or env.profile_sample_rate > 0
+
+
+def repeated_statements(queries: list) -> list:
+    # statements with same SQL (parameters differ) executed at least N_PLUS_ONE_MIN times, e.g. query per item
+    counts = Counter(statement for statement, _ in queries)
+    return [{'statement': statement, 'count': count} for statement, count in counts.most_common()
+            if count >= N_PLUS_ONE_MIN]
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware profiling selected HTTP requests.
+    cProfile sees only the event loop thread and everything running on it, so at most one request at once
+    is profiled by it, other selected requests get only statements and timing.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.path = Path(env.profile_path)
+        self.cprofile_busy = False
+
+    def selected(self, scope) -> bool:
+        if env.profile_token != '':
+            header = Headers(scope=scope).get('x-profile', '')
+            if header and hmac.compare_digest(header, env.profile_token):
+                return True
+        return env.profile_sample_rate > 0 and random.random() < env.profile_sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.selected(scope):
+            return await self.app(scope, receive, send)
+
+        stats = request_stats.get()
+        token = None
+        if stats is None:   # not measured by metrics middleware
+            stats = RequestStats()
+            token = request_stats.set(stats)
+        stats.queries = []
+
+        profile_id = uuid.uuid4().hex
+        profile = None
+        if not self.cprofile_busy:
+            self.cprofile_busy = True
+            profile = cProfile.Profile()
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def profiled_send(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                total = time.perf_counter() - start
+                timing = server_timing(stats, total)
+                message = {**message, 'headers': list(message.get('headers', [])) + [
+                    (b'server-timing', timing.encode()), (b'x-profile-id', profile_id.encode())]}
+            await send(message)
+
+        try:
+            if profile is not None:
+                profile.enable()
+            await self.app(scope, receive, profiled_send)
+        finally:
+            if profile is not None:
+                profile.disable()
+                self.cprofile_busy = False
+            if token is not None:
+                request_stats.reset(token)
+
+            report = {'id': profile_id, 'method': scope['method'], 'path': scope['path'], 'status': status_code,
+                      'seconds': time.perf_counter() - start, 'auth_seconds': stats.auth_time,
+                      'db_seconds': stats.db_time, 'render_seconds': stats.render_time,
+                      'statements': [{'statement': statement, 'seconds': seconds}
+                                     for statement, seconds in stats.queries],
+                      'n_plus_one': repeated_statements(stats.queries)}
+            if report['n_plus_one']:
+                logger.warning(f"Likely N+1 queries in {scope['method']} {scope['path']} (profile {profile_id}): "
+                               f"{', '.join(str(item['count']) + 'x' for item in report['n_plus_one'])}")
+            await run_in_threadpool(self.save, profile_id, report, profile)
+
+    def save(self, profile_id: str, report: dict, profile):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / f"{profile_id}.json", 'w') as f:
+            json.dump(report, f, indent=2)
+        if profile is not None:
+            profile.dump_stats(str(self.path / f"{profile_id}.prof"))
+
+
+def server_timing(stats: RequestStats, total: float) -> str:
+    """
+    Server-Timing header value (durations in ms): auth (authentication dependency), db (SQL statements),
+    serialization (JSON render) and handler (the rest of request, it includes db time of handler).
+    """
+
+    handler = max(total - stats.auth_time - stats.render_time, 0.0)
+    return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in (
+        ('auth', stats.auth_time), ('db', stats.db_time), ('handler', handler),
+        ('serialization', stats.render_time), ('total', total)))
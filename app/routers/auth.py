@@ -1,9 +1,12 @@
 from fastapi import APIRouter, Depends, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..database import get_db
 from .. import models, utils, oauth2
+from ..config import env
+from ..workers import password_pool
 from ..schemas.users import TokenResponse
 
 # Authentification router init
@@ -12,20 +15,32 @@ router = APIRouter(tags=["Authentification"],
 
 
 # POST endpoint for user login
-@router.post('/login', response_model=TokenResponse, status_code=status.HTTP_200_OK)
-def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+@router.post('/login', response_model=TokenResponse, status_code=status.HTTP_200_OK,
+             responses={503: {'description': 'Service unavailable - too many logins in progress'}})
+async def login(user_credentials: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
 
     # GET user from database
-    user = db.query(models.User).filter(models.User.email == user_credentials.username).first()
+    user = (await db.execute(select(models.User).where(models.User.email == user_credentials.username))) \
+        .scalars().first()
 
     # If no user was fetched form database
     if not user:
         raise oauth2.ex_InvalidCreds
 
-    # If user verifycation did not succeed
-    if not utils.verify(user_credentials.password, user.password):
+    # If user verifycation did not succeed (bcrypt runs in password worker pool)
+    if env.password_rehash:
+        verified, new_hash = await password_pool.run(utils.verify_and_update, user_credentials.password,
+                                                     user.password)
+    else:
+        verified, new_hash = await password_pool.run(utils.verify, user_credentials.password, user.password), None
+
+    if not verified:
         raise oauth2.ex_InvalidCreds
 
+    if new_hash is not None:    # stored hash has other cost than configured, replace it
+        await db.execute(update(models.User).where(models.User.id == user.id).values(password=new_hash))
+        await db.commit()
+
     # Create token
     access_token = oauth2.create_token(data={"user_id": user.id})
 
@@ -1,12 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status, WebSocket
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import Float, cast, func, select
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
 
+from ..config import env
 from ..database import get_db, ws_get_db
 from .. import models
 from ..oauth2 import get_current_user
+from ..websocket import ws_authenticate, ws_search_loop, ws_query
+from ..pagination import PageParams, Keyset, decode_cursor, estimate_count, set_page_headers
+from ..food_catalog import catalog
 from ..schemas import food
+from ..schemas.users import UserPrincipal
+from ..streaming import stream_rows, streaming_response
+from ..utils import escape_like
 
 # Food router init
 router = APIRouter(
@@ -16,16 +24,85 @@ router = APIRouter(
 )
 
 
+def food_search_query(title: str, fuzzy: bool = False):
+    """
+    Builds food search query and its sort key, both modes use trigram index on lower(title).
+    Substring mode matches foods containing title, fuzzy mode matches foods with similar words (typo tolerant).
+    Results are ranked by similarity to the title.
+    """
+
+    query = select(models.Food)
+
+    if title == '':
+        return query, Keyset((models.Food.id, False))
+
+    title = title.lower()
+    title_lower = func.lower(models.Food.title)
+
+    if fuzzy:   # word similarity above pg_trgm.word_similarity_threshold
+        query = query.where(title_lower.op('%>')(title))
+    else:
+        query = query.where(title_lower.like(f"%{escape_like(title)}%", escape='\\'))
+
+    # similarities are float4, cast to float8 so cursor values round-trip exactly and ties are not skipped
+    return query, Keyset((cast(func.word_similarity(title, title_lower), Float(53)), True),
+                         (cast(func.similarity(title_lower, title), Float(53)), True),
+                         (models.Food.id, False))
+
+
+async def search_food(db: AsyncSession, title: str, fuzzy: bool, page: PageParams):
+    # returns page of foods, cursor of next page and total estimate (if requested)
+    after = None
+    if page.after is not None:
+        after = decode_cursor(page.after, float, float, int) if title != '' else decode_cursor(page.after, int)
+
+    if catalog.ready:   # search in memory when food catalog is enabled, in threadpool so the event loop is free
+        return await run_in_threadpool(catalog.snapshot.search, title, fuzzy, page.limit, after, page.total)
+
+    query, keyset = food_search_query(title, fuzzy)
+    total = await estimate_count(db, query) if page.total else None
+    rows = (await db.execute(keyset.apply(query, page.limit, after))).all()
+    answer, next_cursor = keyset.page(rows, page.limit)
+
+    return answer, next_cursor, total
+
+
+async def stream_food(db: AsyncSession, title: str, fuzzy: bool):
+    # batches of every matching food in the same order as pages, from catalog or server-side cursor
+    if catalog.ready:
+        snapshot = catalog.snapshot     # same snapshot for the whole response
+        if title == '':
+            for start in range(0, len(snapshot), env.stream_batch_size):
+                yield [snapshot.row(pos) for pos in range(start, min(start + env.stream_batch_size, len(snapshot)))]
+        else:
+            answer = (await run_in_threadpool(snapshot.search, title, fuzzy))[0]
+            for start in range(0, len(answer), env.stream_batch_size):
+                yield answer[start:start + env.stream_batch_size]
+        return
+
+    query, keyset = food_search_query(title, fuzzy)
+    async for batch in stream_rows(db, keyset.order(query)):
+        yield batch
+
+
 # GET endpoint for food based on title
 @router.get("/", response_model=List[food.FoodOut], status_code=status.HTTP_200_OK)
-def get_all_food_or_by_name(title: Optional[str] = '', curr_user: models.User = Depends(get_current_user),
-                            db: Session = Depends(get_db)):
+async def get_all_food_or_by_name(request: Request, response: Response, title: Optional[str] = '',
+                                  fuzzy: bool = False, stream: bool = False, page: PageParams = Depends(),
+                                  curr_user: UserPrincipal = Depends(get_current_user),
+                                  db: AsyncSession = Depends(get_db)):
 
     """
     **GET endpoint for food based on title**
 
     Query parameter:
     - Optional **title**: title of food (if empty returns every food)
+    - Optional **fuzzy**: typo tolerant search by similar words instead of substring match
+    - Optional **limit**: maximum number of returned foods (best matches first)
+    - Optional **after**: cursor of next page (from **X-Next-Cursor** response header)
+    - Optional **total**: return estimated number of matching foods in **X-Total-Estimate** header
+    - Optional **stream**: stream every matching food (limit and after are ignored) as JSON array,
+      or NDJSON (one food per line) when Accept header is **application/x-ndjson**
 
     Response body:
     - **id**: id of fetched food
@@ -34,11 +111,12 @@ def get_all_food_or_by_name(title: Optional[str] = '', curr_user: models.User =
 
     """
 
-    if title != '':  # if no title was provided fetch all the food
-        title = title.lower()
-        answer = db.query(models.Food).filter(func.lower(models.Food.title).like(f"%{title}%")).all()
-    else:  # else fetch based on title
-        answer = db.query(models.Food).all()
+    if stream:  # rows are encoded while they are read, memory does not grow with the catalog
+        return streaming_response(request, stream_food(db, title, fuzzy), food.FoodOut)
+
+    # if no title was provided fetch all the food, else fetch based on title
+    answer, next_cursor, total = await search_food(db, title, fuzzy, page)
+    set_page_headers(response, next_cursor, total)
 
     return answer
 
@@ -46,42 +124,28 @@ def get_all_food_or_by_name(title: Optional[str] = '', curr_user: models.User =
 @router.websocket("/ws")
 async def ws_get_all_food_or_by_name(websocket: WebSocket):
     await websocket.accept()
-    token: str = websocket.headers['authorization']
-    db = ws_get_db()
-    curr_user = get_current_user(token=token, db=db, is_wb=True)
-    db.close()
+    db = ws_get_db()    # one session for whole connection
 
-    if not isinstance(curr_user, models.User):
-        return curr_user
+    async def search(message: str):
+        title, page, params = ws_query(message, 'title')
+        answer, next_cursor, _ = await search_food(db, title, bool(params.get('fuzzy', False)), page)
 
-    try:
-        while True:
-            db = ws_get_db()
-            title: str = await websocket.receive_text()
-
-            if title != '':  # if no title was provided fetch all the food
-                title = title.lower()
-                answer = db.query(models.Food).filter(func.lower(models.Food.title).like(f"%{title}%")).all()
-            else:  # else fetch based on title
-                answer = db.query(models.Food).all()
-
-            l_food = []
+        if not catalog.ready:
+            answer = [food.FoodOut.from_orm(x).dict() for x in answer]
+        return answer, next_cursor
 
-            for x in answer:
-                new = food.FoodOut(**x.__dict__)
-                l_food.append(new.dict())
-
-            db.close()
-            await websocket.send_json({'status_code': 200, 'detail': l_food})
+    try:
+        if await ws_authenticate(websocket, db) is not None:
+            await ws_search_loop(websocket, db, search)
+    finally:
+        await db.close()
 
-    except WebSocketDisconnect:
-        pass
 
 # GET endpoint for getting food based on id
 @router.get("/{id}", response_model=food.FoodOut, status_code=status.HTTP_200_OK,
             responses={404: {'description': 'Not found'}})
-def get_food_by_id(id: int, curr_user: models.User = Depends(get_current_user),
-                   db: Session = Depends(get_db)):
+async def get_food_by_id(id: int, curr_user: UserPrincipal = Depends(get_current_user),
+                         db: AsyncSession = Depends(get_db)):
     """
     **GET endpoint for getting food based on id**
 
@@ -96,7 +160,10 @@ def get_food_by_id(id: int, curr_user: models.User = Depends(get_current_user),
     """
 
     # fetch the food
-    answer = db.query(models.Food).filter(models.Food.id == id).first()
+    if catalog.ready:
+        answer = catalog.snapshot.get(id)
+    else:
+        answer = (await db.execute(select(models.Food).where(models.Food.id == id))).scalars().first()
 
     if answer is None:  # if no food was fetched
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Food not found")
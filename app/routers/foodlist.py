@@ -1,17 +1,25 @@
-from fastapi import APIRouter, Depends, status, HTTPException
-from sqlalchemy import func, and_
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
+from fastapi import APIRouter, Depends, Query, Response, status, HTTPException
+from sqlalchemy import ARRAY, Integer, and_, any_, func, literal, select, delete, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .. import models
 from ..oauth2 import get_current_user, ex_notAuthToPerformAction
 from ..database import get_db
-from ..schemas.foodlist import FoodListOut, FoodListAdd
-from ..utils import ex_formatter
+from ..schemas.foodlist import FoodListOut, FoodListAdd, DailyIntakeOut
+from ..schemas.users import UserPrincipal
+from ..writes import write_errors
+from ..pagination import PageParams, Keyset, decode_cursor, estimate_count, set_page_headers
+from ..dates import DateRange
+from ..config import env
 
-from datetime import datetime
-from dateutil import parser
-from typing import List
+from datetime import date, datetime
+from typing import List, Optional
+from pydantic import conlist
+
+MAX_BULK_ITEMS = 100
+
+ex_foodListingNotFound = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Food listing not found")
 
 # Food list router init
 router = APIRouter(
@@ -21,15 +29,118 @@ router = APIRouter(
 )
 
 
+def food_list_query(id_user: int, dates: DateRange):  # food list of user in date range, uses (id_user, time) index
+    return select(models.Foodlist.id, models.Food.title, models.Food.kcal_100g, models.Foodlist.amount) \
+        .join(models.Food).where(models.Foodlist.id_user == id_user, *dates.where(models.Foodlist.time))
+
+
+def intake_rollup(entries, sign: int = 1):
+    """
+    Adds (sign=1) or subtracts (sign=-1) food list entries to daily_intake rollup,
+    entries is a subquery or CTE with id_user, time, id_food and amount columns of food list.
+    Has to run in the transaction which inserts or deletes the entries.
+    Built from Core tables, so it can be embedded as CTE (see insert_food_list).
+    """
+
+    food, daily_intake = models.Food.__table__, models.DailyIntake.__table__
+
+    # day is computed in subquery, so grouping does not repeat expression with bound time zone parameter
+    rows = select(entries.c.id_user, func.date(func.timezone(env.default_time_zone, entries.c.time)).label('day'),
+                  (food.c.kcal_100g * entries.c.amount / 100).label('kcal')) \
+        .join_from(entries, food, food.c.id == entries.c.id_food).subquery()
+    totals = select(rows.c.id_user, rows.c.day, func.sum(rows.c.kcal) * sign, func.count() * sign) \
+        .group_by(rows.c.id_user, rows.c.day)
+
+    upsert = insert(daily_intake).from_select(['id_user', 'day', 'kcal', 'entries'], totals)
+    return upsert.on_conflict_do_update(
+        index_elements=[daily_intake.c.id_user, daily_intake.c.day],
+        set_={'kcal': daily_intake.c.kcal + upsert.excluded.kcal,
+              'entries': daily_intake.c.entries + upsert.excluded.entries})
+
+
+def intake_recompute(food_ids: List[int]):
+    """
+    Recomputes kcal of daily_intake rollup for days with entries of given foods, after kcal of the foods changed
+    (rollup keeps kcal of the time entries were added). Has to run in the transaction which changes the foods.
+    """
+
+    food_list, food, daily_intake = models.Foodlist.__table__, models.Food.__table__, models.DailyIntake.__table__
+    day = func.date(func.timezone(env.default_time_zone, food_list.c.time))
+
+    affected = select(food_list.c.id_user, day.label('day')) \
+        .where(food_list.c.id_food == any_(literal(food_ids, ARRAY(Integer)))).distinct().cte('affected')
+    # entries of affected users only, (id_user, time) index is used
+    rows = select(food_list.c.id_user, day.label('day'), (food.c.kcal_100g * food_list.c.amount / 100).label('kcal')) \
+        .join_from(food_list, food, food.c.id == food_list.c.id_food) \
+        .where(food_list.c.id_user.in_(select(affected.c.id_user))).subquery()
+    totals = select(rows.c.id_user, rows.c.day, func.sum(rows.c.kcal).label('kcal')) \
+        .join_from(rows, affected, and_(affected.c.id_user == rows.c.id_user, affected.c.day == rows.c.day)) \
+        .group_by(rows.c.id_user, rows.c.day).subquery()
+
+    return update(daily_intake).values(kcal=totals.c.kcal) \
+        .where(daily_intake.c.id_user == totals.c.id_user, daily_intake.c.day == totals.c.day)
+
+
+def daily_totals_query(id_user: int, tz_name: str, dates: DateRange):
+    """
+    Daily totals of food list computed from its entries with days in given time zone, for clients whose time zone
+    differs from the one of daily_intake rollup. Returns the query and its day column (sort key).
+    """
+
+    # day is computed in subquery, so grouping does not repeat expression with bound time zone parameter
+    rows = select(func.date(func.timezone(tz_name, models.Foodlist.time)).label('day'),
+                  (models.Food.kcal_100g * models.Foodlist.amount / 100).label('kcal')) \
+        .join(models.Food).where(models.Foodlist.id_user == id_user, *dates.where(models.Foodlist.time)).subquery()
+    query = select(rows.c.day, func.sum(rows.c.kcal).label('kcal'), func.count().label('entries')) \
+        .group_by(rows.c.day)
+    return query, rows.c.day
+
+
+async def missing_foods(db, ids: List[int]) -> List[int]:  # ids of foods which do not exist
+    found = set((await db.execute(select(models.Food.id).where(models.Food.id.in_(set(ids))))).scalars().all())
+    return sorted(set(ids) - found)
+
+
+async def insert_food_list(db, id_user: int, new_foods: List[FoodListAdd]):
+    """
+    Adds foods to food list of user with one statement: multi-row INSERT ... RETURNING in CTE,
+    daily totals updated from it in another CTE and added entries joined with their food.
+    Core tables are used, ORM enabled select would not render the rollup CTE (SQLAlchemy 1.4).
+    """
+
+    food_list, food = models.Foodlist.__table__, models.Food.__table__
+    inserted = insert(food_list) \
+        .values([{'id_user': id_user, **new_food.dict()} for new_food in new_foods]) \
+        .returning(food_list.c.id, food_list.c.id_user, food_list.c.id_food, food_list.c.amount, food_list.c.time) \
+        .cte('inserted')
+
+    statement = select(inserted.c.id, food.c.title, food.c.kcal_100g, inserted.c.amount) \
+        .join_from(inserted, food, food.c.id == inserted.c.id_food) \
+        .add_cte(intake_rollup(inserted).cte('rollup')) \
+        .order_by(inserted.c.id)
+
+    async with write_errors(db):    # rolled back, 403 when constraints were violated
+        added = (await db.execute(statement)).all()
+        await db.commit()
+
+    return added
+
+
 # GET endpoint for getting food list based on date
-@router.get("/", response_model=List[FoodListOut], status_code=status.HTTP_200_OK)
-def get_food_list(date: str, curr_user: models.User = Depends(get_current_user),
-                  db: Session = Depends(get_db)):
+@router.get("/", response_model=List[FoodListOut], status_code=status.HTTP_200_OK,
+            responses={400: {'description': 'Bad request - unknown time zone or invalid cursor'}})
+async def get_food_list(response: Response, dates: DateRange = Depends(), page: PageParams = Depends(),
+                        curr_user: UserPrincipal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """
     **GET endpoint for getting food list based on date**
 
     Query parameter:
     - Optional **date**: date of addition of food to foodlist, if empty fetches every food of current user
+    - Optional **from**, **to**: range of dates (both included) instead of single date
+    - Optional **tz**: time zone of client, e.g. Europe/Bratislava (default UTC)
+    - Optional **limit**: maximum number of returned foods
+    - Optional **after**: cursor of next page (from **X-Next-Cursor** response header)
+    - Optional **total**: return estimated number of foods in **X-Total-Estimate** header
 
     Response body:
     - **id**: id of food in foodlist
@@ -40,28 +151,81 @@ def get_food_list(date: str, curr_user: models.User = Depends(get_current_user),
     """
 
     # test if input is date
-    try:
-        test_date = str(parser.parse(date).date())
-    except Exception:
+    if not dates.valid:
         return []
 
+    after = decode_cursor(page.after, datetime, int) if page.after is not None else None
+
     # fetch the list
-    food_list_query = db.query(models.Foodlist.id, models.Food.title, models.Food.kcal_100g, models.Foodlist.amount) \
-        .join(models.Food).filter(and_(models.Foodlist.id_user == curr_user.id,
-                                       and_(func.date(models.Foodlist.time) >= test_date),
-                                       func.date(models.Foodlist.time) <= test_date))
+    query = food_list_query(curr_user.id, dates)
 
-    food_list = food_list_query.all()
+    keyset = Keyset((models.Foodlist.time, False), (models.Foodlist.id, False))
+    total = await estimate_count(db, query) if page.total else None
+    rows = (await db.execute(keyset.apply(query, page.limit, after))).all()
+    food_list, next_cursor = keyset.page(rows, page.limit)
+    set_page_headers(response, next_cursor, total)
 
     return food_list
 
 
+# GET endpoint for getting daily totals of food list
+@router.get("/summary", response_model=List[DailyIntakeOut], status_code=status.HTTP_200_OK,
+            responses={400: {'description': 'Bad request - invalid cursor or unknown time zone'}})
+async def get_food_list_summary(response: Response, from_: Optional[date] = Query(None, alias='from'),
+                                to: Optional[date] = None, tz_name: Optional[str] = Query(None, alias='tz'),
+                                page: PageParams = Depends(), curr_user: UserPrincipal = Depends(get_current_user),
+                                db: AsyncSession = Depends(get_db)):
+    """
+    **GET endpoint for getting daily totals of food list**
+
+    Query parameter:
+    - Optional **from**, **to**: range of days (both included), if empty fetches every day of current user
+    - Optional **tz**: time zone of client, e.g. Europe/Bratislava (days start at midnight in it)
+    - Optional **limit**: maximum number of returned days
+    - Optional **after**: cursor of next page (from **X-Next-Cursor** response header)
+    - Optional **total**: return estimated number of days in **X-Total-Estimate** header
+
+    Days are in time zone of server (DEFAULT_TIME_ZONE) when tz is not given, totals are then read from daily
+    rollup. With other tz they are summed from food list entries grouped by days in that time zone.
+    Days without food are not returned.
+
+    Response body:
+    - **day**: date
+    - **kcal**: sum of kcal of foods added that day (kcal_100g * amount / 100)
+    - **entries**: number of foods added that day
+
+    """
+
+    after = decode_cursor(page.after, date) if page.after is not None else None
+
+    if tz_name and tz_name != env.default_time_zone:    # rollup has days of server time zone
+        dates = DateRange(None, from_ and from_.isoformat(), to and to.isoformat(), tz_name)  # 400 for unknown zone
+        query, day = daily_totals_query(curr_user.id, tz_name, dates)     # range scan of (id_user, time) index
+        keyset = Keyset((day, False))
+    else:
+        # one range scan of primary key (id_user, day)
+        query = select(models.DailyIntake).where(models.DailyIntake.id_user == curr_user.id,
+                                                 models.DailyIntake.entries > 0)
+        if from_ is not None:
+            query = query.where(models.DailyIntake.day >= from_)
+        if to is not None:
+            query = query.where(models.DailyIntake.day <= to)
+        keyset = Keyset((models.DailyIntake.day, False))
+
+    total = await estimate_count(db, query) if page.total else None
+    rows = (await db.execute(keyset.apply(query, page.limit, after))).all()
+    summary, next_cursor = keyset.page(rows, page.limit)
+    set_page_headers(response, next_cursor, total)
+
+    return summary
+
+
 # POST endpoint for adding new food to foodlist
 @router.post("/", response_model=FoodListOut, status_code=status.HTTP_200_OK,
              responses={403: {'description': 'Forbidden - Integrity or Data error (violated DB constraints)'},
                         404: {'description': 'Not found'}})
-def add_food_to_food_list(new_food: FoodListAdd, curr_user: models.User = Depends(get_current_user),
-                          db: Session = Depends(get_db)):
+async def add_food_to_food_list(new_food: FoodListAdd, curr_user: UserPrincipal = Depends(get_current_user),
+                                db: AsyncSession = Depends(get_db)):
     """
     **POST endpoint for adding new food to foodlist**
 
@@ -77,37 +241,54 @@ def add_food_to_food_list(new_food: FoodListAdd, curr_user: models.User = Depend
 
     """
 
-    # Fetch food from foods table in database
-    answer = db.query(models.Food).filter(models.Food.id == new_food.id_food).first()
-    if answer is None:  # if no food was fetched
+    # Check if food exists in foods table in database
+    if await missing_foods(db, [new_food.id_food]):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Food not found")
 
-    add_time = datetime.now()   # add timestamp
-    new_food_model = models.Foodlist(id_user=curr_user.id, time=add_time, **new_food.dict())
+    # add to database, added food is returned by the same statement
+    added = await insert_food_list(db, curr_user.id, [new_food])
+    return added[0]
 
-    try:    # add to database
-        db.add(new_food_model)
-        db.commit()
-    except IntegrityError as e:     # if constrains were violated
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=ex_formatter(e))
-    except Exception as e:  # when other exception occured (data error)
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e.__cause__))
 
-    # fetch the response (added food)
-    fetched = db.query(models.Foodlist.id, models.Food.title, models.Food.kcal_100g, models.Foodlist.amount) \
-        .join(models.Food).filter(and_(models.Foodlist.id_food == new_food.id_food,
-                                       models.Foodlist.id_user == curr_user.id,
-                                       models.Foodlist.time == add_time)).first()
+# POST endpoint for adding more foods to foodlist at once
+@router.post("/bulk", response_model=List[FoodListOut], status_code=status.HTTP_200_OK,
+             responses={403: {'description': 'Forbidden - Integrity or Data error (violated DB constraints)'},
+                        404: {'description': 'Not found'}})
+async def add_foods_to_food_list(new_foods: conlist(FoodListAdd, min_items=1, max_items=MAX_BULK_ITEMS),
+                                 curr_user: UserPrincipal = Depends(get_current_user),
+                                 db: AsyncSession = Depends(get_db)):
+    """
+    **POST endpoint for adding more foods to foodlist at once** (e.g. whole meal)
+
+    Request body:
+    - list (at most 100) of:
+    - **id_food**: id of chosen food
+    - **amount**: amount of chosen food
+
+    Response body:
+    - list of added foods, in order of request:
+    - **id**: id of food in foodlist
+    - **title**: title of added food
+    - **kcal_100g**: amount of kcal for 100g
+    - **amount**: amount of added food
+
+    """
+
+    # every food is checked by one query
+    missing = await missing_foods(db, [new_food.id_food for new_food in new_foods])
+    if missing:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Food not found: {', '.join(str(id_food) for id_food in missing)}")
 
-    return fetched
+    return await insert_food_list(db, curr_user.id, new_foods)
 
 
 # DELETE endpoint for deleting food from food list
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT,
                responses={404: {'description': 'Not found'},
                           401: {'description': 'Unauthorized'}})
-def delete_food_from_food_list(id: int, curr_user: models.User = Depends(get_current_user),
-                               db: Session = Depends(get_db)):
+async def delete_food_from_food_list(id: int, curr_user: UserPrincipal = Depends(get_current_user),
+                                     db: AsyncSession = Depends(get_db)):
     """
     DELETE endpoint for deleting food from food list
 
@@ -116,14 +297,27 @@ def delete_food_from_food_list(id: int, curr_user: models.User = Depends(get_cur
 
     """
 
-    # fetch food from foodlist
-    food_query = db.query(models.Foodlist).filter(models.Foodlist.id == id)
-    food = food_query.first()
+    # fetch owner of food from foodlist
+    id_user = (await db.execute(select(models.Foodlist.id_user).where(models.Foodlist.id == id))).first()
 
-    if food is None:    # if no food was fetched raise an exception
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Food listing not found")
-    elif food.id_user != curr_user.id:  # if the food belongs to other user raise an excepion
+    if id_user is None:    # if no food was fetched raise an exception
+        raise ex_foodListingNotFound
+    elif id_user[0] != curr_user.id:  # if the food belongs to other user raise an excepion
         raise ex_notAuthToPerformAction
 
-    food_query.delete(synchronize_session=False)    # delte the food
-    db.commit()
+    # delete the food and subtract from daily totals what was really deleted in one statement,
+    # entry deleted by concurrent request (retry) is not subtracted twice
+    food_list = models.Foodlist.__table__
+    deleted = delete(food_list).where(food_list.c.id == id, food_list.c.id_user == curr_user.id) \
+        .returning(food_list.c.id, food_list.c.id_user, food_list.c.id_food, food_list.c.amount, food_list.c.time) \
+        .cte('deleted')
+    statement = select(deleted.c.id).add_cte(intake_rollup(deleted, sign=-1).cte('rollup'))
+
+    if (await db.execute(statement)).first() is None:
+        await db.rollback()
+        raise ex_foodListingNotFound
+
+    # emptied days are removed after the statement, its own changes are not visible in its CTEs
+    await db.execute(delete(models.DailyIntake).where(models.DailyIntake.id_user == curr_user.id,
+                                                      models.DailyIntake.entries <= 0))
+    await db.commit()
@@ -1,17 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status, UploadFile, File, WebSocket
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 from ..database import get_db, ws_get_db
 from .. import models
-from sqlalchemy import func, and_
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import func, select, insert, update, delete
 from ..schemas import recipes
+from ..schemas.users import UserOut, UserPrincipal
 from typing import List, Optional
 from ..oauth2 import get_current_user, ex_notAuthToPerformAction
-from ..utils import remove_none_from_dict, ex_formatter, verify_image
-from starlette.responses import StreamingResponse
-from datetime import datetime
-import io
-from PIL import Image
+from ..utils import remove_none_from_dict, prepare_image
+from ..websocket import ws_authenticate, ws_search_loop, ws_query
+from ..pagination import PageParams, Keyset, decode_cursor, estimate_count, set_page_headers
+from ..workers import image_pool
+from ..uploads import read_upload
+from ..writes import write_returning
+from ..streaming import stream_rows, streaming_response
+from ..storage import save_image, save_image_variants, select_image, requested_variant, image_variant_response, \
+    image_upload_response
+from datetime import datetime, timezone
 
 # Recipe router init
 router = APIRouter(
@@ -20,16 +26,61 @@ router = APIRouter(
     responses={401: {'description': 'Unauthorized'}}
 )
 
+# creator is loaded in the same query as recipes (join), only with columns of UserOut
+creator_loader = joinedload(models.Recipe.creator, innerjoin=True) \
+    .load_only(*(getattr(models.User, field) for field in UserOut.__fields__))
+
+ex_recipeNotFound = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Recipe not found")
+
+
+async def check_own_recipe(db: AsyncSession, id: int, curr_user: UserPrincipal):
+    # 404 when recipe does not exist, 403 when it belongs to other user (only owner column is fetched)
+    id_user = (await db.execute(select(models.Recipe.id_user).where(models.Recipe.id == id))).first()
+
+    if id_user is None:
+        raise ex_recipeNotFound
+    elif id_user[0] != curr_user.id:
+        raise ex_notAuthToPerformAction
+
+
+def recipe_search_query(title: str):
+    # recipes with creators containing title ordered by id, if title is empty string, every recipe
+    query = select(models.Recipe).options(creator_loader)
+
+    if title != '':
+        title = title.lower()
+        query = query.where(func.lower(models.Recipe.title).like(f"%{title}%"))
+
+    return query, Keyset((models.Recipe.id, False))
+
+
+async def search_recipes(db: AsyncSession, title: str, page: PageParams):
+    # returns page of recipes, cursor of next page and total estimate (if requested)
+    after = decode_cursor(page.after, int) if page.after is not None else None
+
+    query, keyset = recipe_search_query(title)
+    total = await estimate_count(db, query) if page.total else None
+    rows = (await db.execute(keyset.apply(query, page.limit, after))).all()
+    answer, next_cursor = keyset.page(rows, page.limit)
+
+    return answer, next_cursor, total
+
 
 # GET endpoint for getting recipes based on title
 @router.get("/", response_model=List[recipes.RecipeOut], status_code=status.HTTP_200_OK)
-def get_recipes(title: Optional[str] = '', db: Session = Depends(get_db),
-                curr_user: models.User = Depends(get_current_user)):
+async def get_recipes(request: Request, response: Response, title: Optional[str] = '', stream: bool = False,
+                      page: PageParams = Depends(), db: AsyncSession = Depends(get_db),
+                      curr_user: UserPrincipal = Depends(get_current_user)):
     """
     **GET endpoint for getting recipes based on title**
 
     Query parameter:
     - Optional **title**: title of recipe, if empty returns every recipe
+    - Optional **limit**: maximum number of returned recipes
+    - Optional **after**: cursor of next page (from **X-Next-Cursor** response header)
+    - Optional **total**: return estimated number of matching recipes in **X-Total-Estimate** header
+    - Optional **stream**: stream every matching recipe (limit and after are ignored) as JSON array,
+      or NDJSON (one recipe per line) when Accept header is **application/x-ndjson**
 
     Response body:
     - **id**: recipe id
@@ -50,11 +101,12 @@ def get_recipes(title: Optional[str] = '', db: Session = Depends(get_db),
 
     """
 
-    if title != '':  # if title is empty string, get every recipe
-        title = title.lower()
-        answer = db.query(models.Recipe).filter(func.lower(models.Recipe.title).like(f"%{title}%")).all()
-    else:  # else get recipe based on title
-        answer = db.query(models.Recipe).all()
+    if stream:  # recipes are read from server-side cursor and encoded batch by batch
+        query, keyset = recipe_search_query(title)
+        return streaming_response(request, stream_rows(db, keyset.order(query)), recipes.RecipeOut)
+
+    answer, next_cursor, total = await search_recipes(db, title, page)
+    set_page_headers(response, next_cursor, total)
 
     return answer
 
@@ -62,44 +114,26 @@ def get_recipes(title: Optional[str] = '', db: Session = Depends(get_db),
 @router.websocket("/ws")
 async def ws_get_recipes(websocket: WebSocket):
     await websocket.accept()
-    token: str = websocket.headers['authorization']
-    db = ws_get_db()
-    curr_user = get_current_user(token=token, db=db, is_wb=True)
-    db.close()
+    db = ws_get_db()    # one session for whole connection
 
-    if not isinstance(curr_user, models.User):
-        return curr_user
+    async def search(message: str):
+        title, page, _ = ws_query(message, 'title')
+        answer, next_cursor, _ = await search_recipes(db, title, page)
+
+        return [recipes.RecipeOut.from_orm(x).dict() for x in answer], next_cursor
 
     try:
-        while True:
-            db = ws_get_db()
-            title: str = await websocket.receive_text()
-            if title != '':  # if title is empty string, get every recipe
-                title = title.lower()
-                answer = db.query(models.Recipe).filter(func.lower(models.Recipe.title).like(f"%{title}%")).all()
-            else:  # else get recipe based on title
-                answer = db.query(models.Recipe).all()
-
-            l_recipes = []
-            for x in answer:
-                user = db.query(models.User).filter(models.User.id == x.id_user).first()
-                merge_dict = x.__dict__
-                merge_dict['creator'] = user.__dict__
-                new = recipes.RecipeOut(**merge_dict)
-                l_recipes.append(new.dict())
-
-            db.close()
-            await websocket.send_json({'status_code': 200, 'detail': l_recipes})
-
-    except WebSocketDisconnect:
-        pass
+        if await ws_authenticate(websocket, db) is not None:
+            await ws_search_loop(websocket, db, search)
+    finally:
+        await db.close()
 
 
 # GET endpoint for getting a recipe based on its id
 @router.get("/{id}", response_model=recipes.RecipeOut, status_code=status.HTTP_200_OK,
             responses={404: {'description': 'Not found'}})
-def get_recipe(id: int, db: Session = Depends(get_db),
-               curr_user: models.User = Depends(get_current_user)):
+async def get_recipe(id: int, db: AsyncSession = Depends(get_db),
+                     curr_user: UserPrincipal = Depends(get_current_user)):
 
     """
     **GET endpoint for getting a recipe based on its id**
@@ -126,7 +160,8 @@ def get_recipe(id: int, db: Session = Depends(get_db),
 
     """
 
-    answer = db.query(models.Recipe).filter(models.Recipe.id == id).first()
+    answer = (await db.execute(select(models.Recipe).options(creator_loader)
+                               .where(models.Recipe.id == id))).scalars().first()
 
     if answer is None:  # if no recipe was fetched raise exception
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Recipe not found")
@@ -137,40 +172,50 @@ def get_recipe(id: int, db: Session = Depends(get_db),
 # GET endpoint for getting a recipe's image
 @router.get("/{id}/image", status_code=status.HTTP_200_OK,
             responses={204: {'description': 'No content'},
+                       304: {'description': 'Not modified (If-None-Match matches ETag)'},
                        404: {'description': 'Not found'}}
             )
-def get_recipe_image(id: int, db: Session = Depends(get_db),
-                     curr_user: models.User = Depends(get_current_user)):
+async def get_recipe_image(id: int, request: Request, size: Optional[int] = Query(None, ge=1),
+                           db: AsyncSession = Depends(get_db),
+                           curr_user: UserPrincipal = Depends(get_current_user)):
 
     """
     **GET endpoint for getting a recipe's image**
 
     Query parameter:
     - **id**: id of recipe
+    - Optional **size**: wanted size in px, smallest stored size at least as large is returned (64, 256, 1024)
+
+    WebP is returned when Accept header contains image/webp.
 
     Response body:
-    - **Recipe picture**
+    - **Recipe picture**, with ETag and Last-Modified headers for conditional requests
 
     """
 
-    recipe = db.query(models.Recipe.recipe_picture).filter(models.Recipe.id == id).first()
+    variant = requested_variant(request, size)
+    recipe = (await db.execute(select_image(models.Recipe.recipe_picture_key, models.Recipe.recipe_picture_type,
+                                            models.Recipe.recipe_picture_updated_at, variant)
+                               .where(models.Recipe.id == id))).first()
 
     if recipe is None:  # if no recipe was fetched raise exception
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Recipe not found")
 
-    elif recipe.recipe_picture is None:  # if recipe was fetched but has no picture raise an exception
+    async def load_picture():   # picture is read from database only when it has to be sent
+        return (await db.execute(select(models.Recipe.recipe_picture).where(models.Recipe.id == id))).scalar()
+
+    response = await image_variant_response(request, db, recipe, load_picture)
+    if response is None:  # if recipe was fetched but has no picture raise an exception
         raise HTTPException(status_code=status.HTTP_204_NO_CONTENT)
 
-    else:  # else display the picture
-        im = Image.open(io.BytesIO(recipe.recipe_picture))
-        return StreamingResponse(io.BytesIO(recipe.recipe_picture), media_type=f"image/{im.format.lower()}")
+    return response  # else display the picture
 
 
 # POST endpoint for adding a new recipe
 @router.post("/", response_model=recipes.RecipePostOut, status_code=status.HTTP_201_CREATED,
              responses={403: {'description': 'Forbidden - Integrity or Data error (violated DB constraints)'}})
-def add_recipe(recipe_data: recipes.RecipeIn, db: Session = Depends(get_db),
-               curr_user: models.User = Depends(get_current_user)):
+async def add_recipe(recipe_data: recipes.RecipeIn, db: AsyncSession = Depends(get_db),
+                     curr_user: UserPrincipal = Depends(get_current_user)):
 
     """
     **POST endpoint for adding a new recipe**
@@ -189,24 +234,9 @@ def add_recipe(recipe_data: recipes.RecipeIn, db: Session = Depends(get_db),
 
     """
 
-    time = datetime.now()
-    new_recipe = models.Recipe(id_user=curr_user.id, created_at=time, **recipe_data.dict())  # create a new recipe
-
-    try:
-        db.add(new_recipe)  # add it to database
-        db.commit()
-    except IntegrityError as e:  # when constrains in databse were violated
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=ex_formatter(e))
-    except Exception as e:  # when other exception occured (data error)
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e.__cause__))
-
-    # fetch the added recipe and return it
-    fetched = db.query(models.Recipe.id, models.Recipe.title, models.Recipe.id_user, models.Recipe.created_at).filter \
-        (and_(models.Recipe.id == new_recipe.id,
-              models.Recipe.id_user == curr_user.id,
-              models.Recipe.created_at == time)).first()
-
-    return fetched
+    # add new recipe to database, created_at is set by database and returned by the insert
+    return await write_returning(db, insert(models.Recipe).values(id_user=curr_user.id, **recipe_data.dict()),
+                                 recipes.RecipePostOut, models.Recipe)
 
 
 # PUT endpoint for recipe update
@@ -215,8 +245,8 @@ def add_recipe(recipe_data: recipes.RecipeIn, db: Session = Depends(get_db),
                        401: {'description': 'Unauthorized'},
                        403: {'description': 'Forbidden - Integrity or Data error (violated DB constraints)'},
                        404: {'description': 'Not found'}})
-def update_recipe(id: int, updated_recipe: recipes.RecipeUpdate, db: Session = Depends(get_db),
-                  curr_user: models.User = Depends(get_current_user)):
+async def update_recipe(id: int, updated_recipe: recipes.RecipeUpdate, db: AsyncSession = Depends(get_db),
+                        curr_user: UserPrincipal = Depends(get_current_user)):
 
     """
     **PUT endpoint for recipe update**
@@ -246,27 +276,21 @@ def update_recipe(id: int, updated_recipe: recipes.RecipeUpdate, db: Session = D
 
     """
 
-    # fetch the recipe
-    recipe_query = db.query(models.Recipe).filter(models.Recipe.id == id)
-    recipe = recipe_query.first()
-
-    if recipe is None:  # if no recipe was fecthed raise an exception
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Recipe not found")
-    elif recipe.id_user != curr_user.id:  # if the recipe belongs to other user raise an exception
-        raise ex_notAuthToPerformAction
-    elif all(value is None for value in updated_recipe.dict().values()):  # if there is no value to update (empty json)
+    if all(value is None for value in updated_recipe.dict().values()):  # if there is no value to update (empty json)
         raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, detail="Nothing to update")
 
-    try:  # update the recipe
-        recipe_query.update(remove_none_from_dict(updated_recipe.dict()), synchronize_session=False)
-        db.commit()
-    except IntegrityError as e:  # if constrains in database were violated raise an exception
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=ex_formatter(e))
-    except Exception as e:  # if other exception occured (data error)
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e.__cause__))
+    # update recipe of current user, creator is joined (UPDATE ... FROM users) and returned with the recipe
+    recipe = await write_returning(db, update(models.Recipe)
+                                   .where(models.Recipe.id == id, models.Recipe.id_user == curr_user.id,
+                                          models.User.id == models.Recipe.id_user)
+                                   .values(**remove_none_from_dict(updated_recipe.dict())),
+                                   recipes.RecipeOut, models.Recipe, nested={'creator': models.User})
 
-    # return updated recipe
-    return recipe_query.first()
+    if recipe is None:  # nothing was updated, recipe does not exist or belongs to other user
+        await check_own_recipe(db, id, curr_user)
+        raise ex_recipeNotFound     # deleted meanwhile
+
+    return recipe
 
 
 # PUT endpoint for updating recipe image
@@ -274,8 +298,9 @@ def update_recipe(id: int, updated_recipe: recipes.RecipeUpdate, db: Session = D
             responses={404: {'description': 'Not found'},
                        413: {'description': 'Request entity too large (exceeded 2.7MB)'},
                        415: {'description': 'Unsupported media type'}})
-def update_recipe_picture(id: int, recipe_picture: UploadFile = File(...),
-                          curr_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def update_recipe_picture(id: int, recipe_picture: UploadFile = File(...),
+                                curr_user: UserPrincipal = Depends(get_current_user),
+                                db: AsyncSession = Depends(get_db)):
 
     """
     **PUT endpoint for updating recipe image**
@@ -291,28 +316,29 @@ def update_recipe_picture(id: int, recipe_picture: UploadFile = File(...),
 
     """
 
-    # fetch the recipe
-    recipe_query = db.query(models.Recipe).filter(models.Recipe.id == id)
-    recipe = recipe_query.first()
-
-    if recipe is None:  # if no recipe was fetched raise an excepton
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Recipe with id {id} was not found")
-    elif recipe.id_user != curr_user.id:    # if the fecthed recipe belongs to another user raise an exception
-        raise ex_notAuthToPerformAction
+    await check_own_recipe(db, id, curr_user)   # before the upload is processed
 
-    verified_image = verify_image(recipe_picture.file.read())  # verify that the file is an image
+    # verify that the file is an image
+    image_data = await read_upload(recipe_picture)     # chunked, 413 when too large
+    verified_image, variants = await image_pool.run(prepare_image, image_data)     # with smaller sizes and WebP
 
     # update database
-    recipe_query.update({"recipe_picture": verified_image}, synchronize_session=False)
-    db.commit()
+    picture, key = await save_image(verified_image)    # to database or image storage
+    await save_image_variants(db, key, variants)
+    updated_at = datetime.now(timezone.utc)
+    await db.execute(update(models.Recipe).where(models.Recipe.id == id)
+                     .values(recipe_picture=picture, recipe_picture_key=key,
+                             recipe_picture_type=verified_image.media_type, recipe_picture_updated_at=updated_at))
+    await db.commit()
 
-    return StreamingResponse(io.BytesIO(recipe_query.first().recipe_picture), media_type="image/png")
+    return image_upload_response(verified_image, updated_at)
 
 
 # DELETE endpoint for recipe
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT,
                responses={404: {'description': 'Not found'}})
-def delete_recipe(id: int, curr_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_recipe(id: int, curr_user: UserPrincipal = Depends(get_current_user),
+                        db: AsyncSession = Depends(get_db)):
 
     """
     DELETE endpoint for recipe
@@ -323,8 +349,7 @@ def delete_recipe(id: int, curr_user: models.User = Depends(get_current_user), d
     """
 
     # fetch the recipe
-    recipe_query = db.query(models.Recipe).filter(models.Recipe.id == id)
-    recipe = recipe_query.first()
+    recipe = (await db.execute(select(models.Recipe).where(models.Recipe.id == id))).scalars().first()
 
     if recipe is None:  # if no recipe was fetched
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Recipe not found")
@@ -332,5 +357,5 @@ def delete_recipe(id: int, curr_user: models.User = Depends(get_current_user), d
         raise ex_notAuthToPerformAction
 
     # delete the recipe
-    recipe_query.delete(synchronize_session=False)
-    db.commit()
+    await db.execute(delete(models.Recipe).where(models.Recipe.id == id))
+    await db.commit()
@@ -0,0 +1,52 @@
+from fastapi import APIRouter, status
+
+from ..database import pool_stats
+from ..oauth2 import principal_cache
+
+# Stats router init, internal like /metrics: mounted only when METRICS=true and hidden from API docs,
+# it is meant for monitoring inside the deployment, not for users of the API
+router = APIRouter(
+    prefix="/stats",
+    tags=["Stats"],
+    include_in_schema=False
+)
+
+
+# GET endpoint for authenticated users cache counters
+@router.get("/auth_cache", status_code=status.HTTP_200_OK)
+async def get_auth_cache_stats():
+    """
+    **GET endpoint for authenticated users cache counters**
+
+    Response body:
+    - **size**: number of cached users
+    - **maxsize**: maximum number of cached users
+    - **ttl**: time to live of cached user in seconds
+    - **hits**: number of requests authenticated from cache
+    - **misses**: number of requests authenticated from database
+
+    """
+
+    return principal_cache.stats()
+
+
+# GET endpoint for database connection pool gauges
+@router.get("/pool", status_code=status.HTTP_200_OK)
+async def get_pool_stats():
+    """
+    **GET endpoint for database connection pool gauges**
+
+    Response body:
+    - **size**: number of connections kept in pool
+    - **checked_out**: connections currently used by requests
+    - **idle**: open connections waiting in pool
+    - **overflow**: connections opened above pool size
+    - **max_overflow**: maximum number of overflow connections
+    - **timeout**: seconds request waits for free connection
+    - **checkouts**: number of connections handed out
+    - **timeouts**: number of requests which did not get connection in time
+    - **wait_seconds_total**, **wait_seconds_avg**, **wait_seconds_max**: time of getting connection from pool
+
+    """
+
+    return pool_stats()
@@ -1,20 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, status, WebSocket, WebSocketDisconnect
-from starlette.responses import StreamingResponse
-from sqlalchemy import func
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
+from fastapi import APIRouter, Depends, HTTPException, File, Query, Request, Response, UploadFile, status, WebSocket
+from sqlalchemy import func, select, insert, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from PIL import Image
+from datetime import datetime, timezone
 
 from ..database import get_db, ws_get_db
 from .. import models, utils
-from ..oauth2 import get_current_user, ex_notAuthToPerformAction
-from ..schemas.users import UserOut, UserCreate, UserUpdate, UserUpdatedOut, UserCreateResponse
-from ..utils import remove_none_from_dict, verify_image, ex_formatter
+from ..oauth2 import get_current_user, ex_notAuthToPerformAction, principal_cache
+from ..schemas.users import UserOut, UserCreate, UserUpdate, UserUpdatedOut, UserCreateResponse, UserPrincipal
+from ..utils import remove_none_from_dict, prepare_image
+from ..websocket import ws_authenticate, ws_search_loop, ws_query
+from ..workers import password_pool, image_pool
+from ..uploads import read_upload
+from ..writes import write_returning
+from ..storage import save_image, save_image_variants, select_image, requested_variant, image_variant_response, \
+    image_upload_response
+from ..pagination import PageParams, Keyset, decode_cursor, estimate_count, set_page_headers
 
-import io
-import psycopg2
-from psycopg2 import errors
 
 # User router init
 router = APIRouter(
@@ -25,16 +27,44 @@ router = APIRouter(
 ex_userNotFound = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User not found")
 
 
+async def check_own_account(db: AsyncSession, id: int, curr_user: UserPrincipal):
+    # current user always exists, so other user is fetched only to tell 404 from 403
+    if id != curr_user.id or id == 0:
+        exists = (await db.execute(select(models.User.id).where(models.User.id == id))).first()
+        raise ex_notAuthToPerformAction if exists is not None and id != 0 else ex_userNotFound
+
+
+async def search_users(db: AsyncSession, name: str, page: PageParams):
+    # returns page of users, cursor of next page and total estimate (if requested)
+    after = decode_cursor(page.after, int) if page.after is not None else None
+
+    # if no name was provided return all users
+    query = select(models.User).where(models.User.id != 0)
+    if name != '':  # if name was provided fetch user by the name
+        query = query.where(func.lower(func.concat(
+            models.User.first_name, ' ', models.User.last_name)).like(f"%{name.lower()}%"))
+
+    keyset = Keyset((models.User.id, False))
+    total = await estimate_count(db, query) if page.total else None
+    rows = (await db.execute(keyset.apply(query, page.limit, after))).all()
+    users, next_cursor = keyset.page(rows, page.limit)
+
+    return users, next_cursor, total
+
+
 # GET endpoint for getting user based on name
 @router.get("/", response_model=List[UserOut], status_code=status.HTTP_200_OK,
             responses={401: {'description': 'Unauthorized'}})
-def get_users(name: Optional[str] = '', curr_user: models.User = Depends(get_current_user),
-              db: Session = Depends(get_db)):
+async def get_users(response: Response, name: Optional[str] = '', page: PageParams = Depends(),
+                    curr_user: UserPrincipal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """
     **GET endpoint for getting user based on name**
 
     Query parameter:
     - Optional **name**: name of user, if not present, returns every user
+    - Optional **limit**: maximum number of returned users
+    - Optional **after**: cursor of next page (from **X-Next-Cursor** response header)
+    - Optional **total**: return estimated number of matching users in **X-Total-Estimate** header
 
     Response body:
     - **id**: id of user
@@ -46,56 +76,35 @@ def get_users(name: Optional[str] = '', curr_user: models.User = Depends(get_cur
     - **is_nutr_adviser**: boolean if he is nutritional adviser
     """
 
-    # if no name was provided return all users
-    if name == '':
-        users = db.query(models.User).filter(models.User.id != 0).all()
-    else:  # if name was provided fetch user by the name
-        users = db.query(models.User).filter(func.lower(func.concat(
-            models.User.first_name, ' ', models.User.last_name)).like(f"%{name.lower()}%"),
-                                             models.User.id != 0).all()
+    users, next_cursor, total = await search_users(db, name, page)
+    set_page_headers(response, next_cursor, total)
 
     return users
 
 @router.websocket("/ws")
 async def ws_get_users(websocket: WebSocket):
     await websocket.accept()
-    token: str = websocket.headers['authorization']
-    db = ws_get_db()
-    curr_user = get_current_user(token=token, db=db, is_wb=True)
-    db.close()
+    db = ws_get_db()    # one session for whole connection
 
-    if not isinstance(curr_user, models.User):
-       return curr_user
-
-    try:
-        while True:
-            db = ws_get_db()
-            name: str = await websocket.receive_text()
+    async def search(message: str):
+        name, page, _ = ws_query(message, 'name')
+        users, next_cursor, _ = await search_users(db, name, page)
 
-            if name == '':
-                users = db.query(models.User).filter(models.User.id != 0).all()
-            else:  # if name was provided fetch user by the name
-                users = db.query(models.User).filter(func.lower(func.concat(
-                    models.User.first_name, ' ', models.User.last_name)).like(f"%{name.lower()}%"),
-                                                     models.User.id != 0).all()
-            l_users = []
+        return [UserOut.from_orm(x).dict() for x in users], next_cursor
 
-            for x in users:
-                new = UserOut(**x.__dict__)
-                l_users.append(new.dict())
-
-            await websocket.send_json({'status_code': 200, 'detail': l_users})
-            db.close()
-
-    except WebSocketDisconnect:
-        pass
+    try:
+        if await ws_authenticate(websocket, db) is not None:
+            await ws_search_loop(websocket, db, search)
+    finally:
+        await db.close()
 
 
 # GET endpoint for getting used based on id
 @router.get("/{id}", response_model=UserUpdatedOut, status_code=status.HTTP_200_OK,
             responses={401: {'description': 'Unauthorized'},
                        404: {'description': 'Not found'}})
-def get_one_user(id: int, curr_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_one_user(id: int, curr_user: UserPrincipal = Depends(get_current_user),
+                       db: AsyncSession = Depends(get_db)):
     # fetch user
 
     """
@@ -118,7 +127,7 @@ def get_one_user(id: int, curr_user: models.User = Depends(get_current_user), db
 
     """
 
-    user = db.query(models.User).filter(models.User.id == id).first()
+    user = (await db.execute(select(models.User).where(models.User.id == id))).scalars().first()
 
     if user is None or id == 0:     # if user does not exists or it is anonymous user
         raise ex_userNotFound
@@ -129,37 +138,50 @@ def get_one_user(id: int, curr_user: models.User = Depends(get_current_user), db
 # GET endpoint for getting users's image
 @router.get("/{id}/image", status_code=status.HTTP_200_OK,
             responses={204: {'description': 'No content'},
+                       304: {'description': 'Not modified (If-None-Match matches ETag)'},
                        401: {'description': 'Unauthorized'},
                        404: {'description': 'Not found'}})
-def get_user_profile_picture(id: int, curr_user: models.User = Depends(get_current_user),
-                             db: Session = Depends(get_db)):
+async def get_user_profile_picture(id: int, request: Request, size: Optional[int] = Query(None, ge=1),
+                                   curr_user: UserPrincipal = Depends(get_current_user),
+                                   db: AsyncSession = Depends(get_db)):
     """
     **GET endpoint for getting users's profile picture**
 
     Query parameter:
     - **id**: id of user
+    - Optional **size**: wanted size in px, smallest stored size at least as large is returned (64, 256, 1024)
+
+    WebP is returned when Accept header contains image/webp.
 
     Response body:
-    - **User's profile picture**
+    - **User's profile picture**, with ETag and Last-Modified headers for conditional requests
 
     """
 
-    user = db.query(models.User.profile_picture).filter(models.User.id == id).first()
+    variant = requested_variant(request, size)
+    user = (await db.execute(select_image(models.User.profile_picture_key, models.User.profile_picture_type,
+                                          models.User.profile_picture_updated_at, variant)
+                             .where(models.User.id == id))).first()
 
     if user is None or id == 0:     # if user does not exist
         raise ex_userNotFound
-    elif user.profile_picture is None:      # if user does not have a profile picture
+
+    async def load_picture():   # picture is read from database only when it has to be sent
+        return (await db.execute(select(models.User.profile_picture).where(models.User.id == id))).scalar()
+
+    response = await image_variant_response(request, db, user, load_picture)   # display image
+    if response is None:      # if user does not have a profile picture
         raise HTTPException(status_code=status.HTTP_204_NO_CONTENT)
 
-    im = Image.open(io.BytesIO(user.profile_picture))   # display image
-    return StreamingResponse(io.BytesIO(user.profile_picture), media_type=f"image/{im.format.lower()}")
+    return response
 
 
 # POST endpoint for registering a new user
 @router.post("/", response_model=UserCreateResponse, status_code=status.HTTP_201_CREATED,
              responses={400: {'description': 'Bad request - email taken'},
-                        403: {'description': 'Forbidden - Integrity or Data error (violated DB constraints)'}})
-def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
+                        403: {'description': 'Forbidden - Integrity or Data error (violated DB constraints)'},
+                        503: {'description': 'Service unavailable - too many registrations in progress'}})
+async def register_user(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
     # hash the user's password
 
     """
@@ -189,22 +211,13 @@ def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
 
     """
 
-    hashed_password = utils.pwd_hash(user_data.password)
+    hashed_password = await password_pool.run(utils.pwd_hash, user_data.password)   # bcrypt in worker pool
     user_data.password = hashed_password
 
-    user_reg_data = models.User(**user_data.dict())
-    try:    # add user do database
-        db.add(user_reg_data)
-        db.commit()
-    except IntegrityError as e:     # if constrains were violated
-        if isinstance(e.orig, psycopg2.errors.lookup("23505")):
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                                detail=f"E-mail '{user_reg_data.email}' already registered.")
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=ex_formatter(e))
-    except Exception as e:  # if other exception occured (data error)
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e.__cause__))
-
-    return db.query(models.User).filter(models.User.email == user_reg_data.email).first()
+    # add user do database, response is returned by the insert
+    return await write_returning(db, insert(models.User).values(**user_data.dict()), UserCreateResponse, models.User,
+                                 ex_unique=HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                                         detail=f"E-mail '{user_data.email}' already registered."))
 
 
 # PUT endpoint for updating users information
@@ -212,8 +225,8 @@ def register_user(user_data: UserCreate, db: Session = Depends(get_db)):
             responses={304: {'description': 'Not modified'},
                        401: {'description': 'Unauthorized'},
                        403: {'description': 'Forbidden - Integrity or Data error (violated DB constraints)'}})
-def update_user_data(id: int, updated_user: UserUpdate, db: Session = Depends(get_db),
-                     curr_user: models.User = Depends(get_current_user)):
+async def update_user_data(id: int, updated_user: UserUpdate, db: AsyncSession = Depends(get_db),
+                           curr_user: UserPrincipal = Depends(get_current_user)):
     """
     **PUT endpoint for updating users information**
 
@@ -237,25 +250,18 @@ def update_user_data(id: int, updated_user: UserUpdate, db: Session = Depends(ge
 
     """
 
-    user_query = db.query(models.User).filter(models.User.id == id)
-    user = user_query.first()
-
-    if user is None or id == 0:     # if user does not exist
-        raise ex_userNotFound
-    elif user.id != curr_user.id:   # if current user does not match the fetched user
-        raise ex_notAuthToPerformAction
-    elif all(value is None for value in updated_user.dict().values()):  # if there are no things to update (empty json)
+    await check_own_account(db, id, curr_user)     # if user does not exist or is not the current user
+    if all(value is None for value in updated_user.dict().values()):  # if there are no things to update (empty json)
         raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, detail="Nothing to update")
 
-    try:    # update user
-        user_query.update(remove_none_from_dict(updated_user.dict()), synchronize_session=False)
-        db.commit()
-    except IntegrityError as e:     # if constrains in database were violated
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=ex_formatter(e))
-    except Exception as e:      # if other exception occured (data error)
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e.__cause__))
+    # update user, response is returned by the update
+    user = await write_returning(db, update(models.User).where(models.User.id == id)
+                                 .values(**remove_none_from_dict(updated_user.dict())), UserUpdatedOut, models.User)
+    principal_cache.invalidate(id)
+    if user is None:    # deleted meanwhile
+        raise ex_userNotFound
 
-    return user_query.first()
+    return user
 
 
 # PUT endpoint for updating user's image
@@ -264,8 +270,9 @@ def update_user_data(id: int, updated_user: UserUpdate, db: Session = Depends(ge
                        404: {'description': 'Not found'},
                        413: {'description': 'Request entity too large (exceeded 2.7MB)'},
                        415: {'description': 'Unsupported media type'}})
-def update_user_profile_picture(id: int, prof_picture: UploadFile = File(...),
-                                curr_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def update_user_profile_picture(id: int, prof_picture: UploadFile = File(...),
+                                      curr_user: UserPrincipal = Depends(get_current_user),
+                                      db: AsyncSession = Depends(get_db)):
     """
     **PUT endpoint for updating user's profile picture**
 
@@ -280,28 +287,30 @@ def update_user_profile_picture(id: int, prof_picture: UploadFile = File(...),
 
     """
 
-    user_query = db.query(models.User).filter(models.User.id == id)
-    user = user_query.first()
-
-    if user is None or id == 0:     # if user does not exist
-        raise ex_userNotFound
-    elif user.id != curr_user.id:   # if fetched id does not match current user
-        raise ex_notAuthToPerformAction
+    await check_own_account(db, id, curr_user)     # if user does not exist or is not the current user
 
-    verified_image = verify_image(prof_picture.file.read())     # verifycation if file is a valid picture file
+    # verifycation if file is a valid picture file
+    image_data = await read_upload(prof_picture)     # chunked, 413 when too large
+    verified_image, variants = await image_pool.run(prepare_image, image_data)     # with smaller sizes and WebP
 
-    user_query.update({'profile_picture': verified_image}, synchronize_session=False)
-    db.commit()
+    picture, key = await save_image(verified_image)    # to database or image storage
+    await save_image_variants(db, key, variants)
+    updated_at = datetime.now(timezone.utc)
+    await db.execute(update(models.User).where(models.User.id == id)
+                     .values(profile_picture=picture, profile_picture_key=key,
+                             profile_picture_type=verified_image.media_type, profile_picture_updated_at=updated_at))
+    await db.commit()
+    principal_cache.invalidate(id)
 
-    return StreamingResponse(io.BytesIO(user_query.first().profile_picture),
-                             media_type=prof_picture.content_type)
+    return image_upload_response(verified_image, updated_at)
 
 
 # DELETE endpoint for deleting user
 @router.delete("/{id}", status_code=status.HTTP_204_NO_CONTENT,
                responses={401: {'description': 'Unauthorized'},
                           404: {'description': 'Not found'}})
-def delete_user_account(id: int, curr_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_user_account(id: int, curr_user: UserPrincipal = Depends(get_current_user),
+                              db: AsyncSession = Depends(get_db)):
 
     """
     **DELETE endpoint for user**
@@ -311,13 +320,13 @@ def delete_user_account(id: int, curr_user: models.User = Depends(get_current_us
 
     """
 
-    user_query = db.query(models.User).filter(models.User.id == id)
-    user = user_query.first()
+    user = (await db.execute(select(models.User).where(models.User.id == id))).scalars().first()
 
     if user is None or id == 0:  # if user does not exist raise an exception
         raise ex_userNotFound
     elif user.id != curr_user.id:   # if current user is not the fecthed user raise an exception
         raise ex_notAuthToPerformAction
 
-    user_query.delete(synchronize_session=False)    # delete user
-    db.commit()
+    await db.execute(delete(models.User).where(models.User.id == id))    # delete user
+    await db.commit()
+    principal_cache.invalidate(id)
@@ -1,15 +1,16 @@
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
-from sqlalchemy.exc import IntegrityError
+from fastapi import APIRouter, Depends, Query, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, insert, select
 from ..database import get_db
 from .. import models
-from ..schemas.weight_measurement import WeightIn, WeightOut
-from typing import List, Optional
+from ..schemas.weight_measurement import WeightIn, WeightOut, WeightSeriesPoint
+from ..schemas.users import UserPrincipal
+from typing import List
 from ..oauth2 import get_current_user
-from dateutil import parser
-from ..utils import ex_formatter
+from ..writes import write_returning
+from ..pagination import PageParams, Keyset, decode_cursor, estimate_count, set_page_headers
+from ..dates import DateRange
 
 # Authentification router init
 router = APIRouter(
@@ -19,16 +20,92 @@ router = APIRouter(
 )
 
 
+def weight_query(id_user: int, dates: DateRange):  # measurements of user in date range, uses index on (id_user, time)
+    return select(models.Weightmeasure).where(models.Weightmeasure.id_user == id_user,
+                                              *dates.where(models.Weightmeasure.measure_time))
+
+
+MAX_SERIES_POINTS = 1000
+
+
+def weight_series_query(id_user: int, dates: DateRange, points: int, window: int):
+    """
+    Weight measurements of user in date range downsampled to at most given number of points.
+    Time between first and last measurement is split to equal buckets, every bucket is averaged,
+    trend is moving average of window buckets. Whole computation runs in database.
+    """
+
+    epoch = func.extract('epoch', models.Weightmeasure.measure_time)
+    measurements = select(epoch.label('epoch'), models.Weightmeasure.weight) \
+        .where(models.Weightmeasure.id_user == id_user, *dates.where(models.Weightmeasure.measure_time)) \
+        .cte('measurements')
+
+    bounds = select(func.min(measurements.c.epoch).label('low'), func.max(measurements.c.epoch).label('high')) \
+        .cte('bounds')
+
+    # bucket number is computed in subquery, so grouping does not repeat expression with bound parameters
+    bucket = func.least(func.width_bucket(measurements.c.epoch, bounds.c.low,
+                                          func.greatest(bounds.c.high, bounds.c.low + 1), points), points)
+    bucketed = select(measurements.c.epoch, measurements.c.weight, bucket.label('bucket')) \
+        .select_from(measurements).join(bounds, True).subquery()
+
+    averages = select(bucketed.c.bucket, func.to_timestamp(func.avg(bucketed.c.epoch)).label('measure_time'),
+                      func.avg(bucketed.c.weight).label('weight'), func.count().label('measurements')) \
+        .group_by(bucketed.c.bucket).subquery()
+
+    trend = func.avg(averages.c.weight).over(order_by=averages.c.bucket, rows=(-(window - 1), 0))
+    return select(averages.c.measure_time, averages.c.weight, trend.label('trend'), averages.c.measurements) \
+        .order_by(averages.c.bucket)
+
+
+# GET endpoint for getting downsampled weight measurements for charts
+@router.get("/series", response_model=List[WeightSeriesPoint], status_code=status.HTTP_200_OK,
+            responses={400: {'description': 'Bad request - unknown time zone'}})
+async def get_weight_series(dates: DateRange = Depends(), points: int = Query(100, ge=1, le=MAX_SERIES_POINTS),
+                            window: int = Query(7, ge=1, le=MAX_SERIES_POINTS), db: AsyncSession = Depends(get_db),
+                            curr_user: UserPrincipal = Depends(get_current_user)):
+    """
+    **GET endpoint for getting weight measurements downsampled for charts**
+
+    Query parameter:
+    - Optional **date**, **from**, **to**, **tz**: range of dates as in GET /weight_measurement/
+    - Optional **points**: maximum number of returned points (default 100)
+    - Optional **window**: number of points in moving average of trend (default 7)
+
+    Time between first and last measurement in range is split to **points** equal parts,
+    measurements in every part are averaged, parts without measurements are left out.
+
+    Response body:
+    - **measure_time**: average time of measurements in part
+    - **weight**: average weight
+    - **trend**: moving average of weight
+    - **measurements**: number of averaged measurements
+
+    """
+
+    if not dates.valid:  # check if date is valid
+        return []
+
+    return (await db.execute(weight_series_query(curr_user.id, dates, points, window))).all()
+
+
 # GET endpoint for getting weight measurement based on date
-@router.get("/", response_model=List[WeightOut], status_code=status.HTTP_200_OK)
-def get_weight_measurement(date: Optional[str] = '', db: Session = Depends(get_db),
-                           curr_user: models.User = Depends(get_current_user)):
+@router.get("/", response_model=List[WeightOut], status_code=status.HTTP_200_OK,
+            responses={400: {'description': 'Bad request - unknown time zone or invalid cursor'}})
+async def get_weight_measurement(response: Response, dates: DateRange = Depends(), page: PageParams = Depends(),
+                                 db: AsyncSession = Depends(get_db),
+                                 curr_user: UserPrincipal = Depends(get_current_user)):
 
     """
     **GET endpoint for getting weight measurement based on date**
 
     Query patameter:
     - Optional **date**: date of measuremnts, if empty fetches every weight measurement of current user
+    - Optional **from**, **to**: range of dates (both included) instead of single date
+    - Optional **tz**: time zone of client, e.g. Europe/Bratislava (default UTC)
+    - Optional **limit**: maximum number of returned measurements
+    - Optional **after**: cursor of next page (from **X-Next-Cursor** response header)
+    - Optional **total**: return estimated number of measurements in **X-Total-Estimate** header
 
     Response body:
     - **weight**: inserted weight
@@ -36,17 +113,19 @@ def get_weight_measurement(date: Optional[str] = '', db: Session = Depends(get_d
 
     """
 
-    if date == '':  # if no date was provided return every measuremnt of current user
-        answer = db.query(models.Weightmeasure).filter(models.Weightmeasure.id_user == curr_user.id).all()
-    else:
-        try:  # check if date is valid
-            date = str(parser.parse(date).date())
-        except Exception:
-            return []
+    if not dates.valid:  # check if date is valid
+        return []
+
+    after = decode_cursor(page.after, datetime, int) if page.after is not None else None
+
+    # fetch weight measurements of current user (every one if no date was provided)
+    query = weight_query(curr_user.id, dates)
 
-        # fetch weight measurement
-        answer = db.query(models.Weightmeasure).filter((func.date(models.Weightmeasure.measure_time) >= date),
-                                                       func.date(models.Weightmeasure.measure_time) <= date).all()
+    keyset = Keyset((models.Weightmeasure.measure_time, False), (models.Weightmeasure.id, False))
+    total = await estimate_count(db, query) if page.total else None
+    rows = (await db.execute(keyset.apply(query, page.limit, after))).all()
+    answer, next_cursor = keyset.page(rows, page.limit)
+    set_page_headers(response, next_cursor, total)
 
     return answer
 
@@ -54,8 +133,8 @@ def get_weight_measurement(date: Optional[str] = '', db: Session = Depends(get_d
 # POST endpoint for adding new weight measurement
 @router.post("/", response_model=WeightOut, status_code=status.HTTP_200_OK,
              responses={403: {'description': 'Forbidden - Integrity or Data error (violated DB constraints)'}})
-def add_weight_measurement(weight: WeightIn, db: Session = Depends(get_db),
-                           curr_user: models.User = Depends(get_current_user)):
+async def add_weight_measurement(weight: WeightIn, db: AsyncSession = Depends(get_db),
+                                 curr_user: UserPrincipal = Depends(get_current_user)):
     """
         **POST endpoint for adding new weight measurement**
 
@@ -68,20 +147,6 @@ def add_weight_measurement(weight: WeightIn, db: Session = Depends(get_db),
 
         """
 
-    # get curent datetime and create new weigh measurement
-    time = datetime.now()
-    new_measurement = models.Weightmeasure(id_user=curr_user.id, measure_time=time, **weight.dict())
-    try:    # add to database
-        db.add(new_measurement)
-        db.commit()
-    except IntegrityError as e:     # if database constrains were violated raise an exception
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=ex_formatter(e))
-    except Exception as e:  # when other exception occured (data error)
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e.__cause__))
-
-    # fetch added weight measurement
-    fetched = db.query(models.Weightmeasure.weight, models.Weightmeasure.measure_time).filter \
-        (and_(models.Weightmeasure.id_user == curr_user.id,
-              models.Weightmeasure.measure_time == time)).first()
-
-    return fetched
+    # add to database, measure_time is set by database and returned by the insert
+    return await write_returning(db, insert(models.Weightmeasure).values(id_user=curr_user.id, **weight.dict()),
+                                 WeightOut, models.Weightmeasure)
@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+import datetime
 
 
 # Response foodlist schema
@@ -13,3 +14,13 @@ class FoodListOut(BaseModel):
 class FoodListAdd(BaseModel):
     id_food: int
     amount: float
+
+
+# Response daily summary of food list
+class DailyIntakeOut(BaseModel):
+    day: datetime.date
+    kcal: float
+    entries: int
+
+    class Config:
+        orm_mode = True
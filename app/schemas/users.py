@@ -55,6 +55,23 @@ class UserUpdatedOut(UserOut):
     height: float
 
 
+# Authenticated user (current user of request)
+class UserPrincipal(BaseModel):
+    id: int
+    email: EmailStr
+    first_name: str
+    last_name: str
+    gender: int
+    age: int
+    goal_weight: Optional[float]
+    height: Optional[float]
+    state: Optional[int]
+    is_nutr_adviser: Optional[bool]
+
+    class Config:
+        orm_mode = True
+
+
 # Login schema
 class UserLogin(BaseModel):
     email: EmailStr
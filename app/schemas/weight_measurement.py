@@ -14,3 +14,14 @@ class WeightOut(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+# Point of downsampled weight series (average of measurements in one time bucket)
+class WeightSeriesPoint(BaseModel):
+    measure_time: datetime.datetime
+    weight: float
+    trend: float
+    measurements: int
+
+    class Config:
+        orm_mode = True
@@ -0,0 +1,255 @@
+from fastapi import Request, status
+from sqlalchemy import and_, select
+from sqlalchemy.dialects.postgresql import insert
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse, Response, StreamingResponse
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from . import models
+from .config import env
+
+import hashlib
+import os
+import re
+import tempfile
+
+# Image storage: images are kept in database (bytea columns, default) or as files
+# in content addressed directory (IMAGE_STORAGE=filesystem), row then stores only the key.
+
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+IMAGE_SIZES = (64, 256, 1024)   # sizes (longer side in px) of image derivatives created on upload
+
+
+def content_key(data: bytes) -> str:  # key of image is sha256 of its content
+    return hashlib.sha256(data).hexdigest()
+
+
+class VerifiedImage(NamedTuple):  # uploaded image accepted by verify_image
+    data: bytes
+    media_type: str     # e.g. image/png
+    key: str            # sha256 of data
+
+
+class FileSystemStore:
+    """
+    Content addressed directory, file of image with key 'abcd...' is stored as root/ab/cd/abcd...
+    Same image uploaded more times is stored only once.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / key[2:4] / key
+
+    def exists(self, key: str) -> bool:
+        return self.path(key).is_file()
+
+    def put(self, data: bytes, key: Optional[str] = None) -> str:
+        key = key or content_key(data)
+        path = self.path(key)
+        if path.is_file():  # deduplication, content is already stored
+            return key
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        try:    # write to temporary file and rename, so readers never see partial file
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        return key
+
+    def delete(self, key: str):
+        self.path(key).unlink(missing_ok=True)
+
+    def keys(self):  # every stored key
+        for path in self.root.glob('*/*/*'):
+            if path.is_file() and not path.name.startswith('.tmp-'):
+                yield path.name
+
+
+image_store = FileSystemStore(env.image_storage_path) if env.image_storage == 'filesystem' else None
+
+
+def file_response(request: Request, path: Path, media_type: str, headers: Optional[dict] = None) -> Response:
+    """
+    Response with image file, file is streamed by the server without loading it to memory.
+    Supports single byte range requests (Range: bytes=start-end).
+    """
+
+    headers = {**(headers or {}), 'Accept-Ranges': 'bytes'}
+    size = path.stat().st_size
+    match = RANGE_HEADER.match(request.headers.get('range', ''))
+
+    if match is None or match.group(1) == match.group(2) == '':    # whole file
+        return FileResponse(path, media_type=media_type, headers=headers)
+
+    if match.group(1) == '':    # suffix range, last n bytes
+        start, end = max(size - int(match.group(2)), 0), size - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+
+    if start > end or start >= size:    # range not satisfiable
+        return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                        headers={'Content-Range': f"bytes */{size}"})
+
+    def read_range():
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    return StreamingResponse(read_range(), status_code=status.HTTP_206_PARTIAL_CONTENT, media_type=media_type,
+                             headers={**headers, 'Content-Range': f"bytes {start}-{end}/{size}",
+                                      'Content-Length': str(end - start + 1)})
+
+
+async def save_image(image: VerifiedImage) -> Tuple[Optional[bytes], str]:
+    """
+    Stores verified image, returns values for picture (bytea) and picture key columns of row.
+    With filesystem storage picture column is cleared, image is only in file.
+    """
+
+    if image_store is None:
+        return image.data, image.key
+
+    await run_in_threadpool(image_store.put, image.data, image.key)
+    return None, image.key
+
+
+def sniff_media_type(head: bytes) -> str:  # MIME type from file signature, for images stored without type
+    return 'image/png' if head.startswith(PNG_SIGNATURE) else 'image/jpeg'
+
+
+def cache_headers(key: str, updated_at: Optional[datetime]) -> dict:
+    # key is hash of image content, so it is used as strong ETag
+    headers = {'ETag': f'"{key}"', 'Vary': 'Accept', 'Cache-Control': f"private, max-age={env.image_cache_max_age}"
+               if env.image_cache_max_age > 0 else 'private, no-cache'}
+    if updated_at is not None:
+        headers['Last-Modified'] = format_datetime(updated_at.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def not_modified(request: Request, key: str, updated_at: Optional[datetime]) -> bool:
+    # If-None-Match takes precedence over If-Modified-Since (RFC 7232)
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = {tag.strip()[2:] if tag.strip().startswith('W/') else tag.strip() for tag in if_none_match.split(',')}
+        return '*' in tags or f'"{key}"' in tags
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is None or updated_at is None:
+        return False
+    try:
+        return updated_at.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+
+async def image_response(request: Request, key: Optional[str], media_type: Optional[str],
+                         updated_at: Optional[datetime],
+                         load_picture: Callable[[], Awaitable[Optional[bytes]]]) -> Optional[Response]:
+    """
+    Response with image of row given by its key, type and modification time columns, None when there is no image.
+    Image is not decoded, picture (bytea) is loaded by load_picture only when it is not in image storage
+    and client does not have current version (304 Not Modified).
+    """
+
+    if key is None:
+        return None
+
+    headers = cache_headers(key, updated_at)
+    if not_modified(request, key, updated_at):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if image_store is not None and image_store.exists(key):
+        path = image_store.path(key)
+        if media_type is None:
+            with open(path, 'rb') as f:
+                media_type = sniff_media_type(f.read(len(PNG_SIGNATURE)))
+        return file_response(request, path, media_type, headers)
+
+    picture = await load_picture()
+    if picture is None:
+        return None
+
+    return Response(bytes(picture), media_type=media_type or sniff_media_type(picture), headers=headers)
+
+
+def image_upload_response(image: VerifiedImage, updated_at: datetime) -> Response:  # response with uploaded image
+    return Response(image.data, media_type=image.media_type, headers=cache_headers(image.key, updated_at))
+
+
+# Image derivatives: on upload image is resized to IMAGE_SIZES in original format and WebP (see utils.image_variants),
+# variants are stored like images (database or filesystem) and listed in image_variants table.
+
+def variant_name(size: int, webp: bool) -> str:
+    return f"{size}.webp" if webp else str(size)
+
+
+def requested_variant(request: Request, size: Optional[int]) -> Optional[str]:
+    """
+    Variant for size query parameter and Accept header: smallest derivative at least as large as requested size,
+    WebP when client accepts it. None means original image.
+    """
+
+    webp = 'image/webp' in request.headers.get('accept', '')
+    if size is None and not webp:
+        return None
+
+    if size is None:    # original size, only format differs
+        return variant_name(IMAGE_SIZES[-1], webp)
+    return variant_name(next((s for s in IMAGE_SIZES if s >= size), IMAGE_SIZES[-1]), webp)
+
+
+def select_image(key_column, type_column, updated_column, variant: Optional[str]):
+    # image metadata of row with requested variant joined (variant columns are None when it does not exist)
+    return select(key_column.label('key'), type_column.label('media_type'), updated_column.label('updated_at'),
+                  models.ImageVariant.variant, models.ImageVariant.variant_key,
+                  models.ImageVariant.media_type.label('variant_type')) \
+        .outerjoin(models.ImageVariant, and_(models.ImageVariant.image_key == key_column,
+                                             models.ImageVariant.variant == variant))
+
+
+async def image_variant_response(request: Request, db, image,
+                                 load_picture: Callable[[], Awaitable[Optional[bytes]]]) -> Optional[Response]:
+    """
+    Response with image selected by select_image, requested variant when it exists, else original image.
+    """
+
+    if image.variant_key is None:
+        return await image_response(request, image.key, image.media_type, image.updated_at, load_picture)
+
+    async def load_variant():
+        return (await db.execute(select(models.ImageVariant.data)
+                                 .where(models.ImageVariant.image_key == image.key,
+                                        models.ImageVariant.variant == image.variant))).scalar()
+
+    return await image_response(request, image.variant_key, image.variant_type, image.updated_at, load_variant)
+
+
+async def save_image_variants(db, image_key: str, variants: Dict[str, VerifiedImage]):
+    # stores variants of image, in the transaction of db (variants of the same image are already stored)
+    rows = []
+    for variant, image in variants.items():
+        data, key = await save_image(image)
+        rows.append({'image_key': image_key, 'variant': variant, 'variant_key': key,
+                     'media_type': image.media_type, 'data': data})
+
+    if rows:
+        await db.execute(insert(models.ImageVariant).values(rows).on_conflict_do_nothing())
@@ -0,0 +1,58 @@
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Iterable, Type
+from pydantic import BaseModel
+
+from .config import env
+
+# Streaming responses of whole result sets (?stream=true on list endpoints)
+# Rows are read from server-side cursor in batches of stream_batch_size and encoded batch by batch,
+# so the first bytes are sent right after the first batch and memory does not grow with number of rows.
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+
+def wants_ndjson(request: Request) -> bool:  # NDJSON (one object per line) instead of JSON array
+    return NDJSON_MEDIA_TYPE in request.headers.get('accept', '')
+
+
+async def stream_rows(db, statement) -> AsyncIterator[list]:
+    """
+    Batches of entities selected by statement, read from server-side cursor (stream_results, yield_per).
+    Same for AsyncSession and ThreadpoolSession, both have stream().
+    """
+
+    result = await db.stream(statement.execution_options(yield_per=env.stream_batch_size))
+    try:
+        async for batch in result.scalars().partitions():
+            yield batch
+    finally:
+        await result.close()
+
+
+async def encode_batches(batches: AsyncIterator[Iterable], schema: Type[BaseModel], ndjson: bool):
+    # JSON array (or NDJSON lines) of batches validated by response schema, one chunk per batch
+    separator = '\n' if ndjson else ','
+    first = True
+    if not ndjson:
+        yield '['
+
+    async for batch in batches:
+        items = separator.join(schema.parse_obj(item).json() if isinstance(item, dict)
+                               else schema.from_orm(item).json() for item in batch)
+        if not items:
+            continue
+        if ndjson:
+            yield items + '\n'
+        else:
+            yield items if first else ',' + items
+        first = False
+
+    if not ndjson:
+        yield ']'
+
+
+def streaming_response(request: Request, batches: AsyncIterator[Iterable], schema: Type[BaseModel]):
+    ndjson = wants_ndjson(request)
+    return StreamingResponse(encode_batches(batches, schema, ndjson),
+                             media_type=NDJSON_MEDIA_TYPE if ndjson else 'application/json')
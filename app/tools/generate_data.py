@@ -0,0 +1,272 @@
+"""
+Generates synthetic users, foods, recipes, food list entries and weight series and loads them with COPY,
+for profiling against production sized data. Activity of users is skewed (Pareto distribution, few users
+log most of the entries), popularity of foods follows Zipf's law, entries are logged at meal times.
+Generated rows are added to existing data, ids of users and foods are reserved from their sequences.
+
+Usage: python -m app.tools.generate_data [--users 10000] [--foods 5000] [--entries 200] [--weights 30]
+                                         [--recipes 1] [--days 365] [--skew 1.5] [--rebuild-indexes]
+- --entries, --weights, --recipes: average number of rows per user
+- --skew:            Pareto shape of user activity, lower is more skewed, 0 gives every user the same activity
+- --rebuild-indexes: drop secondary indexes of loaded table and create them again after COPY (faster for large loads)
+- --email:           e-mail of users, {n} is replaced by user id (default user{n}@example.com)
+- --password:        password of every generated user (hashed once with BCRYPT_ROUNDS)
+Runs against database configured in .env with the sync engine, every table is loaded in its own transaction.
+"""
+
+from sqlalchemy import func, select, text
+from typing import Callable, Iterable, List, NamedTuple, Optional
+from datetime import datetime, timedelta, timezone
+from array import array
+
+from .. import models, utils
+from ..database import engine
+from ..routers.foodlist import intake_rollup
+
+import argparse
+import io
+import itertools
+import json
+import math
+import random
+import time
+
+FIRST_NAMES = (('Anna', 'Eva', 'Maria', 'Lucia', 'Zuzana', 'Aurora', 'Petra', 'Jana', 'Sofia', 'Nina'),
+               ('Peter', 'Jan', 'Lukas', 'Martin', 'Tomas', 'Jack', 'Simon', 'Richard', 'Michal', 'Adam'))
+LAST_NAMES = ('Novak', 'Horvath', 'Kovac', 'Varga', 'Toth', 'Knowles', 'Cooke', 'Carey', 'Strbo', 'Szarka',
+              'Balaz', 'Molnar', 'Nagy', 'Baran', 'Kral', 'Hudak', 'Lukac', 'Polak', 'Urban', 'Sedlak')
+FOOD_NOUNS = ('apple', 'bread', 'cheese', 'chicken', 'rice', 'milk', 'yogurt', 'banana', 'potato', 'tomato',
+              'pasta', 'beef', 'salmon', 'butter', 'honey', 'carrot', 'orange', 'pork', 'egg', 'oat',
+              'soup', 'salad', 'ham', 'sausage', 'cake', 'juice', 'beans', 'lentils', 'tofu', 'pizza')
+FOOD_KINDS = ('', 'fresh', 'boiled', 'baked', 'fried', 'smoked', 'wholegrain', 'light', 'organic', 'dried')
+MEAL_HOURS = ((7, 0.3), (12, 0.3), (18, 0.25), (15, 0.1), (21, 0.05))   # (hour, probability) of logged entries
+
+
+class Cardinalities(NamedTuple):
+    users: int
+    foods: int
+    entries: float  # per user, on average
+    weights: float
+    recipes: float
+    days: int       # history of entries and weights
+    skew: float
+
+
+def copy_value(value) -> str:  # value in COPY text format
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(cursor, table: str, columns: List[str], rows: Iterable[tuple], batch: int) -> int:
+    # streams rows with COPY in chunks of batch rows, so memory does not depend on number of rows
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    count = 0
+    rows = iter(rows)
+    while True:
+        buffer = io.StringIO()
+        chunk = 0
+        for row in itertools.islice(rows, batch):
+            buffer.write('\t'.join(copy_value(value) for value in row) + '\n')
+            chunk += 1
+        if chunk == 0:
+            return count
+
+        buffer.seek(0)
+        cursor.copy_expert(statement, buffer)
+        count += chunk
+
+
+def reserve_ids(connection, table: str, count: int) -> int:  # first of count consecutive ids taken from sequence
+    if count == 0:
+        return 0
+    last = connection.execute(text(f"SELECT setval('{table}_id_seq', nextval('{table}_id_seq') + :count - 1)"),
+                              {'count': count}).scalar()
+    return last - count + 1
+
+
+def secondary_indexes(connection, table: str) -> list:  # (name, definition) of indexes not backing constraints
+    return connection.execute(text(
+        """SELECT i.indexname, i.indexdef FROM pg_indexes AS i
+           WHERE i.schemaname = 'public' AND i.tablename = :table
+             AND NOT EXISTS (SELECT 1 FROM pg_constraint AS c WHERE c.conindid = (quote_ident(i.indexname))::regclass)"""),
+        {'table': table}).all()
+
+
+def rng_round(rng: random.Random, value: float) -> int:  # random rounding, keeps the average
+    whole = math.floor(value)
+    return whole + (rng.random() < value - whole)
+
+
+class Generator:
+    """
+    Deterministic (by seed) generator of rows. Activity and goal weight of every user are kept in arrays,
+    other rows are generated lazily while they are copied.
+    """
+
+    def __init__(self, counts: Cardinalities, seed: int, email: str, password_hash: str):
+        self.counts = counts
+        self.rng = random.Random(seed)
+        self.email = email
+        self.password_hash = password_hash
+        self.now = datetime.now(timezone.utc).replace(microsecond=0)
+        self.first_user = self.first_food = 0
+        self.activity = array('d')
+        self.goal = array('d')
+        self.food_weights: Optional[list] = None
+
+    def user_activity(self) -> float:  # Pareto distributed with mean 1
+        alpha = self.counts.skew
+        if alpha <= 1:  # mean of Pareto distribution is infinite, use uniform activity
+            return 1.0
+        return min(self.rng.paretovariate(alpha) * (alpha - 1) / alpha, 100.0)
+
+    def users(self):
+        rng = self.rng
+        for i in range(self.counts.users):
+            user_id = self.first_user + i
+            gender = rng.choices((0, 1, 2), (0.49, 0.49, 0.02))[0]
+            first_name = rng.choice(FIRST_NAMES[gender % 2])
+            height = round(rng.gauss(165 if gender == 0 else 178, 7), 1)
+            goal_weight = round(rng.gauss(23, 2.5) * (height / 100) ** 2, 1)
+            self.activity.append(self.user_activity())
+            self.goal.append(goal_weight)
+            yield (user_id, self.email.format(n=user_id), self.password_hash, first_name, rng.choice(LAST_NAMES),
+                   gender, min(max(int(rng.gauss(35, 12)), 16), 90), goal_weight, height, rng.randint(0, 2),
+                   rng.random() < 0.02, self.now - timedelta(days=rng.uniform(0, self.counts.days)))
+
+    def foods(self):
+        rng = self.rng
+        for i in range(self.counts.foods):
+            title = f"{rng.choice(FOOD_KINDS)} {rng.choice(FOOD_NOUNS)}".strip().capitalize()
+            kcal = round(min(max(rng.lognormvariate(math.log(180), 0.7), 1), 900), 1)
+            yield self.first_food + i, f"{title} {i + 1}", kcal
+
+    def food_id(self) -> int:  # food by popularity (Zipf's law, rank 1 is the most popular)
+        if self.food_weights is None:
+            self.food_weights = list(itertools.accumulate(1 / rank for rank in range(1, self.counts.foods + 1)))
+        return self.first_food + self.rng.choices(range(self.counts.foods), cum_weights=self.food_weights)[0]
+
+    def entry_time(self) -> datetime:
+        rng = self.rng
+        hour = rng.choices([hour for hour, _ in MEAL_HOURS], [p for _, p in MEAL_HOURS])[0]
+        day = self.now.replace(hour=0, minute=0, second=0) - timedelta(days=rng.randrange(self.counts.days))
+        return day + timedelta(hours=hour + rng.uniform(0, 2))
+
+    def food_list(self):
+        rng = self.rng
+        for i, activity in enumerate(self.activity):
+            for _ in range(rng_round(rng, self.counts.entries * activity)):
+                amount = round(min(max(rng.lognormvariate(math.log(150), 0.5), 5), 1000))
+                yield self.first_user + i, self.food_id(), amount, self.entry_time()
+
+    def weights(self):
+        rng = self.rng
+        for i, (activity, goal) in enumerate(zip(self.activity, self.goal)):
+            count = rng_round(rng, self.counts.weights * activity)
+            start = goal + rng.gauss(8, 5)
+            for n in range(count):  # evenly spread, moving half the way to goal weight
+                progress = (n + 1) / count
+                weight = max(start + (goal - start) * progress / 2 + rng.gauss(0, 0.4), 30)
+                measure_time = self.now - timedelta(days=self.counts.days * (1 - progress) + rng.uniform(0, 0.5))
+                yield self.first_user + i, round(weight, 1), measure_time
+
+    def recipes(self):
+        rng = self.rng
+        for i, activity in enumerate(self.activity):
+            for n in range(rng_round(rng, self.counts.recipes * activity)):
+                noun = rng.choice(FOOD_NOUNS)
+                title = f"{noun.capitalize()} {rng.choice(('bowl', 'pie', 'stew', 'salad'))} {n + 1}"
+                yield self.first_user + i, title, f"{noun}, salt, water", 'Mix everything and cook it.', \
+                    round(rng.uniform(50, 450), 1)
+
+
+def load_table(table: str, columns: List[str], rows: Iterable[tuple], batch: int, rebuild_indexes: bool,
+               after: Optional[Callable] = None) -> dict:
+    """
+    Loads rows to table in one transaction, secondary indexes are dropped before COPY and created after it
+    when rebuild_indexes is set. after(connection) runs in the transaction after COPY.
+    """
+
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        indexes = secondary_indexes(connection, table) if rebuild_indexes else []
+        for name, _ in indexes:
+            connection.execute(text(f'DROP INDEX "{name}"'))
+
+        count = copy_rows(connection.connection.cursor(), table, columns, rows, batch)
+
+        if after is not None:
+            after(connection)
+        if indexes:
+            connection.execute(text("SET LOCAL maintenance_work_mem = '512MB'"))
+        for _, definition in indexes:
+            connection.execute(text(definition))
+        connection.execute(text(f"ANALYZE {table}"))
+
+    seconds = time.perf_counter() - start
+    return {'rows': count, 'seconds': round(seconds, 2), 'rows_per_second': round(count / seconds) if seconds else None,
+            'rebuilt_indexes': [name for name, _ in indexes]}
+
+
+def generate(counts: Cardinalities, seed: int = 0, email: str = 'user{n}@example.com', password: str = 'password',
+             batch: int = 10000, rebuild_indexes: bool = False) -> dict:
+    """
+    Generates and loads all tables, returns rows and time of every table.
+    Food list entries are added to daily_intake rollup in the transaction which loads them.
+    """
+
+    generator = Generator(counts, seed, email, utils.pwd_hash(password))
+    with engine.begin() as connection:
+        generator.first_user = reserve_ids(connection, 'users', counts.users)
+        generator.first_food = reserve_ids(connection, 'food', counts.foods)
+        last_entry = connection.execute(select(func.coalesce(func.max(models.Foodlist.id), 0))).scalar()
+
+    def rollup(connection):     # daily totals of loaded entries (ids after last existing), as endpoints maintain them
+        food_list = models.Foodlist.__table__
+        connection.execute(intake_rollup(select(food_list).where(food_list.c.id > last_entry).subquery()))
+
+    return {
+        'users': load_table('users', ['id', 'email', 'password', 'first_name', 'last_name', 'gender', 'age',
+                                      'goal_weight', 'height', 'state', 'is_nutr_adviser', 'created_at'],
+                            generator.users(), batch, rebuild_indexes),
+        'food': load_table('food', ['id', 'title', 'kcal_100g'], generator.foods(), batch, rebuild_indexes),
+        'foodlist': load_table('foodlist', ['id_user', 'id_food', 'amount', 'time'], generator.food_list(),
+                               batch, rebuild_indexes, after=rollup),
+        'weightmeasurements': load_table('weightmeasurements', ['id_user', 'weight', 'measure_time'],
+                                         generator.weights(), batch, rebuild_indexes),
+        'recipes': load_table('recipes', ['id_user', 'title', 'ingredients', 'instructions', 'kcal_100g'],
+                              generator.recipes(), batch, rebuild_indexes),
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--users', type=int, default=10000, help='number of users')
+    arg_parser.add_argument('--foods', type=int, default=5000, help='number of foods')
+    arg_parser.add_argument('--entries', type=float, default=200, help='food list entries per user (average)')
+    arg_parser.add_argument('--weights', type=float, default=30, help='weight measurements per user (average)')
+    arg_parser.add_argument('--recipes', type=float, default=1, help='recipes per user (average)')
+    arg_parser.add_argument('--days', type=int, default=365, help='days of history')
+    arg_parser.add_argument('--skew', type=float, default=1.5, help='Pareto shape of user activity (0: uniform)')
+    arg_parser.add_argument('--seed', type=int, default=0, help='random seed')
+    arg_parser.add_argument('--email', default='user{n}@example.com', help='e-mail of users, {n} is user id')
+    arg_parser.add_argument('--password', default='password', help='password of generated users')
+    arg_parser.add_argument('--batch', type=int, default=10000, help='rows per COPY chunk')
+    arg_parser.add_argument('--rebuild-indexes', action='store_true', help='drop and create secondary indexes')
+    args = arg_parser.parse_args()
+
+    if args.foods == 0 and args.entries > 0:
+        raise SystemExit('Food list entries need generated foods (--foods)')
+
+    counts = Cardinalities(args.users, args.foods, args.entries, args.weights, args.recipes, args.days, args.skew)
+    report = generate(counts, args.seed, args.email, args.password, args.batch, args.rebuild_indexes)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+Imports foods from external nutrition dataset (CSV or NDJSON, one JSON object per line).
+Input is streamed: rows are validated against food table constraints, valid rows are copied (COPY) to a temporary
+staging table and merged into food with one INSERT ... ON CONFLICT by (source, external_id). Re-importing updated
+dataset updates changed foods and adds new ones, unchanged rows are not written. Only written rows are locked,
+so searches read food table during the whole import. Daily intake totals of days with entries of updated foods
+are recomputed in the same transaction. Foods missing from newer dataset are kept (they can be in food lists
+of users, deleting them would delete the entries).
+
+Usage: python -m app.tools.import_foods FILE --source usda [--format csv] [--rejects rejects.csv]
+                                        [--id-column id] [--title-column title] [--kcal-column kcal_100g]
+- FILE:      path of dataset, - reads standard input
+- --source:  name of dataset, imported foods are identified by it and their id in it
+- --rejects: CSV report of rejected rows (line, reason, row)
+Runs against database configured in .env with the sync engine, prints counts of the import.
+In-memory food catalog (FOOD_CATALOG=true) reloads changed food table on its next refresh.
+"""
+
+from sqlalchemy import Boolean, column, func, literal, literal_column, select, table, text
+from sqlalchemy.dialects.postgresql import insert
+from typing import Iterator, Optional, Tuple
+
+from .. import models
+from ..database import engine
+from ..routers.foodlist import intake_recompute
+from .generate_data import copy_rows
+
+import argparse
+import csv
+import io
+import json
+import math
+import sys
+import time
+
+MAX_TITLE = models.Food.title.type.length
+MAX_EXTERNAL_ID = models.Food.external_id.type.length
+MAX_SOURCE = models.Food.source.type.length
+
+
+def read_rows(file, file_format: str, delimiter: str) -> Iterator[Tuple[int, Optional[dict], str]]:
+    # (line, parsed row or None, error) of every input row, one row in memory at a time
+    if file_format == 'csv':
+        reader = csv.DictReader(file, delimiter=delimiter)
+        for row in reader:
+            yield reader.line_num, row, ''
+        return
+
+    for line, raw in enumerate(file, start=1):
+        if not raw.strip():
+            continue
+        try:
+            row = json.loads(raw)
+        except ValueError as e:
+            yield line, None, f"invalid JSON: {e}"
+            continue
+        yield (line, row, '') if isinstance(row, dict) else (line, None, 'not a JSON object')
+
+
+def validate(row: dict, id_column: str, title_column: str, kcal_column: str) -> Tuple[str, str, float]:
+    # (external id, title, kcal) of row, ValueError with reason when it violates food constraints
+    external_id = str(row.get(id_column) or '').strip()
+    if not external_id:
+        raise ValueError('missing id')
+    if len(external_id) > MAX_EXTERNAL_ID:
+        raise ValueError(f"id longer than {MAX_EXTERNAL_ID} characters")
+
+    title = ' '.join(str(row.get(title_column) or '').split())
+    if len(title) < 2:
+        raise ValueError('title shorter than 2 characters')
+    if len(title) > MAX_TITLE:
+        raise ValueError(f"title longer than {MAX_TITLE} characters")
+
+    try:
+        kcal = float(row.get(kcal_column))
+    except (TypeError, ValueError):
+        raise ValueError('kcal_100g is not a number')
+    if not math.isfinite(kcal) or kcal <= 0:
+        raise ValueError('kcal_100g has to be positive')
+
+    return external_id, title, kcal
+
+
+class Importer:
+    # validates input rows and counts them, rejected rows are written to rejects report
+
+    def __init__(self, id_column: str, title_column: str, kcal_column: str, rejects=None):
+        self.columns = (id_column, title_column, kcal_column)
+        self.rejects = csv.writer(rejects) if rejects is not None else None
+        self.read = 0
+        self.rejected = 0
+        if self.rejects is not None:
+            self.rejects.writerow(['line', 'reason', 'row'])
+
+    def reject(self, line: int, reason: str, row):
+        self.rejected += 1
+        if self.rejects is not None:
+            self.rejects.writerow([line, reason, json.dumps(row, ensure_ascii=False) if row is not None else ''])
+
+    def valid_rows(self, rows):
+        for line, row, error in rows:
+            self.read += 1
+            if row is None:
+                self.reject(line, error, None)
+                continue
+            try:
+                yield (line, *validate(row, *self.columns))
+            except ValueError as e:
+                self.reject(line, str(e), row)
+
+
+def merge(connection, source: str) -> Tuple[int, int]:
+    """
+    Merges staging table into food, last row of duplicate ids wins. Returns numbers of inserted and updated foods.
+    Row is updated only when title or kcal changed, daily_intake rollup of entries with updated foods is recomputed.
+    """
+
+    staging = table('food_import', column('line'), column('external_id', models.Food.external_id.type),
+                    column('title', models.Food.title.type), column('kcal_100g', models.Food.kcal_100g.type))
+    latest = select(staging.c.external_id, staging.c.title, staging.c.kcal_100g) \
+        .distinct(staging.c.external_id).order_by(staging.c.external_id, staging.c.line.desc()).subquery()
+    food = models.Food.__table__
+    upsert = insert(food).from_select(['source', 'external_id', 'title', 'kcal_100g'],
+                                      select(literal(source, models.Food.source.type), latest.c.external_id,
+                                             latest.c.title, latest.c.kcal_100g))
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[food.c.source, food.c.external_id],
+        set_={'title': upsert.excluded.title, 'kcal_100g': upsert.excluded.kcal_100g},
+        where=func.row(food.c.title, food.c.kcal_100g).op('IS DISTINCT FROM')(
+            func.row(upsert.excluded.title, upsert.excluded.kcal_100g)))
+    # xmax of inserted row version is 0, of updated one it is the updating transaction
+    result = connection.execute(upsert.returning(food.c.id, literal_column('xmax = 0', Boolean).label('inserted')))
+    inserted, updated_ids = 0, []
+    for food_id, row_inserted in result:    # one row per written food
+        if row_inserted:
+            inserted += 1
+        else:
+            updated_ids.append(food_id)
+
+    if updated_ids:     # rollup keeps kcal of the time entries were added
+        connection.execute(intake_recompute(updated_ids))
+    return inserted, len(updated_ids)
+
+
+def import_foods(file, source: str, file_format: str = 'csv', delimiter: str = ',', id_column: str = 'id',
+                 title_column: str = 'title', kcal_column: str = 'kcal_100g', rejects=None,
+                 batch: int = 10000) -> dict:
+    start = time.perf_counter()
+    importer = Importer(id_column, title_column, kcal_column, rejects)
+
+    with engine.begin() as connection:
+        # temporary table is private to the import, food table is not touched until the merge
+        connection.execute(text("CREATE TEMPORARY TABLE food_import (line bigint, external_id text, title text, "
+                                "kcal_100g double precision) ON COMMIT DROP"))
+        valid = copy_rows(connection.connection.cursor(), 'food_import', ['line', 'external_id', 'title', 'kcal_100g'],
+                          importer.valid_rows(read_rows(file, file_format, delimiter)), batch)
+        unique = connection.execute(text("SELECT count(DISTINCT external_id) FROM food_import")).scalar()
+        inserted, updated = merge(connection, source)
+
+    if inserted or updated:
+        with engine.connect() as connection:
+            connection.execute(text("ANALYZE food"))
+
+    return {'source': source, 'read': importer.read, 'rejected': importer.rejected, 'valid': valid,
+            'duplicates': valid - unique, 'inserted': inserted, 'updated': updated,
+            'unchanged': unique - inserted - updated, 'seconds': round(time.perf_counter() - start, 2)}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('file', help='CSV or NDJSON file, - for standard input')
+    arg_parser.add_argument('--source', required=True, help='name of dataset (upsert key with id)')
+    arg_parser.add_argument('--format', choices=('csv', 'ndjson'), default='csv', help='input format')
+    arg_parser.add_argument('--delimiter', default=',', help='CSV delimiter')
+    arg_parser.add_argument('--id-column', default='id', help='column with id of food in dataset')
+    arg_parser.add_argument('--title-column', default='title', help='column with food title')
+    arg_parser.add_argument('--kcal-column', default='kcal_100g', help='column with kcal per 100g')
+    arg_parser.add_argument('--rejects', help='CSV report of rejected rows')
+    arg_parser.add_argument('--batch', type=int, default=10000, help='rows per COPY chunk')
+    args = arg_parser.parse_args()
+
+    if len(args.source) > MAX_SOURCE:
+        raise SystemExit(f"Source name longer than {MAX_SOURCE} characters")
+
+    file = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='') if args.file == '-' \
+        else open(args.file, encoding='utf-8', newline='')
+    rejects = open(args.rejects, 'w', newline='') if args.rejects else None
+    try:
+        report = import_foods(file, args.source, args.format, args.delimiter, args.id_column, args.title_column,
+                              args.kcal_column, rejects, args.batch)
+    finally:
+        file.close()
+        if rejects is not None:
+            rejects.close()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Moves images stored in database (bytea columns) to filesystem image storage.
+Every moved image is written to content addressed directory, row keeps only its key
+and the bytea column is cleared. Safe to run repeatedly, images whose file is already stored are not rewritten,
+so repeated runs with --keep only write images added since the previous run.
+
+Usage: python -m app.tools.migrate_images [--path images] [--batch 100] [--keep] [--gc] [--variants]
+- --path:     image storage directory (default IMAGE_STORAGE_PATH)
+- --keep:     keep bytea columns filled (only write files and keys)
+- --gc:       afterwards delete files and variants not referenced by any row (run while uploads are stopped)
+- --variants: instead of moving, create missing derivatives (sizes, WebP) of images uploaded before they existed,
+              derivatives are stored where their image is (database or file)
+Runs against database configured in .env with the sync engine, prints numbers of written files.
+"""
+
+from sqlalchemy import select, update, delete, exists, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from .. import models
+from ..config import env
+from ..database import SessionLocal
+from ..storage import FileSystemStore, VerifiedImage, sniff_media_type
+from ..utils import image_variants
+
+import argparse
+import json
+
+# (table, primary key, picture column, key column, type column)
+IMAGE_COLUMNS = [
+    (models.User, models.User.id, models.User.profile_picture, models.User.profile_picture_key,
+     models.User.profile_picture_type),
+    (models.Recipe, models.Recipe.id, models.Recipe.recipe_picture, models.Recipe.recipe_picture_key,
+     models.Recipe.recipe_picture_type),
+]
+
+
+def batches(db, query, key_columns, batch: int):
+    # rows of query in batches ordered by key columns (keyset), so whole table is never loaded at once
+    last = None
+    while True:
+        page = query.order_by(*key_columns).limit(batch)
+        if last is not None:
+            page = page.where(tuple_(*key_columns) > tuple_(*last))
+
+        rows = db.execute(page).all()
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][:len(key_columns)]
+
+
+def migrate_column(db, store: FileSystemStore, table, pk, picture, key_column, batch: int, keep: bool) -> int:
+    moved = 0
+    for rows in batches(db, select(pk, key_column).where(picture.isnot(None)), [pk], batch):
+        # rows whose file is already stored (previous run with --keep, or upload with database storage) are not
+        # read and rewritten again, only their bytea column is cleared
+        missing = [row_id for row_id, key in rows if key is None or not store.exists(key)]
+        for row_id, data in db.execute(select(pk, picture).where(pk.in_(missing))) if missing else ():
+            key = store.put(bytes(data))    # file is written before row points to it
+            db.execute(update(table).where(pk == row_id).values(**{key_column.key: key}))
+        if not keep:
+            db.execute(update(table).where(pk.in_([row_id for row_id, _ in rows]), key_column.isnot(None))
+                       .values(**{picture.key: None}))
+        db.commit()
+        moved += len(missing)
+    return moved
+
+
+def migrate_variants(db, store: FileSystemStore, batch: int, keep: bool) -> int:
+    variant = models.ImageVariant
+    moved = 0
+    for rows in batches(db, select(variant.image_key, variant.variant, variant.variant_key)
+                        .where(variant.data.isnot(None)), [variant.image_key, variant.variant], batch):
+        for image_key, name, variant_key in rows:
+            where = (variant.image_key == image_key, variant.variant == name)
+            if not store.exists(variant_key):   # already stored variants are skipped
+                store.put(bytes(db.execute(select(variant.data).where(*where)).scalar_one()), variant_key)
+                moved += 1
+            if not keep:
+                db.execute(update(variant).where(*where).values(data=None))
+        db.commit()
+    return moved
+
+
+def create_variants(db, store: FileSystemStore, pk, picture, key_column, type_column, batch: int) -> int:
+    created = 0
+    missing = select(pk, key_column, type_column, picture) \
+        .where(key_column.isnot(None), ~exists().where(models.ImageVariant.image_key == key_column))
+
+    for rows in batches(db, missing, [pk], batch):
+        for _, key, media_type, data in rows:
+            in_database = data is not None
+            if not in_database:
+                if not store.exists(key):   # image file is missing, nothing to resize
+                    continue
+                data = store.path(key).read_bytes()
+
+            image = VerifiedImage(bytes(data), media_type or sniff_media_type(bytes(data)), key)
+            values = []
+            for name, derivative in image_variants(image).items():
+                if not in_database:
+                    store.put(derivative.data, derivative.key)
+                values.append({'image_key': key, 'variant': name, 'variant_key': derivative.key,
+                               'media_type': derivative.media_type, 'data': derivative.data if in_database else None})
+            db.execute(insert(models.ImageVariant).values(values).on_conflict_do_nothing())
+            created += 1
+        db.commit()
+    return created
+
+
+def collect_garbage(db, store: FileSystemStore) -> dict:
+    image_keys = set()
+    for _, _, _, key_column, _ in IMAGE_COLUMNS:
+        image_keys.update(key for key, in db.execute(select(key_column).where(key_column.isnot(None))))
+
+    # variants of images no row refers to anymore (replaced or deleted)
+    variant = models.ImageVariant
+    removed_variants = 0
+    for (image_key,) in db.execute(select(variant.image_key).distinct()).all():
+        if image_key not in image_keys:
+            removed_variants += db.execute(delete(variant).where(variant.image_key == image_key)).rowcount
+    db.commit()
+
+    keys = image_keys | {key for key, in db.execute(select(variant.variant_key))}
+    removed_files = 0
+    for key in list(store.keys()):
+        if key not in keys:
+            store.delete(key)
+            removed_files += 1
+
+    return {'removed_variants': removed_variants, 'removed_files': removed_files}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--path', default=env.image_storage_path, help='image storage directory')
+    arg_parser.add_argument('--batch', type=int, default=100, help='rows moved per transaction')
+    arg_parser.add_argument('--keep', action='store_true', help='do not clear bytea columns')
+    arg_parser.add_argument('--gc', action='store_true', help='delete unreferenced files and variants')
+    arg_parser.add_argument('--variants', action='store_true', help='create missing image derivatives')
+    args = arg_parser.parse_args()
+
+    store = FileSystemStore(args.path)
+    report = {}
+    db = SessionLocal()
+    try:
+        for table, pk, picture, key_column, type_column in IMAGE_COLUMNS:
+            name = f"{table.__tablename__}.{picture.key}"
+            if args.variants:
+                report[name] = create_variants(db, store, pk, picture, key_column, type_column, args.batch)
+            else:
+                report[name] = migrate_column(db, store, table, pk, picture, key_column, args.batch, args.keep)
+
+        if not args.variants:
+            report['image_variants'] = migrate_variants(db, store, args.batch, args.keep)
+
+        if args.gc:
+            report.update(collect_garbage(db, store))
+    finally:
+        db.close()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
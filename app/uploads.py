@@ -0,0 +1,81 @@
+from fastapi import UploadFile, status
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+from .utils import MAX_FILE_SIZE, ex_imageTooLarge
+
+# Limits of uploaded files: request body is rejected with 413 as soon as it is known to be too large,
+# upload is then read in chunks up to the limit, never as one unbounded read.
+
+CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BODY = MAX_FILE_SIZE + CHUNK_SIZE    # file with multipart headers and form fields
+
+
+class UploadSizeLimit:
+    """
+    ASGI middleware rejecting multipart request bodies larger than max_size with 413.
+    Declared Content-Length is checked before any byte is read, bodies without it are counted while received.
+    Once the limit is passed, application receives only http.disconnect (it stops reading the form instead of
+    handling truncated one) and its response is replaced by 413.
+    """
+
+    def __init__(self, app, max_size: int = MAX_UPLOAD_BODY):
+        self.app = app
+        self.max_size = max_size
+
+    def too_large(self):
+        return JSONResponse({'detail': f"Image too large. Maximum upload size is {MAX_FILE_SIZE} bytes"},
+                            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in ('POST', 'PUT'):
+            return await self.app(scope, receive, send)
+
+        headers = Headers(scope=scope)
+        if not headers.get('content-type', '').startswith('multipart/form-data'):
+            return await self.app(scope, receive, send)
+
+        length = headers.get('content-length', '')
+        if length.isdigit() and int(length) > self.max_size:    # rejected before reading the body
+            return await self.too_large()(scope, receive, send)
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:    # rest of the body is never passed, application sees disconnected client
+                return {'type': 'http.disconnect'}
+
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_size:    # stop passing body to application
+                    exceeded = True
+                    return {'type': 'http.disconnect'}
+            return message
+
+        async def limited_send(message):
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, limited_send)
+        except Exception:   # application failed on disconnected body (e.g. ClientDisconnect while parsing form)
+            if not exceeded:
+                raise
+        if exceeded:
+            await self.too_large()(scope, receive, send)
+
+
+async def read_upload(upload: UploadFile, max_size: int = MAX_FILE_SIZE) -> bytes:
+    # reads uploaded file in chunks, 413 as soon as it is larger than max_size
+    data = bytearray()
+    while True:
+        chunk = await upload.read(CHUNK_SIZE)
+        if not chunk:
+            return bytes(data)
+
+        data += chunk
+        if len(data) > max_size:
+            raise ex_imageTooLarge
@@ -1,14 +1,21 @@
 from fastapi import HTTPException, status
 from passlib.context import CryptContext
 from PIL import Image
+from sqlalchemy.exc import DataError
+
+from .config import env
+from .storage import VerifiedImage, IMAGE_SIZES, content_key, variant_name
+from typing import Dict, Tuple
 
 import PIL
-import sys
 import io
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# hashes with other cost than configured need update (rehash on login)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=env.bcrypt_rounds,
+                           bcrypt__min_rounds=env.bcrypt_rounds, bcrypt__max_rounds=env.bcrypt_rounds)
 MAX_IMAGE_DIM = 1024, 1024
-MAX_FILE_SIZE = 2831200 + sys.getsizeof(bytes())  # Maximum file size 2.7MB with bytes object size included
+MAX_FILE_SIZE = 2831200  # Maximum file size 2.7MB
+MAX_IMAGE_PIXELS = 40_000_000   # larger images are rejected before decoding
 ALLOWED_IMAGE_TYPES = ('PNG', 'JPEG', 'JPG')
 
 
@@ -20,40 +27,124 @@ def verify(plain_password: str, hashed_password: str):  # Verify if password mat
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_update(plain_password: str, hashed_password: str):  # Verify and return new hash if cost changed
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 def remove_none_from_dict(data: dict) -> dict:
     filtered = {key: value for key, value in data.items() if value is not None}
     return filtered
 
 
-def verify_image(file: bytes) -> bytes:  # Verify if image is suitable to upload
-    ex_unsupported = HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+def escape_like(value: str) -> str:  # escape LIKE wildcards in user input (escape character is backslash)
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+ex_unsupportedImage = HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
                                    detail="Unsupported file or media type")
+ex_imageTooLarge = HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                 detail=f"Image too large. Maximum upload size is {MAX_FILE_SIZE} bytes")
+
 
-    try: # try to open
+def load_image(file: bytes) -> Tuple[Image.Image, Tuple[int, int]]:
+    # Verify if image is suitable to upload and decode it, returns decoded image and its size in file header
+    if len(file) > MAX_FILE_SIZE:     # if file is too large
+        raise ex_imageTooLarge
+
+    try: # try to open, only header is read
         im = Image.open(io.BytesIO(file))
     except PIL.UnidentifiedImageError:  # if not supported file type
-        raise ex_unsupported
+        raise ex_unsupportedImage
     except Exception:
-        raise ex_unsupported
+        raise ex_unsupportedImage
 
     if im.format not in ALLOWED_IMAGE_TYPES:
-        raise ex_unsupported
+        raise ex_unsupportedImage
+
+    if im.size[0] * im.size[1] > MAX_IMAGE_PIXELS:  # decoded image would be too large
+        raise ex_imageTooLarge
+
+    original_size = im.size     # draft mode below changes size of decoded image
+    if im.format == 'JPEG':     # decoder draft mode, decodes directly at 1/2, 1/4 or 1/8 scale still >= MAX_IMAGE_DIM
+        im.draft(im.mode, MAX_IMAGE_DIM)
+
+    try:
+        im.load()
+    except Exception:   # truncated or corrupted image
+        raise ex_unsupportedImage
+
+    return im, original_size
+
+
+def stored_image(im: Image.Image, file: bytes, original_size: Tuple[int, int]) -> VerifiedImage:
+    # form of loaded image which is stored, original_size is size in file header (before draft decoding)
+    if original_size[0] > MAX_IMAGE_DIM[0] or original_size[1] > MAX_IMAGE_DIM[1]:  # downscaling images
+        im.thumbnail(MAX_IMAGE_DIM, Image.ANTIALIAS)    # no-op when draft already decoded it at 1024
+        return encode_image(im, im.format)
+
+    # format and hash are stored with image, so it is never decoded again when served
+    return VerifiedImage(file, f"image/{im.format.lower()}", content_key(file))
+
 
-    im_size = sys.getsizeof(file)
-    if im_size > MAX_FILE_SIZE:     # if file is too large
-        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                            detail=f"Image too large. Maximum upload size is {MAX_FILE_SIZE} bytes")
+def verify_image(file: bytes) -> VerifiedImage:  # Verify if image is suitable to upload, returns stored form
+    im, original_size = load_image(file)
+    return stored_image(im, file, original_size)
 
-    if im.size[0] > MAX_IMAGE_DIM[0] or im.size[1] > MAX_IMAGE_DIM[1]:  # downscaling images
-        im.thumbnail(MAX_IMAGE_DIM, Image.ANTIALIAS)
-        img_bytes = io.BytesIO()
-        im.save(img_bytes, format=im.format)
-        return img_bytes.getvalue()
 
-    return file
+def prepare_image(file: bytes) -> Tuple[VerifiedImage, Dict[str, VerifiedImage]]:
+    """
+    Verifies uploaded image and creates its derivatives, image is decoded only once.
+    CPU heavy, runs in image worker pool (workers.image_pool).
+    """
+
+    im, original_size = load_image(file)
+    image = stored_image(im, file, original_size)   # downscales im in place, derivatives are made from stored size
+    return image, derivatives(im)
+
+
+def encode_image(im: Image.Image, image_format: str) -> VerifiedImage:
+    img_bytes = io.BytesIO()
+    im.save(img_bytes, format=image_format)
+    data = img_bytes.getvalue()
+    return VerifiedImage(data, f"image/{image_format.lower()}", content_key(data))
+
+
+def derivatives(im: Image.Image) -> Dict[str, VerifiedImage]:
+    """
+    Derivatives of loaded image for every size in IMAGE_SIZES, in original format and WebP.
+    Variant in original format is skipped when image is not larger than its size (original is served instead).
+    """
+
+    variants = {}
+    for size in IMAGE_SIZES:
+        resized = im.copy()
+        resized.thumbnail((size, size), Image.ANTIALIAS)
+        if resized.size != im.size:
+            variants[variant_name(size, False)] = encode_image(resized, im.format)
+
+        if resized.mode not in ('RGB', 'RGBA'):     # e.g. palette PNG
+            resized = resized.convert('RGBA')
+        variants[variant_name(size, True)] = encode_image(resized, 'WEBP')
+
+    return variants
+
+
+def image_variants(image: VerifiedImage) -> Dict[str, VerifiedImage]:  # derivatives of stored image
+    im = Image.open(io.BytesIO(image.data))
+    im.load()
+    return derivatives(im)
 
 
 def ex_formatter(e: Exception): # function for exception formating
     msg: str = str(e.__cause__)
     msg = msg.split('\n')[0].split('\"')[2] + msg.split('\n')[0].split('\"')[3]
     return msg[1:]
+
+
+def pg_error_code(e: Exception):  # SQLSTATE code of database error (psycopg2 and asyncpg)
+    return getattr(e.orig, 'pgcode', None)
+
+
+def is_data_error(e: Exception) -> bool:
+    # invalid data in request (SQLSTATE class 22), asyncpg errors are not translated to DataError
+    return isinstance(e, DataError) or (pg_error_code(e) or '').startswith('22')
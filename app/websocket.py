@@ -0,0 +1,116 @@
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect, status
+from typing import Awaitable, Callable, Optional, Tuple
+
+from .config import env
+from .oauth2 import ws_get_current_user
+from .pagination import PageParams
+from .schemas.users import UserPrincipal
+
+import asyncio
+import json
+
+
+async def ws_authenticate(websocket: WebSocket, db) -> Optional[UserPrincipal]:
+    """
+    Authenticates websocket connection with token from authorization header.
+    On failure sends error message, closes the socket and returns None.
+    """
+
+    token: str = websocket.headers.get('authorization', '')
+    curr_user = await ws_get_current_user(token=token, db=db)
+    await db.rollback()     # end transaction so connection returns to pool
+
+    if not isinstance(curr_user, UserPrincipal):
+        await websocket.send_json(curr_user)
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return None
+
+    return curr_user
+
+
+def ws_query(message: str, field: str) -> Tuple[str, PageParams, dict]:
+    """
+    Parses search message, it is either plain search text or JSON object
+    with search text in given field and optional limit and after (cursor) keys.
+    Returns search text, pagination parameters and whole parsed message.
+    """
+
+    params = {}
+    if message.startswith('{'):
+        try:
+            params = json.loads(message)
+        except ValueError:
+            params = {}
+
+    if not isinstance(params, dict) or not params:  # plain search text
+        return message, PageParams(limit=env.page_size, after=None, total=False), {}
+
+    try:
+        limit = min(max(int(params.get('limit', env.page_size)), 1), env.page_size_max)
+    except (TypeError, ValueError):
+        limit = env.page_size
+
+    return str(params.get(field, '')), PageParams(limit=limit, after=params.get('after'), total=False), params
+
+
+async def ws_search_loop(websocket: WebSocket, db, search: Callable[[str], Awaitable[tuple]]):
+    """
+    Serves search queries received on websocket, one session (db) is reused for whole connection.
+    Search returns items and cursor of next page, which is sent in 'next' key of response.
+
+    Messages are received in separate task and every search runs in its own task. When newer query
+    arrives while search is running, the search is cancelled and only the latest query is answered.
+    Threadpool (sync driver) round-trip which is already running finishes first, following ones are skipped.
+    """
+
+    latest = {'query': None}
+    received = asyncio.Event()
+
+    async def receiver():
+        while True:
+            latest['query'] = await websocket.receive_text()
+            received.set()
+
+    async def answer(query: str) -> dict:
+        try:
+            items, next_cursor = await search(query)
+            return {'status_code': 200, 'detail': items, 'next': next_cursor}
+        except HTTPException as e:  # invalid query (e.g. cursor)
+            return {'status_code': e.status_code, 'detail': e.detail}
+        finally:
+            await db.rollback()     # end transaction so connection returns to pool between messages
+
+    async def cancel(task: asyncio.Task):   # waits until cancelled search has rolled back
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    receiver_task = asyncio.create_task(receiver())
+    search_task: Optional[asyncio.Task] = None
+    try:
+        while True:
+            waiter = asyncio.create_task(received.wait())
+            running = {receiver_task, waiter} if search_task is None else {receiver_task, waiter, search_task}
+            await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+            if received.is_set():   # new query, running search is superseded
+                received.clear()
+                if search_task is not None:
+                    await cancel(search_task)
+                search_task = asyncio.create_task(answer(latest['query']))
+                continue
+
+            waiter.cancel()
+            if search_task is not None and search_task.done():
+                response, search_task = search_task.result(), None
+                await websocket.send_json(response)
+                continue
+
+            receiver_task.result()  # receiver ended (client disconnected)
+            return
+
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver_task.cancel()
+        if search_task is not None:
+            await cancel(search_task)
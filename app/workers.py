@@ -0,0 +1,61 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import HTTPException, status
+from typing import Callable, Optional
+
+from .config import env
+
+import asyncio
+
+ex_serverBusy = HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                              detail="Server is busy, try again later",
+                              headers={"Retry-After": "1"})
+
+
+class BoundedPool:
+    """
+    Dedicated worker pool for CPU heavy tasks, so they do not starve the shared threadpool.
+    At most max_queue tasks wait for a free worker, when the queue is full, request is rejected with 503.
+    Executor is created on first use.
+    """
+
+    def __init__(self, name: str, executor_factory: Callable[[int], Executor], workers: int, max_queue: int):
+        self.name = name
+        self.executor_factory = executor_factory
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor: Optional[Executor] = None
+        self.pending = 0    # running and queued tasks
+        self.rejected = 0
+
+    async def run(self, fn: Callable, *args):
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise ex_serverBusy
+
+        if self.executor is None:
+            self.executor = self.executor_factory(self.workers)
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def stats(self) -> dict:
+        return {'workers': self.workers, 'max_queue': self.max_queue, 'pending': self.pending,
+                'rejected': self.rejected}
+
+
+# bcrypt hashing and verification (utils.pwd_hash, utils.verify), processes so hashing runs on all cores
+password_pool = BoundedPool('password', lambda workers: ProcessPoolExecutor(max_workers=workers),
+                            env.password_workers, env.password_queue)
+
+# decoding and resizing of uploaded images (utils.prepare_image), threads as image is large to send to process
+# and Pillow releases GIL while decoding, workers bound number of decoded images in memory at once
+image_pool = BoundedPool('image', lambda workers: ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image'),
+                         env.image_workers, env.image_queue)
@@ -0,0 +1,74 @@
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from typing import Dict, Optional, Type
+
+from .utils import ex_formatter, is_data_error, pg_error_code
+
+# Write path of routers: INSERT / UPDATE ... RETURNING exactly the columns of response schema,
+# so the response is built from the written row without querying it again.
+
+
+def response_columns(schema: Type[BaseModel], entity, nested: Optional[Dict[str, object]] = None) -> list:
+    """
+    Columns of entity (model) for every field of schema, labeled by field name.
+    Fields with nested schema are taken from other entity given in nested (e.g. {'creator': models.User}),
+    their columns are labeled 'field__subfield'.
+    """
+
+    columns = []
+    for name, field in schema.__fields__.items():
+        if nested is not None and name in nested:
+            columns += [column.label(f"{name}__{column.name}") for column in response_columns(field.type_, nested[name])]
+        else:
+            columns.append(getattr(entity, name).label(name))
+    return columns
+
+
+def to_schema(schema: Type[BaseModel], row) -> BaseModel:  # returned row to response schema (nested by '__')
+    data = {}
+    for key, value in row._mapping.items():
+        parent, _, child = key.partition('__')
+        if child:
+            data.setdefault(parent, {})[child] = value
+        else:
+            data[key] = value
+    return schema.parse_obj(data)
+
+
+@asynccontextmanager
+async def write_errors(db, ex_unique: Optional[HTTPException] = None):
+    """
+    Wraps writing statements and their commit. On error the transaction is rolled back, so the session
+    can be used again. Violated constraints and invalid data are 403, unique violation is ex_unique when given.
+    Other errors (pool or statement timeout, lost connection) are left to the app handlers.
+    """
+
+    try:
+        yield
+    except IntegrityError as e:     # if constrains were violated
+        await db.rollback()
+        if ex_unique is not None and pg_error_code(e) == "23505":     # unique violation
+            raise ex_unique
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=ex_formatter(e))
+    except DBAPIError as e:  # if data error occured
+        await db.rollback()
+        if not is_data_error(e):
+            raise
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e.__cause__))
+
+
+async def write_returning(db, statement, schema: Type[BaseModel], entity, nested: Optional[Dict[str, object]] = None,
+                          ex_unique: Optional[HTTPException] = None) -> Optional[BaseModel]:
+    """
+    Runs INSERT or UPDATE statement returning columns of response schema and commits it.
+    Returns response or None when no row was written (UPDATE did not match).
+    Errors are mapped by write_errors.
+    """
+
+    async with write_errors(db, ex_unique):
+        row = (await db.execute(statement.returning(*response_columns(schema, entity, nested)))).first()
+        await db.commit()
+
+    return None if row is None else to_schema(schema, row)
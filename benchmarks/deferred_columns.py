@@ -0,0 +1,63 @@
+"""
+Bytes transferred from database per list request, with image columns deferred (current models)
+and undeferred (how models loaded them before).
+
+Usage: python -m benchmarks.deferred_columns [--limit 100]
+Runs against database configured in .env, every query is run with the sync engine.
+"""
+
+from sqlalchemy import select
+from sqlalchemy.orm import undefer
+
+from app import models
+from app.database import engine
+from app.routers.recipes import creator_loader
+
+import argparse
+import json
+
+
+def value_size(value) -> int:   # size of value as received by client
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, memoryview)):
+        return len(value)
+    return len(str(value).encode())
+
+
+def transferred_bytes(connection, statement) -> int:
+    # ORM statement compiled to plain SQL selects exactly the columns the ORM would load
+    compiled = statement.compile(dialect=connection.dialect)
+    rows = connection.exec_driver_sql(str(compiled), compiled.params)
+    return sum(value_size(value) for row in rows for value in row)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--limit', type=int, default=100, help='page size of list requests')
+    args = arg_parser.parse_args()
+
+    statements = {
+        'get_current_user': select(models.User).where(models.User.id == 1),
+        'get_users': select(models.User).where(models.User.id != 0).order_by(models.User.id).limit(args.limit),
+        'get_recipes': select(models.Recipe).options(creator_loader).order_by(models.Recipe.id).limit(args.limit),
+    }
+    undeferred = {
+        'get_current_user': undefer(models.User.profile_picture),
+        'get_users': undefer(models.User.profile_picture),
+        'get_recipes': undefer(models.Recipe.recipe_picture),
+    }
+
+    report = {}
+    with engine.connect() as connection:
+        for name, statement in statements.items():
+            report[name] = {
+                'before_bytes': transferred_bytes(connection, statement.options(undeferred[name])),
+                'after_bytes': transferred_bytes(connection, statement),
+            }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
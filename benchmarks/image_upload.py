@@ -0,0 +1,113 @@
+"""
+Peak memory (RSS) of server process during a burst of concurrent image uploads,
+for the upload pipeline before (whole read, full decode in shared threadpool) and now
+(chunked read, JPEG draft mode decode in bounded image worker pool, with derivatives).
+Every pipeline runs in a fresh process, so its peak RSS is not affected by the other one.
+
+Usage: python -m benchmarks.image_upload [--uploads 50] [--width 4000] [--height 3000]
+No database is needed, test JPEG is generated as large as upload limit allows (2.7MB).
+Burst larger than IMAGE_WORKERS + IMAGE_QUEUE is partly rejected with 503, raise IMAGE_QUEUE for it.
+"""
+
+from fastapi import UploadFile
+from PIL import Image
+from starlette.concurrency import run_in_threadpool
+
+from app import utils
+from app.uploads import read_upload
+from app.workers import image_pool
+
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import resource
+import tempfile
+import time
+
+
+def test_jpeg(width: int, height: int) -> bytes:  # photo-like JPEG just under upload limit
+    channels = [Image.effect_noise((width // 8, height // 8), sigma).resize((width, height), Image.BILINEAR)
+                for sigma in (40, 60, 80)]
+    im = Image.merge('RGB', channels)
+    low, high, best = 5, 95, None
+    while low <= high:  # highest quality which fits the limit
+        quality = (low + high) // 2
+        buffer = io.BytesIO()
+        im.save(buffer, format='JPEG', quality=quality)
+        if buffer.tell() <= utils.MAX_FILE_SIZE:
+            best, low = buffer.getvalue(), quality + 1
+        else:
+            high = quality - 1
+
+    if best is None:
+        raise SystemExit('Test image does not fit upload limit, use smaller --width and --height')
+    return best
+
+
+def upload(data: bytes) -> UploadFile:  # like Starlette's multipart parser, spooled to disk over 1MB
+    file = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    file.write(data)
+    file.seek(0)
+    return UploadFile('image.jpg', file, 'image/jpeg')
+
+
+def legacy_verify(file: bytes):  # verify_image before streaming validation
+    im = Image.open(io.BytesIO(file))
+    if im.size[0] > utils.MAX_IMAGE_DIM[0] or im.size[1] > utils.MAX_IMAGE_DIM[1]:
+        im.thumbnail(utils.MAX_IMAGE_DIM, Image.ANTIALIAS)
+        buffer = io.BytesIO()
+        im.save(buffer, format=im.format)
+        return buffer.getvalue()
+    return file
+
+
+async def before(file: UploadFile):
+    return await run_in_threadpool(legacy_verify, await file.read())
+
+
+async def after(file: UploadFile):
+    return await image_pool.run(utils.prepare_image, await read_upload(file))
+
+
+def child(pipeline: str, data: bytes, uploads: int, results):
+    handler = {'before': before, 'after': after}[pipeline]
+    files = [upload(data) for _ in range(uploads)]
+    idle = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    async def burst():
+        start = time.perf_counter()
+        await asyncio.gather(*(handler(file) for file in files))
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(burst())
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put({'pipeline': pipeline, 'seconds': round(elapsed, 3),
+                 'idle_rss_mb': round(idle / 1024, 1), 'peak_rss_mb': round(peak / 1024, 1)})
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--uploads', type=int, default=50, help='concurrent uploads in burst')
+    arg_parser.add_argument('--width', type=int, default=4000, help='width of test image')
+    arg_parser.add_argument('--height', type=int, default=3000, help='height of test image')
+    args = arg_parser.parse_args()
+
+    data = test_jpeg(args.width, args.height)
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    report = {'uploads': args.uploads, 'image_bytes': len(data), 'image_size': [args.width, args.height],
+              'image_workers': image_pool.workers, 'runs': []}
+
+    for pipeline in ('before', 'after'):
+        process = context.Process(target=child, args=(pipeline, data, args.uploads, results))
+        process.start()
+        report['runs'].append(results.get())
+        process.join()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+Load and latency benchmark of the whole API: seeds benchmark users and data, then clients log in and send
+requests picked by weights of traffic mix (HTTP endpoints and the three WebSocket search channels)
+for given time. Prints JSON with throughput and p50/p95/p99 latency per endpoint, so runs can be compared
+across commits (commit is part of the output).
+
+Usage: python -m benchmarks.load [--seed] [--users 1000] [--foods 10000] [--mix mixed] [--clients 20]
+                                 [--duration 30] [--url http://localhost:8000] [--output result.json]
+Runs against database configured in .env. Without --url, server (uvicorn app.main:app) is started
+for the run with --workers processes. --seed adds benchmark data (users bench<n>@bench.com) with app.tools.generate_data.
+Requirements: pip install -r benchmarks/requirements.txt
+"""
+
+from jose import jwt
+from PIL import Image
+from sqlalchemy import func, select
+
+from app import models
+from app.database import engine
+from app.tools.generate_data import Cardinalities, FOOD_NOUNS, LAST_NAMES, generate
+
+import argparse
+import asyncio
+import io
+import json
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import websockets
+
+PASSWORD = 'benchmark'
+EMAIL = 'bench{n}@bench.com'
+
+# weights of operations in traffic mixes
+MIXES = {
+    'read': {'food_search': 25, 'food_list_read': 20, 'recipes': 15, 'weight_read': 10, 'image_get': 10,
+             'ws_food': 10, 'ws_users': 5, 'ws_recipes': 5},
+    'write': {'food_list_add': 40, 'weight_add': 30, 'image_put': 10, 'food_list_read': 20},
+    'mixed': {'food_search': 20, 'food_list_read': 15, 'food_list_add': 15, 'recipes': 10, 'weight_read': 5,
+              'weight_add': 10, 'image_get': 5, 'image_put': 2, 'ws_food': 10, 'ws_users': 4, 'ws_recipes': 4},
+}
+
+
+def seed(users: int, foods: int, entries: float, weights: float, recipes: float, skew: float):
+    # benchmark users (all with password PASSWORD) and their data, loaded by the data generator (COPY)
+    counts = Cardinalities(users, foods, entries, weights, recipes, days=365, skew=skew)
+    return generate(counts, email=EMAIL, password=PASSWORD)
+
+
+def benchmark_users(limit: int = 1000) -> list:  # e-mails of seeded users
+    with engine.connect() as connection:
+        return connection.execute(select(models.User.email).where(models.User.email.like(EMAIL.format(n='%')))
+                                  .order_by(func.random()).limit(limit)).scalars().all()
+
+
+def percentile(values: list, p: float) -> float:  # nearest rank percentile of sorted values
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values) + 0.5) - 1))]
+
+
+class Recorder:  # latencies (ms) and errors of every operation
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, name: str, start: float, ok: bool):
+        self.latencies.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self, seconds: float) -> dict:
+        endpoints = {}
+        for name, values in sorted(self.latencies.items()):
+            values.sort()
+            endpoints[name] = {'requests': len(values), 'errors': self.errors.get(name, 0),
+                               'throughput_rps': round(len(values) / seconds, 2),
+                               'mean_ms': round(sum(values) / len(values), 3),
+                               'p50_ms': round(percentile(values, 50), 3), 'p95_ms': round(percentile(values, 95), 3),
+                               'p99_ms': round(percentile(values, 99), 3)}
+        total = sum(len(values) for values in self.latencies.values())
+        return {'requests': total, 'errors': sum(self.errors.values()),
+                'throughput_rps': round(total / seconds, 2), 'endpoints': endpoints}
+
+
+def test_png() -> bytes:  # small profile picture for image uploads
+    buffer = io.BytesIO()
+    Image.effect_noise((256, 256), 50).convert('RGB').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class Client:
+    """
+    One benchmark user: logs in, then sends operations of mix until deadline.
+    WebSocket channels are opened on first use and kept for the whole run, like the app does while typing.
+    """
+
+    def __init__(self, http: httpx.AsyncClient, ws_url: str, recorder: Recorder, email: str, food_ids: list,
+                 image: bytes):
+        self.http = http
+        self.ws_url = ws_url
+        self.recorder = recorder
+        self.email = email
+        self.food_ids = food_ids
+        self.image = image
+        self.id = None
+        self.token = None
+        self.sockets = {}
+
+    async def request(self, name: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.recorder.record(name, start, ok)
+        return response
+
+    async def login(self) -> bool:
+        response = await self.request('login', 'POST', '/login',
+                                      data={'username': self.email, 'password': PASSWORD})
+        if response is None or response.status_code != 200:
+            return False
+
+        self.token = response.json()['access_token']
+        self.http.headers['Authorization'] = f"Bearer {self.token}"
+        self.id = jwt.get_unverified_claims(self.token)['user_id']
+        return True
+
+    async def search(self, name: str, path: str, query: str):
+        start = time.perf_counter()
+        try:
+            channel = self.sockets.get(path)
+            if channel is None:
+                channel = self.sockets[path] = await websockets.connect(
+                    f"{self.ws_url}{path}", extra_headers={'authorization': self.token})
+            await channel.send(query)
+            ok = json.loads(await channel.recv()).get('status_code') == 200
+        except (OSError, websockets.WebSocketException):
+            self.sockets.pop(path, None)
+            ok = False
+        self.recorder.record(name, start, ok)
+
+    async def run(self, op: str):
+        word = random.choice(FOOD_NOUNS)
+        if op == 'food_search':
+            await self.request(op, 'GET', '/food/', params={'title': word[:random.randint(2, len(word))]})
+        elif op == 'food_list_read':
+            await self.request(op, 'GET', '/foodlist/', params={'from': time.strftime('%Y-%m-%d',
+                                                                time.gmtime(time.time() - 7 * 86400))})
+        elif op == 'food_list_add':
+            await self.request(op, 'POST', '/foodlist/', json={'id_food': random.choice(self.food_ids),
+                                                                'amount': random.randint(20, 300)})
+        elif op == 'recipes':
+            await self.request(op, 'GET', '/recipes/', params={'title': word, 'limit': 20})
+        elif op == 'weight_read':
+            await self.request(op, 'GET', '/weight_measurement/')
+        elif op == 'weight_add':
+            await self.request(op, 'POST', '/weight_measurement/', json={'weight': random.uniform(60, 90)})
+        elif op == 'image_get':
+            await self.request(op, 'GET', f"/users/{self.id}/image", params={'size': 256})
+        elif op == 'image_put':
+            await self.request(op, 'PUT', f"/users/{self.id}/image",
+                               files={'prof_picture': ('image.png', self.image, 'image/png')})
+        elif op == 'ws_food':
+            await self.search(op, '/food/ws', word[:3])
+        elif op == 'ws_users':
+            await self.search(op, '/users/ws', random.choice(LAST_NAMES)[:3])
+        elif op == 'ws_recipes':
+            await self.search(op, '/recipes/ws', word)
+
+    async def loop(self, mix: dict, deadline: float):
+        if not await self.login():
+            return
+
+        ops, weights = list(mix), list(mix.values())
+        try:
+            while time.perf_counter() < deadline:
+                await self.run(random.choices(ops, weights)[0])
+        finally:
+            for channel in self.sockets.values():
+                await channel.close()
+
+
+async def benchmark(url: str, mix: dict, clients: int, duration: float) -> dict:
+    emails = benchmark_users()
+    if not emails:
+        raise SystemExit('No benchmark users, run with --seed first')
+    with engine.connect() as connection:
+        food_ids = connection.execute(select(models.Food.id).order_by(func.random()).limit(1000)).scalars().all()
+
+    recorder = Recorder()
+    image = test_png()
+    sessions = [httpx.AsyncClient(base_url=url, timeout=30) for _ in range(clients)]   # own authorization header
+    start = time.perf_counter()
+    deadline = start + duration
+    try:
+        await asyncio.gather(*(
+            Client(session, url.replace('http', 'ws', 1), recorder, random.choice(emails), food_ids, image)
+            .loop(mix, deadline) for session in sessions))
+    finally:
+        for session in sessions:
+            await session.aclose()
+    elapsed = time.perf_counter() - start
+
+    return recorder.report(elapsed)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers: int):  # uvicorn with app.main:app, returns process and url when it responds
+    port = free_port()
+    process = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(port),
+                                '--workers', str(workers), '--log-level', 'warning'])
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            if httpx.get(url + '/').status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+
+    process.terminate()
+    raise SystemExit('Server did not start')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--seed', action='store_true', help='add benchmark data before the run')
+    arg_parser.add_argument('--users', type=int, default=1000, help='number of seeded users')
+    arg_parser.add_argument('--foods', type=int, default=10000, help='number of seeded foods')
+    arg_parser.add_argument('--entries', type=float, default=100, help='food list entries per seeded user (average)')
+    arg_parser.add_argument('--weights', type=float, default=30, help='weight measurements per seeded user (average)')
+    arg_parser.add_argument('--recipes', type=float, default=2, help='recipes per seeded user (average)')
+    arg_parser.add_argument('--skew', type=float, default=1.5, help='Pareto shape of seeded user activity')
+    arg_parser.add_argument('--mix', choices=MIXES, default='mixed', help='traffic mix')
+    arg_parser.add_argument('--clients', type=int, default=20, help='concurrent clients')
+    arg_parser.add_argument('--duration', type=float, default=30, help='seconds of traffic')
+    arg_parser.add_argument('--url', help='running server, by default one is started for the run')
+    arg_parser.add_argument('--workers', type=int, default=1, help='uvicorn workers of started server')
+    arg_parser.add_argument('--output', help='file for JSON result (default stdout)')
+    args = arg_parser.parse_args()
+
+    if args.seed:
+        print(json.dumps({'seed': seed(args.users, args.foods, args.entries, args.weights, args.recipes, args.skew)}),
+              file=sys.stderr)
+
+    process, url = (None, args.url) if args.url else start_server(args.workers)
+    try:
+        result = asyncio.run(benchmark(url, MIXES[args.mix], args.clients, args.duration))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = {'commit': git_commit(), 'mix': args.mix, 'mix_weights': MIXES[args.mix], 'clients': args.clients,
+              'duration': args.duration, **result}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
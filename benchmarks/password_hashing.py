@@ -0,0 +1,47 @@
+"""
+Logins per second the password worker pool can verify, for increasing number of worker processes.
+Each login is one bcrypt verification with configured cost (BCRYPT_ROUNDS).
+
+Usage: python -m benchmarks.password_hashing [--logins 200] [--workers 1 2 4]
+"""
+
+from app import utils
+from app.config import env
+from app.workers import BoundedPool
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import asyncio
+import json
+import os
+import time
+
+
+async def measure(workers: int, logins: int, hashed: str) -> dict:
+    pool = BoundedPool('benchmark', lambda size: ProcessPoolExecutor(max_workers=size), workers, logins)
+    await pool.run(utils.verify, 'password', hashed)    # start worker processes before measuring
+
+    start = time.perf_counter()
+    await asyncio.gather(*(pool.run(utils.verify, 'password', hashed) for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+
+    return {'workers': workers, 'logins': logins, 'seconds': round(elapsed, 3),
+            'logins_per_second': round(logins / elapsed, 2),
+            'logins_per_second_per_core': round(logins / elapsed / min(workers, os.cpu_count()), 2)}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--logins', type=int, default=200, help='number of verifications per run')
+    arg_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, os.cpu_count()],
+                            help='pool sizes to measure')
+    args = arg_parser.parse_args()
+
+    hashed = utils.pwd_hash('password')
+    results = [asyncio.run(measure(workers, args.logins, hashed)) for workers in args.workers]
+    print(json.dumps({'bcrypt_rounds': env.bcrypt_rounds, 'cpu_count': os.cpu_count(), 'runs': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Query plan regression check: date range queries of food list and weight history have to use
+their (id_user, time) indexes with the time range in the index condition (sargable predicates),
+food searches the trigram index on lower(title), and following keyset pages the same indexes as first ones.
+Exits with status 1 when a query does not. The same checks run as tests/test_query_plans.py.
+
+Usage: python -m benchmarks.query_plans [--user 1] [--from 2022-04-01] [--to 2022-04-07] [--real-costs]
+Sequential scans are disabled for the check (small test databases are cheaper to scan whole),
+--real-costs checks plans the planner picks with current table statistics.
+"""
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.dates import DateRange
+from app.pagination import Explain, Keyset
+from app.routers.food import food_search_query
+from app.routers.foodlist import food_list_query
+from app.routers.weight_measurement import weight_query
+from app import models
+
+import argparse
+import json
+import sys
+
+INDEX_NODES = ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan')
+
+
+def index_nodes(plan: dict):  # every index scan node of plan tree
+    if plan['Node Type'] in INDEX_NODES:
+        yield plan
+    for child in plan.get('Plans', []):
+        yield from index_nodes(child)
+
+
+def plan_checks(user: int, dates: DateRange) -> list:
+    """
+    Queries as endpoints run them, first and following page of keyset pagination.
+    Returns (name, query, index which has to be used, column which has to be in its index condition).
+    """
+
+    food_list = Keyset((models.Foodlist.time, False), (models.Foodlist.id, False))
+    weight = Keyset((models.Weightmeasure.measure_time, False), (models.Weightmeasure.id, False))
+    after_time = (dates.start(dates.first), 0)
+    checks = [
+        ('get_food_list', food_list.apply(food_list_query(user, dates), 100), 'idx_foodlist_id_user_time', 'time'),
+        ('get_food_list next page', food_list.apply(food_list_query(user, dates), 100, after_time),
+         'idx_foodlist_id_user_time', 'time'),
+        ('get_weight_measurement', weight.apply(weight_query(user, dates), 100),
+         'idx_weightmeasurements_id_user_measure_time', 'measure_time'),
+        ('get_weight_measurement next page', weight.apply(weight_query(user, dates), 100, after_time),
+         'idx_weightmeasurements_id_user_measure_time', 'measure_time'),
+    ]
+
+    for name, title, fuzzy, after in (('search_food', 'egg', False, None),
+                                      ('search_food next page', 'egg', False, (0.5, 0.5, 0)),
+                                      ('search_food fuzzy', 'eggs', True, None),
+                                      ('search_food fuzzy next page', 'eggs', True, (0.7, 0.5, 0))):
+        query, keyset = food_search_query(title, fuzzy)
+        checks.append((name, keyset.apply(query, 100, after), 'idx_food_title_trgm', 'title'))
+
+    query, keyset = food_search_query('')   # all foods by id
+    checks.append(('search_food without title next page', keyset.apply(query, 100, (100,)), 'food_pkey', 'id'))
+    return checks
+
+
+def check(connection, name: str, query, index: str, column: str) -> dict:
+    plan = connection.execute(Explain(query)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    nodes = [node for node in index_nodes(plan[0]['Plan']) if node.get('Index Name') == index]
+    ranged = [node for node in nodes if column in node.get('Index Cond', '')]
+    return {'query': name, 'index': index, 'index_used': bool(nodes), 'range_in_index_cond': bool(ranged),
+            'ok': bool(ranged), 'plan': plan[0]['Plan']}
+
+
+def disable_seqscan(connection):  # for the current transaction
+    connection.execute(text("SET LOCAL enable_seqscan = off"))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--user', type=int, default=1, help='id of user whose data are queried')
+    arg_parser.add_argument('--from', dest='first', default='2022-04-01', help='first day of range')
+    arg_parser.add_argument('--to', dest='last', default='2022-04-07', help='last day of range')
+    arg_parser.add_argument('--real-costs', action='store_true', help='do not disable sequential scans')
+    arg_parser.add_argument('--verbose', action='store_true', help='print whole plans')
+    args = arg_parser.parse_args()
+
+    dates = DateRange(date=None, from_=args.first, to=args.last, tz_name=None)
+    with engine.connect() as connection:
+        with connection.begin():
+            if not args.real_costs:
+                disable_seqscan(connection)
+            results = [check(connection, *plan_check) for plan_check in plan_checks(args.user, dates)]
+
+    if not args.verbose:
+        for result in results:
+            del result['plan']
+    print(json.dumps(results, indent=2))
+    sys.exit(0 if all(result['ok'] for result in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+-- Trigram index for ranked / fuzzy food title search
+-- (for databases created from tables.sql before this index was added)
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_food_title_trgm ON public.food USING gin (lower(title) gin_trgm_ops);
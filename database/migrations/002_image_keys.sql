@@ -0,0 +1,6 @@
+-- Keys of images (sha256 of content) for filesystem image storage
+-- (existing images are moved out of database by: python -m app.tools.migrate_images)
+
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS profile_picture_key character varying(64);
+
+ALTER TABLE public.recipes ADD COLUMN IF NOT EXISTS recipe_picture_key character varying(64);
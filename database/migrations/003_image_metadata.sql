@@ -0,0 +1,30 @@
+-- MIME type and modification time of images (Content-Type, ETag and Last-Modified of image responses)
+-- Images stored in database before keys were added get their key (sha256) and type here,
+-- type is recognized by file signature (PNG or JPEG, the only allowed formats).
+
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS profile_picture_type character varying(32);
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS profile_picture_updated_at timestamp with time zone;
+
+ALTER TABLE public.recipes ADD COLUMN IF NOT EXISTS recipe_picture_type character varying(32);
+ALTER TABLE public.recipes ADD COLUMN IF NOT EXISTS recipe_picture_updated_at timestamp with time zone;
+
+UPDATE public.users SET
+    profile_picture_key = coalesce(profile_picture_key, encode(sha256(profile_picture), 'hex')),
+    profile_picture_type = CASE WHEN substring(profile_picture FROM 1 FOR 8) = '\x89504e470d0a1a0a'::bytea
+                                THEN 'image/png' ELSE 'image/jpeg' END,
+    profile_picture_updated_at = now()
+WHERE profile_picture IS NOT NULL AND profile_picture_type IS NULL;
+
+UPDATE public.recipes SET
+    recipe_picture_key = coalesce(recipe_picture_key, encode(sha256(recipe_picture), 'hex')),
+    recipe_picture_type = CASE WHEN substring(recipe_picture FROM 1 FOR 8) = '\x89504e470d0a1a0a'::bytea
+                               THEN 'image/png' ELSE 'image/jpeg' END,
+    recipe_picture_updated_at = now()
+WHERE recipe_picture IS NOT NULL AND recipe_picture_type IS NULL;
+
+-- images already moved to image storage (their type is recognized from file signature when served)
+UPDATE public.users SET profile_picture_updated_at = now()
+WHERE profile_picture_key IS NOT NULL AND profile_picture_updated_at IS NULL;
+
+UPDATE public.recipes SET recipe_picture_updated_at = now()
+WHERE recipe_picture_key IS NOT NULL AND recipe_picture_updated_at IS NULL;
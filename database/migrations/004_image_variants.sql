@@ -0,0 +1,17 @@
+-- Derivatives of images (smaller sizes, WebP) created on upload
+-- (for images uploaded before, run: python -m app.tools.migrate_images --variants)
+
+CREATE TABLE IF NOT EXISTS public.image_variants
+(
+    image_key character varying(64) NOT NULL,
+    variant character varying(16) NOT NULL,
+    variant_key character varying(64) NOT NULL,
+    media_type character varying(32) NOT NULL,
+    data bytea NULL,
+
+    CONSTRAINT pk_image_variants
+        PRIMARY KEY (image_key, variant)
+);
+
+ALTER TABLE IF EXISTS public.image_variants
+    OWNER to postgres;
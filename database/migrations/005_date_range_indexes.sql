@@ -0,0 +1,7 @@
+-- Indexes for date range filters of food list and weight history (and their keyset pagination by time, id)
+-- CONCURRENTLY does not block writes, run outside of transaction
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_foodlist_id_user_time ON public.foodlist (id_user, "time", id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_weightmeasurements_id_user_measure_time
+    ON public.weightmeasurements (id_user, measure_time, id);
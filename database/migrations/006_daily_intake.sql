@@ -0,0 +1,34 @@
+-- Daily totals of food list (rollup), kept up to date by food list endpoints
+-- Days are in DEFAULT_TIME_ZONE of server config ('UTC' below), change it here if it differs.
+-- The transaction at the end rebuilds the rollup from food list, it can be run again anytime
+-- (e.g. after foods were deleted, which removes their food list entries by cascade).
+
+CREATE TABLE IF NOT EXISTS public.daily_intake
+(
+    id_user integer NOT NULL,
+    day date NOT NULL,
+    kcal double precision NOT NULL DEFAULT 0,
+    entries integer NOT NULL DEFAULT 0,
+
+    CONSTRAINT fk_daily_intake_id_user
+        FOREIGN KEY (id_user)
+        REFERENCES users (id)
+        ON DELETE CASCADE,
+
+    CONSTRAINT pk_daily_intake
+        PRIMARY KEY (id_user, day)
+);
+
+ALTER TABLE IF EXISTS public.daily_intake
+    OWNER to postgres;
+
+BEGIN;
+
+DELETE FROM public.daily_intake;
+
+INSERT INTO public.daily_intake (id_user, day, kcal, entries)
+SELECT foodlist.id_user, date(timezone('UTC', foodlist."time")), sum(food.kcal_100g * foodlist.amount / 100), count(*)
+FROM public.foodlist JOIN public.food ON food.id = foodlist.id_food
+GROUP BY foodlist.id_user, date(timezone('UTC', foodlist."time"));
+
+COMMIT;
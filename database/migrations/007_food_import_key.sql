@@ -0,0 +1,7 @@
+-- Source dataset and id of imported foods, unique index is the upsert key of app.tools.import_foods
+-- Adding nullable columns does not rewrite the table, CONCURRENTLY does not block writes, run outside of transaction
+
+ALTER TABLE public.food ADD COLUMN IF NOT EXISTS source character varying(32);
+ALTER TABLE public.food ADD COLUMN IF NOT EXISTS external_id character varying(64);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_food_source_external_id ON public.food (source, external_id);
@@ -1,3 +1,5 @@
+DROP TABLE IF EXISTS public.daily_intake;
+DROP TABLE IF EXISTS public.image_variants;
 DROP TABLE IF EXISTS public.foodlist;
 DROP TABLE IF EXISTS public.weightmeasurements;
 DROP TABLE IF EXISTS public.recipes;
@@ -12,6 +14,9 @@ DROP SEQUENCE IF EXISTS recipes_id_seq;
 DROP SEQUENCE IF EXISTS food_id_seq;
 
 
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+
 CREATE SEQUENCE users_id_seq START WITH 1;
 CREATE SEQUENCE foodlist_id_seq START WITH 1;
 CREATE SEQUENCE weightmeasurements_id_seq START WITH 1;
@@ -25,6 +30,9 @@ CREATE TABLE public.users
     email character varying NOT NULL UNIQUE,
     password character varying NOT NULL,
     profile_picture bytea,
+    profile_picture_key character varying(64),
+    profile_picture_type character varying(32),
+    profile_picture_updated_at timestamp with time zone,
     first_name character varying(50) NOT NULL,
     last_name character varying(50) NOT NULL,
     gender smallint NOT NULL,
@@ -67,12 +75,18 @@ CREATE TABLE public.weightmeasurements
         PRIMARY KEY (id, id_user)
 );
 
+-- measurements of user in date range, ordered by time (keyset pagination)
+CREATE INDEX idx_weightmeasurements_id_user_measure_time ON public.weightmeasurements (id_user, measure_time, id);
+
 
 CREATE TABLE IF NOT EXISTS public.recipes
 (
     id int NOT NULL DEFAULT nextval('recipes_id_seq'),
     id_user integer NOT NULL DEFAULT 0,
     recipe_picture bytea NULL,
+    recipe_picture_key character varying(64) NULL,
+    recipe_picture_type character varying(32) NULL,
+    recipe_picture_updated_at timestamp with time zone NULL,
     title character varying(80) NOT NULL,
     ingredients text NOT NULL,
     instructions text NOT NULL,
@@ -99,6 +113,8 @@ CREATE TABLE public.food
     id int NOT NULL DEFAULT nextval('food_id_seq'),
     title character varying(80) NOT NULL,
     kcal_100g double precision NOT NULL CHECK(kcal_100g > 0),
+    source character varying(32),
+    external_id character varying(64),
 
     CONSTRAINT positive_kcal_100g_in_food CHECK (kcal_100g > 0),
     CONSTRAINT food_title_minimum_characters CHECK (LENGTH(title) >= 2),
@@ -107,6 +123,12 @@ CREATE TABLE public.food
         PRIMARY KEY (id)
 );
 
+-- trigram index for food title search (LIKE '%x%' and similarity operators)
+CREATE INDEX idx_food_title_trgm ON public.food USING gin (lower(title) gin_trgm_ops);
+
+-- imported food is identified by its source dataset and id in it (upsert key of app.tools.import_foods)
+CREATE UNIQUE INDEX idx_food_source_external_id ON public.food (source, external_id);
+
 
 CREATE TABLE public.foodlist
 (
@@ -132,6 +154,41 @@ CREATE TABLE public.foodlist
         PRIMARY KEY (id, id_user)
 );
 
+-- food list of user in date range, ordered by time (keyset pagination)
+CREATE INDEX idx_foodlist_id_user_time ON public.foodlist (id_user, "time", id);
+
+
+-- daily totals of food list (rollup), day is in DEFAULT_TIME_ZONE of server config
+CREATE TABLE public.daily_intake
+(
+    id_user integer NOT NULL,
+    day date NOT NULL,
+    kcal double precision NOT NULL DEFAULT 0,
+    entries integer NOT NULL DEFAULT 0,
+
+    CONSTRAINT fk_daily_intake_id_user
+        FOREIGN KEY (id_user)
+        REFERENCES users (id)
+        ON DELETE CASCADE,
+
+    CONSTRAINT pk_daily_intake
+        PRIMARY KEY (id_user, day)
+);
+
+
+-- derivatives of images (smaller sizes, WebP), image_key is key of original image
+CREATE TABLE public.image_variants
+(
+    image_key character varying(64) NOT NULL,
+    variant character varying(16) NOT NULL,
+    variant_key character varying(64) NOT NULL,
+    media_type character varying(32) NOT NULL,
+    data bytea NULL,
+
+    CONSTRAINT pk_image_variants
+        PRIMARY KEY (image_key, variant)
+);
+
 
 ALTER TABLE IF EXISTS public.users
     OWNER to postgres;
@@ -146,4 +203,10 @@ ALTER TABLE IF EXISTS public.food
     OWNER to postgres;
 
 ALTER TABLE IF EXISTS public.foodlist
+    OWNER to postgres;
+
+ALTER TABLE IF EXISTS public.image_variants
+    OWNER to postgres;
+
+ALTER TABLE IF EXISTS public.daily_intake
     OWNER to postgres;
\ No newline at end of file
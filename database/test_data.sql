@@ -64,4 +64,10 @@ INSERT INTO foodlist (id_user, id_food, amount, time)
         (3, 7, 20, now()),
         (7, 1, 1, now()),
         (7, 6, 20, now()),
-        (4, 4, 5, now());
\ No newline at end of file
+        (4, 4, 5, now());
+
+-- daily totals of the food list above, same rebuild as database/migrations/006_daily_intake.sql
+INSERT INTO daily_intake (id_user, day, kcal, entries)
+SELECT foodlist.id_user, date(timezone('UTC', foodlist."time")), sum(food.kcal_100g * foodlist.amount / 100), count(*)
+FROM foodlist JOIN food ON food.id = foodlist.id_food
+GROUP BY foodlist.id_user, date(timezone('UTC', foodlist."time"));
@@ -0,0 +1,7 @@
+import os
+
+# settings required by app.config, tests below do not connect to database
+for name, value in {'DATABASE_HOSTNAME': 'localhost', 'DATABASE_PORT': '5432', 'DATABASE_PASSWORD': 'test',
+                    'DATABASE_NAME': 'test', 'DATABASE_USERNAME': 'test', 'SECRET': 'test', 'ALGORITHM': 'HS256',
+                    'ACCESS_TOKEN_EXPIRE_MINUTES': '30'}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,44 @@
+from app.cache import TTLCache
+
+import time
+
+
+def test_entry_expires_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    cache = TTLCache(10, 5)
+    cache.set('user', 1)
+    now[0] = 105.0      # expires after ttl, not at it
+    assert cache.get('user') == 1
+    now[0] = 105.5
+    assert cache.get('user') is None
+    assert 'user' not in cache.entries
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_is_removed():
+    cache = TTLCache(2, 60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # b is now least recently used
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+
+def test_zero_ttl_or_size_disables_cache():
+    for cache in (TTLCache(10, 0), TTLCache(0, 60)):
+        cache.set('a', 1)
+        assert cache.get('a') is None
+        assert cache.stats()['size'] == 0
+
+
+def test_invalidate_and_clear():
+    cache = TTLCache(10, 60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.invalidate('a')
+    cache.invalidate('missing')
+    assert cache.get('a') is None and cache.get('b') == 2
+    cache.clear()
+    assert cache.get('b') is None
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+from sqlalchemy import column
+from sqlalchemy.dialects import postgresql
+
+from app.dates import DateRange
+
+import pytest
+
+
+def date_range(date=None, from_=None, to=None, tz_name=None) -> DateRange:    # as created by Depends()
+    return DateRange(date, from_, to, tz_name)
+
+
+def bounds(dates: DateRange):
+    conditions = dates.where(column('time'))
+    return [(condition.operator.__name__, condition.right.value) for condition in conditions]
+
+
+def test_single_day_is_half_open_range():
+    dates = date_range(date='2022-04-01', tz_name='UTC')
+    assert dates.valid
+    assert bounds(dates) == [('ge', datetime(2022, 4, 1, tzinfo=timezone.utc)),
+                             ('lt', datetime(2022, 4, 2, tzinfo=timezone.utc))]
+
+
+def test_range_includes_last_day():
+    dates = date_range(from_='2022-04-01', to='2022-04-03', tz_name='UTC')
+    start, end = (value for _, value in bounds(dates))
+    assert end - start == timedelta(days=3)
+
+
+def test_open_ranges_have_one_bound():
+    assert [op for op, _ in bounds(date_range(from_='2022-04-01'))] == ['ge']
+    assert [op for op, _ in bounds(date_range(to='2022-04-01'))] == ['lt']
+    assert bounds(date_range()) == []
+
+
+def test_days_start_at_midnight_of_client_time_zone():
+    dates = date_range(date='2022-04-01', tz_name='Europe/Bratislava')
+    start, end = (value.astimezone(timezone.utc) for _, value in bounds(dates))
+    assert start == datetime(2022, 3, 31, 22, tzinfo=timezone.utc)     # CEST is UTC+2
+    assert end == datetime(2022, 4, 1, 22, tzinfo=timezone.utc)
+
+
+def test_daylight_saving_day_has_23_hours():
+    dates = date_range(date='2022-03-27', tz_name='Europe/Bratislava')
+    start, end = (value.astimezone(timezone.utc) for _, value in bounds(dates))
+    assert end - start == timedelta(hours=23)
+
+
+def test_unknown_time_zone_is_400():
+    with pytest.raises(HTTPException) as e:
+        date_range(date='2022-04-01', tz_name='Mars/Olympus')
+    assert e.value.status_code == 400
+
+
+@pytest.mark.parametrize('params', [{'date': 'not a date'}, {'from_': '2022-13-45'}, {'to': 'tomorrow-ish'}])
+def test_invalid_date_matches_nothing(params):
+    assert not date_range(**params).valid
+
+
+def test_conditions_are_sargable():
+    dates = date_range(from_='2022-04-01', to='2022-04-02', tz_name='UTC')
+    sql = [str(condition.compile(dialect=postgresql.dialect())) for condition in dates.where(column('time'))]
+    assert sql == ['time >= %(time_1)s', 'time < %(time_1)s']     # column compared directly, not a function of it
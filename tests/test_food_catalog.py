@@ -0,0 +1,91 @@
+from app.food_catalog import CatalogSnapshot, trigrams
+from app.pagination import decode_cursor
+
+# (id, title, kcal_100g) of small food table
+FOODS = [(1, 'Eggplant', 25.0), (2, 'Boiled egg white', 52.0), (3, 'Egg', 155.0), (4, 'Rice', 130.0),
+         (5, 'Fried egg', 196.0), (6, 'Veggie burger', 177.0)]
+
+# order of food_search_query in database for title 'egg' (pg_trgm word_similarity desc, similarity desc, id):
+#   3 Egg              word_similarity 1.0,  similarity 1.0
+#   5 Fried egg        word_similarity 1.0,  similarity 4/10
+#   2 Boiled egg white word_similarity 1.0,  similarity 4/17
+#   1 Eggplant         word_similarity 0.75, similarity 3/10
+#   6 Veggie burger    word_similarity 1/4,  similarity 1/17
+SQL_ORDER_EGG = [3, 5, 2, 1, 6]
+
+
+def ids(foods):
+    return [item['id'] for item in foods]
+
+
+def test_substring_order_matches_database():
+    answer, next_cursor, total = CatalogSnapshot(FOODS).search('egg', total=True)
+    assert ids(answer) == SQL_ORDER_EGG
+    assert next_cursor is None
+    assert total == len(SQL_ORDER_EGG)
+
+
+def test_substring_pages_follow_database_order():
+    snapshot = CatalogSnapshot(FOODS)
+    pages = []
+    answer, next_cursor, _ = snapshot.search('egg', limit=2)
+    pages.extend(ids(answer))
+    while next_cursor is not None:
+        answer, next_cursor, _ = snapshot.search('egg', limit=2, after=decode_cursor(next_cursor, float, float, int))
+        pages.extend(ids(answer))
+    assert pages == SQL_ORDER_EGG
+
+
+def test_empty_title_returns_every_food_by_id():
+    answer, _, _ = CatalogSnapshot(FOODS).search('')
+    assert ids(answer) == [1, 2, 3, 4, 5, 6]
+
+
+# fuzzy 'eggs' (word_similarity >= 0.6), every match shares 3 of 5 trigrams of 'eggs':
+#   3 Egg 0.6, 3/6   1 Eggplant 0.6, 3/11   5 Fried egg 0.6, 3/12   2 Boiled egg white 0.6, 3/19
+SQL_ORDER_EGGS_FUZZY = [3, 1, 5, 2]
+
+# substring 'eg' (shorter than 3 characters), word_similarity and similarity with trigrams '  e', ' eg', 'eg ':
+#   3 Egg 2/3, 2/5   1 Eggplant 2/3, 2/10   5 Fried egg 2/3, 2/11   2 Boiled egg white 2/3, 2/18
+#   6 Veggie burger 0, 0 (contains 'eg', but shares no trigram)
+SQL_ORDER_EG = [3, 1, 5, 2, 6]
+
+
+def all_pages(snapshot, title, fuzzy, limit):
+    found = []
+    answer, next_cursor, _ = snapshot.search(title, fuzzy, limit=limit)
+    found.extend(ids(answer))
+    while next_cursor is not None:
+        after = decode_cursor(next_cursor, float, float, int)
+        answer, next_cursor, _ = snapshot.search(title, fuzzy, limit=limit, after=after)
+        found.extend(ids(answer))
+    return found
+
+
+def test_fuzzy_order_matches_database():
+    answer, _, total = CatalogSnapshot(FOODS).search('eggs', fuzzy=True, total=True)
+    assert ids(answer) == SQL_ORDER_EGGS_FUZZY
+    assert total == len(SQL_ORDER_EGGS_FUZZY)
+    assert all_pages(CatalogSnapshot(FOODS), 'eggs', True, 3) == SQL_ORDER_EGGS_FUZZY
+
+
+def test_fuzzy_candidates_use_padded_trigrams():
+    # 'ox p' shares only word boundary trigrams ('  o', ' ox', 'ox ') with 'Ox' and 'Tea ox', pg_trgm matches them:
+    #   1 Ox 0.6, 3/5   3 Tea ox 0.6, 3/9   2 Ox tail 0.6, 3/10
+    snapshot = CatalogSnapshot([(1, 'Ox', 1.0), (2, 'Ox tail', 1.0), (3, 'Tea ox', 1.0), (4, 'Tea', 1.0)])
+    assert ids(snapshot.search('ox p', fuzzy=True)[0]) == [1, 3, 2]
+
+
+def test_short_title_order_matches_database():
+    answer, _, total = CatalogSnapshot(FOODS).search('eg', total=True)
+    assert ids(answer) == SQL_ORDER_EG
+    assert total == len(SQL_ORDER_EG)
+    # pages continue from ranked matches to zero similarity ones
+    assert all_pages(CatalogSnapshot(FOODS), 'eg', False, 2) == SQL_ORDER_EG
+    assert all_pages(CatalogSnapshot(FOODS), 'e', False, 1) == ids(CatalogSnapshot(FOODS).search('e')[0])
+
+
+def test_short_title_does_not_rank_every_food():
+    # only foods sharing a trigram with 'eg' are ranked (Eggplant, Boiled egg white, Egg, Fried egg positions)
+    snapshot = CatalogSnapshot(FOODS)
+    assert snapshot.candidates('eg', trigrams('eg'), False) == {0, 1, 2, 4}
@@ -0,0 +1,41 @@
+from app.metrics import Counter, Histogram
+
+
+def test_counter_renders_one_line_per_label_values():
+    counter = Counter('http_requests_total', 'Finished HTTP requests.', ('method', 'route', 'status'))
+    counter.inc(('GET', '/food/', '200'))
+    counter.inc(('GET', '/food/', '200'))
+    counter.inc(('POST', '/foodlist/', '403'), 2)
+    assert counter.render() == [
+        '# HELP http_requests_total Finished HTTP requests.',
+        '# TYPE http_requests_total counter',
+        'http_requests_total{method="GET",route="/food/",status="200"} 2',
+        'http_requests_total{method="POST",route="/foodlist/",status="403"} 2',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('latency_seconds', 'Latency.', ('route',), (0.1, 0.5, 1))
+    for value in (0.05, 0.1, 0.3, 0.7, 3):   # bounds are inclusive, 3 is only in +Inf
+        histogram.observe(('/food/',), value)
+    assert histogram.render() == [
+        '# HELP latency_seconds Latency.',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{route="/food/",le="0.1"} 2',
+        'latency_seconds_bucket{route="/food/",le="0.5"} 3',
+        'latency_seconds_bucket{route="/food/",le="1"} 4',
+        'latency_seconds_bucket{route="/food/",le="+Inf"} 5',
+        'latency_seconds_sum{route="/food/"} 4.15',
+        'latency_seconds_count{route="/food/"} 5',
+    ]
+
+
+def test_label_values_are_escaped():
+    counter = Counter('messages_total', 'Messages.', ('route',))
+    counter.inc(('/a"b\\c\nd',))
+    assert counter.render()[-1] == 'messages_total{route="/a\\"b\\\\c\\nd"} 1'
+
+
+def test_metric_without_observations_renders_only_header():
+    histogram = Histogram('empty_seconds', 'Nothing yet.', ('route',), (1,))
+    assert histogram.render() == ['# HELP empty_seconds Nothing yet.', '# TYPE empty_seconds histogram']
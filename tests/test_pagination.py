@@ -0,0 +1,78 @@
+from datetime import date, datetime, timezone
+from fastapi import HTTPException
+from sqlalchemy import column
+from sqlalchemy.dialects import postgresql
+
+from app.pagination import Keyset, decode_cursor, encode_cursor
+
+import base64
+import json
+import pytest
+
+
+def test_cursor_round_trip():
+    time = datetime(2022, 4, 1, 12, 30, tzinfo=timezone.utc)
+    assert decode_cursor(encode_cursor(0.6, 0.25, 42), float, float, int) == (0.6, 0.25, 42)
+    assert decode_cursor(encode_cursor(time, 7), datetime, int) == (time, 7)
+    assert decode_cursor(encode_cursor(date(2022, 4, 1)), date) == (date(2022, 4, 1),)
+
+
+def test_cursor_is_url_safe_without_padding():
+    cursor = encode_cursor('?&/+=' * 5, 1)
+    assert '=' not in cursor and '+' not in cursor and '/' not in cursor
+    assert decode_cursor(cursor, str, int) == ('?&/+=' * 5, 1)
+
+
+def b64(values) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+@pytest.mark.parametrize('cursor, types', [
+    ('not base64 !', (float, int)),
+    (base64.urlsafe_b64encode(b'not json').decode(), (float, int)),
+    (b64([1]), (float, int)),                       # wrong number of values
+    (b64(['x', 1]), (float, int)),                  # wrong type
+    (b64(['yesterday', 1]), (datetime, int)),       # not a time
+])
+def test_tampered_cursor_is_400(cursor, types):
+    with pytest.raises(HTTPException) as e:
+        decode_cursor(cursor, *types)
+    assert e.value.status_code == 400
+
+
+def rows(*ids):     # rows of query with one selected column and one sort key column
+    return [(f"item {i}", i) for i in ids]
+
+
+def test_page_with_more_rows_returns_cursor_of_last_item():
+    keyset = Keyset((column('id'), False))
+    items, next_cursor = keyset.page(rows(1, 2, 3), 2)   # limit + 1 rows were fetched
+    assert items == ['item 1', 'item 2']
+    assert decode_cursor(next_cursor, int) == (2,)
+
+
+def test_last_page_has_no_cursor():
+    keyset = Keyset((column('id'), False))
+    assert keyset.page(rows(1, 2), 2) == (['item 1', 'item 2'], None)
+    assert keyset.page([], 2) == ([], None)
+
+
+def test_page_of_rows_with_several_columns_keeps_rows():
+    keyset = Keyset((column('time'), True), (column('id'), False))
+    items, next_cursor = keyset.page([('a', 1.5, 't2', 5), ('b', 2.5, 't1', 4)], 1)
+    assert items == [('a', 1.5, 't2', 5)]
+    assert decode_cursor(next_cursor, str, int) == ('t2', 5)
+
+
+def compiled(query) -> str:
+    return str(query.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+
+
+def test_same_direction_keys_use_row_comparison():
+    keyset = Keyset((column('score'), True), (column('id'), True))
+    assert compiled(keyset.after((0.5, 10))) == '(score, id) < (0.5, 10)'
+
+
+def test_mixed_direction_keys_expand_to_or():
+    keyset = Keyset((column('score'), True), (column('id'), False))
+    assert compiled(keyset.after((0.5, 10))) == 'score < 0.5 OR score = 0.5 AND id > 10'
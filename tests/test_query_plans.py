@@ -0,0 +1,34 @@
+from sqlalchemy.exc import OperationalError
+
+from app.database import engine
+from app.dates import DateRange
+from benchmarks.query_plans import check, disable_seqscan, plan_checks
+
+import json
+import pytest
+
+# EXPLAIN of endpoint queries against database configured in .env (with tables.sql schema),
+# skipped when the database is not reachable
+
+DATES = DateRange(date=None, from_='2022-04-01', to='2022-04-07', tz_name=None)
+CHECKS = plan_checks(1, DATES)
+
+
+@pytest.fixture(scope='module')
+def connection():
+    try:
+        connection = engine.connect()
+    except OperationalError as e:
+        pytest.skip(f"database is not reachable: {e.orig}")
+
+    with connection:
+        with connection.begin():
+            disable_seqscan(connection)     # small test databases are cheaper to scan whole
+            yield connection
+
+
+@pytest.mark.parametrize('name, query, index, column', CHECKS, ids=[name for name, *_ in CHECKS])
+def test_query_uses_index(connection, name, query, index, column):
+    result = check(connection, name, query, index, column)
+    assert result['index_used'], f"{index} not used:\n{json.dumps(result['plan'], indent=2)}"
+    assert result['range_in_index_cond'], f"{column} not in index condition:\n{json.dumps(result['plan'], indent=2)}"
@@ -0,0 +1,118 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.storage import FileSystemStore, cache_headers, content_key, file_response, not_modified
+from datetime import datetime, timezone
+
+import pytest
+
+DATA = bytes(range(256)) * 4    # 1024 bytes
+
+
+@pytest.fixture
+def client(tmp_path):
+    store = FileSystemStore(str(tmp_path))
+    key = store.put(DATA)
+    app = FastAPI()
+
+    @app.get('/image')
+    def image(request: Request):
+        return file_response(request, store.path(key), 'image/png', {'ETag': f'"{key}"'})
+
+    return TestClient(app)
+
+
+def test_store_is_content_addressed(tmp_path):
+    store = FileSystemStore(str(tmp_path))
+    key = store.put(DATA)
+    assert key == content_key(DATA) and store.put(DATA) == key
+    assert store.path(key).read_bytes() == DATA
+    assert list(store.keys()) == [key]
+
+
+def test_whole_file_without_range(client):
+    response = client.get('/image')
+    assert response.status_code == 200
+    assert response.content == DATA
+    assert response.headers['accept-ranges'] == 'bytes'
+    assert response.headers['etag'] == f'"{content_key(DATA)}"'
+
+
+@pytest.mark.parametrize('header, start, end', [
+    ('bytes=0-99', 0, 99),
+    ('bytes=1000-', 1000, 1023),
+    ('bytes=-24', 1000, 1023),      # suffix range, last 24 bytes
+    ('bytes=1000-5000', 1000, 1023),    # end past the file is cut to its size
+    ('bytes=-5000', 0, 1023),
+])
+def test_byte_range(client, header, start, end):
+    response = client.get('/image', headers={'Range': header})
+    assert response.status_code == 206
+    assert response.content == DATA[start:end + 1]
+    assert response.headers['content-range'] == f"bytes {start}-{end}/1024"
+    assert response.headers['content-length'] == str(end - start + 1)
+
+
+@pytest.mark.parametrize('header', ['bytes=1024-', 'bytes=2000-3000', 'bytes=50-10'])
+def test_unsatisfiable_range_is_416(client, header):
+    response = client.get('/image', headers={'Range': header})
+    assert response.status_code == 416
+    assert response.headers['content-range'] == 'bytes */1024'
+
+
+@pytest.mark.parametrize('header', ['bytes=0-1,5-9', 'items=0-10', 'bytes=-'])
+def test_unsupported_range_returns_whole_file(client, header):
+    response = client.get('/image', headers={'Range': header})
+    assert response.status_code == 200
+    assert response.content == DATA
+
+
+KEY = content_key(DATA)
+UPDATED_AT = datetime(2022, 4, 1, 12, 30, 15, 500000, tzinfo=timezone.utc)
+LAST_MODIFIED = 'Fri, 01 Apr 2022 12:30:15 GMT'
+
+
+def conditional_request(**headers) -> Request:
+    return Request({'type': 'http', 'headers': [(name.replace('_', '-').encode(), value.encode())
+                                                for name, value in headers.items()]})
+
+
+def test_cache_headers_use_key_as_etag():
+    headers = cache_headers(KEY, UPDATED_AT)
+    assert headers['ETag'] == f'"{KEY}"'
+    assert headers['Last-Modified'] == LAST_MODIFIED
+    assert 'Last-Modified' not in cache_headers(KEY, None)
+
+
+@pytest.mark.parametrize('if_none_match, expected', [
+    (f'"{KEY}"', True),
+    (f'W/"{KEY}"', True),
+    (f'"other", "{KEY}"', True),
+    ('*', True),
+    ('"other"', False),
+    (KEY, False),   # unquoted tag is not the ETag
+])
+def test_if_none_match(if_none_match, expected):
+    assert not_modified(conditional_request(if_none_match=if_none_match), KEY, UPDATED_AT) is expected
+
+
+@pytest.mark.parametrize('if_modified_since, expected', [
+    (LAST_MODIFIED, True),  # Last-Modified has whole seconds
+    ('Sat, 02 Apr 2022 00:00:00 GMT', True),
+    ('Fri, 01 Apr 2022 12:30:14 GMT', False),
+    ('yesterday', False),
+])
+def test_if_modified_since(if_modified_since, expected):
+    assert not_modified(conditional_request(if_modified_since=if_modified_since), KEY, UPDATED_AT) is expected
+
+
+def test_if_none_match_takes_precedence_over_if_modified_since():
+    changed = conditional_request(if_none_match='"other"', if_modified_since=LAST_MODIFIED)
+    assert not not_modified(changed, KEY, UPDATED_AT)
+    same = conditional_request(if_none_match=f'"{KEY}"', if_modified_since='Thu, 01 Jan 1970 00:00:00 GMT')
+    assert not_modified(same, KEY, UPDATED_AT)
+
+
+def test_without_conditions_or_time_image_is_sent():
+    assert not not_modified(conditional_request(), KEY, UPDATED_AT)
+    assert not not_modified(conditional_request(if_modified_since=LAST_MODIFIED), KEY, None)
@@ -0,0 +1,61 @@
+from pydantic import BaseModel
+
+from app.streaming import encode_batches
+
+import asyncio
+import json
+
+
+class Item(BaseModel):
+    id: int
+    title: str
+
+    class Config:
+        orm_mode = True
+
+
+class Row:  # entity read by ORM
+    def __init__(self, id, title):
+        self.id = id
+        self.title = title
+
+
+async def batches(*items):
+    for batch in items:
+        yield batch
+
+
+def encode(*items, ndjson=False) -> list:
+    async def chunks():
+        return [chunk async for chunk in encode_batches(batches(*items), Item, ndjson)]
+
+    return asyncio.run(chunks())
+
+
+BATCHES = ([Row(1, 'Egg'), Row(2, 'Rice')], [], [{'id': 3, 'title': 'Tea, "green"'}])
+
+
+def test_json_array_is_one_chunk_per_batch():
+    chunks = encode(*BATCHES)
+    assert chunks == ['[', '{"id": 1, "title": "Egg"},{"id": 2, "title": "Rice"}',
+                      ',{"id": 3, "title": "Tea, \\"green\\""}', ']']
+    assert json.loads(''.join(chunks)) == [{'id': 1, 'title': 'Egg'}, {'id': 2, 'title': 'Rice'},
+                                           {'id': 3, 'title': 'Tea, "green"'}]
+
+
+def test_empty_result_is_empty_array():
+    assert json.loads(''.join(encode())) == []
+    assert json.loads(''.join(encode([], []))) == []
+
+
+def test_ndjson_is_one_object_per_line():
+    body = ''.join(encode(*BATCHES, ndjson=True))
+    assert body.endswith('\n')
+    assert [json.loads(line) for line in body.splitlines()] == [
+        {'id': 1, 'title': 'Egg'}, {'id': 2, 'title': 'Rice'}, {'id': 3, 'title': 'Tea, "green"'}]
+    assert encode(ndjson=True) == []
+
+
+def test_items_are_validated_by_schema():
+    chunks = encode([{'id': '4', 'title': 'Milk', 'kcal_100g': 42}])
+    assert json.loads(''.join(chunks)) == [{'id': 4, 'title': 'Milk'}]     # converted, extra fields dropped
@@ -0,0 +1,98 @@
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+from starlette.datastructures import UploadFile as StarletteUploadFile
+
+from app.uploads import UploadSizeLimit, read_upload
+
+import asyncio
+import io
+import pytest
+
+MAX_SIZE = 1000
+BOUNDARY = 'limit-test'
+
+
+def multipart(size: int) -> bytes:
+    return (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="picture"; filename="a.png"\r\n'
+            f'Content-Type: image/png\r\n\r\n').encode() + b'x' * size + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+def chunked(body: bytes, chunk: int = 100):     # body without Content-Length, counted while received
+    for start in range(0, len(body), chunk):
+        yield body[start:start + chunk]
+
+
+@pytest.fixture
+def handled():
+    return []   # sizes of uploads which reached the endpoint
+
+
+@pytest.fixture
+def client(handled):
+    app = FastAPI()
+
+    @app.post('/upload')
+    async def upload(picture: UploadFile = File(...)):
+        handled.append(len(await picture.read()))
+        return {'size': handled[-1]}
+
+    return TestClient(UploadSizeLimit(app, MAX_SIZE))
+
+
+def post(client, body, **headers):
+    return client.post('/upload', data=body, headers={'Content-Type': f'multipart/form-data; boundary={BOUNDARY}',
+                                                      **headers})
+
+
+def test_small_upload_passes(client, handled):
+    assert post(client, multipart(100)).json() == {'size': 100}
+    assert post(client, chunked(multipart(100))).json() == {'size': 100}
+    assert handled == [100, 100]
+
+
+def test_declared_length_over_limit_is_rejected_before_reading(client, handled):
+    response = post(client, multipart(2000))
+    assert response.status_code == 413
+    assert handled == []
+
+
+def test_streamed_body_over_limit_is_413_and_never_handled(client, handled):
+    response = post(client, chunked(multipart(5000)))
+    assert response.status_code == 413
+    assert 'Image too large' in response.json()['detail']
+    assert handled == []    # endpoint does not run with truncated form
+
+
+def test_received_messages_after_limit_are_disconnects():
+    seen = []
+
+    async def app(scope, receive, send):
+        for _ in range(4):
+            seen.append(await receive())
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'x' * 600, 'more_body': True}
+
+    async def send(message):
+        seen.append(message['type'])
+
+    scope = {'type': 'http', 'method': 'POST', 'headers': [(b'content-type', b'multipart/form-data; boundary=a')]}
+    asyncio.run(UploadSizeLimit(app, MAX_SIZE)(scope, receive, send))
+    assert [message['type'] for message in seen[:4]] == ['http.request'] + ['http.disconnect'] * 3
+    assert seen[4:] == ['http.response.start', 'http.response.body']
+
+
+def test_other_requests_are_not_limited(client):
+    response = client.post('/upload', data=b'x' * 5000, headers={'Content-Type': 'application/octet-stream'})
+    assert response.status_code == 422     # reached the endpoint, not rejected by the limit
+
+
+def upload(size: int) -> StarletteUploadFile:
+    return StarletteUploadFile('a.png', io.BytesIO(b'x' * size))
+
+
+def test_read_upload_is_limited():
+    assert len(asyncio.run(read_upload(upload(MAX_SIZE), MAX_SIZE))) == MAX_SIZE
+    with pytest.raises(Exception) as e:
+        asyncio.run(read_upload(upload(MAX_SIZE + 1), MAX_SIZE))
+    assert e.value.status_code == 413
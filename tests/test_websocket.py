@@ -0,0 +1,79 @@
+from fastapi import HTTPException, WebSocketDisconnect
+
+from app.websocket import ws_query, ws_search_loop
+
+import asyncio
+
+
+class FakeWebSocket:     # messages are received after given delays (seconds), sent responses are collected
+    def __init__(self, *messages):
+        self.messages = list(messages)
+        self.sent = []
+
+    async def receive_text(self):
+        if not self.messages:
+            await asyncio.sleep(0.3)    # client waits for answers, then disconnects
+            raise WebSocketDisconnect()
+        delay, message = self.messages.pop(0)
+        await asyncio.sleep(delay)
+        return message
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+
+class FakeSession:
+    def __init__(self):
+        self.rollbacks = 0
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+def run_loop(websocket, search):
+    db = FakeSession()
+    asyncio.run(ws_search_loop(websocket, db, search))
+    return db
+
+
+def test_superseded_search_is_cancelled():
+    started, cancelled = [], []
+
+    async def search(query):
+        started.append(query)
+        try:
+            await asyncio.sleep(0.1)
+        except asyncio.CancelledError:
+            cancelled.append(query)
+            raise
+        return [query], None
+
+    websocket = FakeWebSocket((0, 'e'), (0.02, 'eg'), (0.02, 'egg'))
+    db = run_loop(websocket, search)
+
+    assert started == ['e', 'eg', 'egg']
+    assert cancelled == ['e', 'eg']
+    assert websocket.sent == [{'status_code': 200, 'detail': ['egg'], 'next': None}]
+    assert db.rollbacks == 3    # cancelled searches end their transaction too
+
+
+def test_every_finished_search_is_answered():
+    async def search(query):
+        if query == 'bad':
+            raise HTTPException(status_code=400, detail='Invalid cursor')
+        return [query], 'cursor'
+
+    websocket = FakeWebSocket((0, 'rice'), (0.05, 'bad'))
+    run_loop(websocket, search)
+
+    assert websocket.sent == [{'status_code': 200, 'detail': ['rice'], 'next': 'cursor'},
+                              {'status_code': 400, 'detail': 'Invalid cursor'}]
+
+
+def test_ws_query_parses_plain_text_and_json():
+    title, page, params = ws_query('egg', 'title')
+    assert (title, page.after, params) == ('egg', None, {})
+
+    title, page, params = ws_query('{"title": "egg", "limit": 100000, "after": "abc"}', 'title')
+    assert title == 'egg' and page.after == 'abc' and params['title'] == 'egg'
+    assert page.limit <= 1000
@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+
+from app.workers import BoundedPool
+
+import asyncio
+import pytest
+import threading
+
+
+def thread_pool(workers, max_queue):
+    return BoundedPool('test', lambda n: ThreadPoolExecutor(max_workers=n), workers, max_queue)
+
+
+def test_full_queue_rejects_with_503():
+    pool = thread_pool(1, 1)
+    release = threading.Event()
+
+    async def scenario():
+        running = [asyncio.create_task(pool.run(release.wait)) for _ in range(2)]     # 1 running, 1 queued
+        await asyncio.sleep(0.05)
+        assert pool.pending == 2
+
+        with pytest.raises(HTTPException) as e:
+            await pool.run(release.wait)
+        assert e.value.status_code == 503
+        assert e.value.headers == {'Retry-After': '1'}
+
+        release.set()
+        assert await asyncio.gather(*running) == [True, True]
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        release.set()
+        pool.shutdown()
+    assert pool.stats() == {'workers': 1, 'max_queue': 1, 'pending': 0, 'rejected': 1}
+
+
+def test_pending_is_released_when_task_fails():
+    pool = thread_pool(1, 0)
+
+    def fail():
+        raise ValueError('bad image')
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            await pool.run(fail)
+        return await pool.run(sum, [1, 2])
+
+    try:
+        assert asyncio.run(scenario()) == 3
+    finally:
+        pool.shutdown()
+    assert pool.pending == 0 and pool.rejected == 0
+
+
+def test_executor_is_created_on_first_use():
+    pool = thread_pool(2, 0)
+    assert pool.executor is None
+    try:
+        assert asyncio.run(pool.run(max, 1, 2)) == 2
+        assert pool.executor is not None
+    finally:
+        pool.shutdown()
+    assert pool.executor is None
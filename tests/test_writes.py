@@ -0,0 +1,86 @@
+from fastapi import HTTPException
+from sqlalchemy.exc import DBAPIError, IntegrityError, OperationalError
+
+from app.writes import write_errors
+
+import asyncio
+import pytest
+
+
+class DatabaseError(Exception):     # driver error with SQLSTATE code
+    def __init__(self, message, pgcode):
+        super().__init__(message)
+        self.pgcode = pgcode
+
+
+class FakeSession:
+    def __init__(self):
+        self.rollbacks = 0
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+def driver_error(error_class, message, pgcode):
+    orig = DatabaseError(message, pgcode)
+    try:    # SQLAlchemy error caused by the driver error, as raised by execute
+        raise error_class('INSERT ...', {}, orig) from orig
+    except error_class as e:
+        return e
+
+
+def write(db, error, ex_unique=None):
+    async def failing_write():
+        async with write_errors(db, ex_unique):
+            raise error
+
+    asyncio.run(failing_write())
+
+
+FK_VIOLATION = 'insert or update on table "foodlist" violates foreign key constraint "fk_foodlist_id_food"'
+
+
+def test_constraint_violation_is_403_and_rolled_back():
+    db = FakeSession()
+    with pytest.raises(HTTPException) as e:
+        write(db, driver_error(IntegrityError, FK_VIOLATION, '23503'))
+    assert e.value.status_code == 403
+    assert e.value.detail == 'violates foreign key constraint fk_foodlist_id_food'
+    assert db.rollbacks == 1
+
+
+def test_unique_violation_is_given_exception():
+    ex_taken = HTTPException(status_code=409, detail='Email is already taken')
+    db = FakeSession()
+    with pytest.raises(HTTPException) as e:
+        write(db, driver_error(IntegrityError, 'duplicate key value violates unique constraint "users_email_key"',
+                               '23505'), ex_taken)
+    assert e.value is ex_taken
+    assert db.rollbacks == 1
+
+
+def test_data_error_is_403():
+    db = FakeSession()
+    with pytest.raises(HTTPException) as e:
+        write(db, driver_error(DBAPIError, 'value "99999999999" is out of range for type integer', '22003'))
+    assert e.value.status_code == 403
+    assert db.rollbacks == 1
+
+
+def test_other_errors_are_left_to_app_handlers():
+    db = FakeSession()
+    timeout = driver_error(OperationalError, 'canceling statement due to statement timeout', '57014')
+    with pytest.raises(OperationalError):
+        write(db, timeout)
+    assert db.rollbacks == 1    # session is usable again
+
+
+def test_successful_write_is_not_rolled_back():
+    db = FakeSession()
+
+    async def ok_write():
+        async with write_errors(db):
+            return 'written'
+
+    assert asyncio.run(ok_write()) == 'written'
+    assert db.rollbacks == 0